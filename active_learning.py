@@ -15,6 +15,7 @@ from matplotlib import pyplot as plt
 from models.simpleNN_net import * #ThreeLayerNet
 from models.logistic_regression import LogisticRegNet
 from models.set_function_act_learn import SetFunctionFacLoc, SetFunctionTaylor, SetFunctionBatch
+from models.sieve_streaming import SieveStreamingFacLoc
 from sklearn.model_selection import train_test_split
 from utils.custom_dataset import CustomDataset_act,load_dataset_numpy, write_knndata
 from custom_dataset_old import load_dataset_numpy as load_dataset_numpy_old, write_knndata as write_knndata_old
@@ -45,6 +46,7 @@ fraction = float(sys.argv[3])
 num_epochs = int(sys.argv[4])
 no_select = int(sys.argv[5])
 feature = sys.argv[6]
+facloc_method = sys.argv[7] if len(sys.argv) > 7 else 'stochastic'  # or 'sieve', one pass streaming facility location (covertype)
 print_every = 50
 
 learning_rate = 0.05
@@ -209,6 +211,14 @@ def run_stochastic_Facloc(data, targets, budget):
         facloc_indices.extend([sub_indices[idx] for idx in idxs])
     return facloc_indices
 
+def run_sieve_Facloc(data, targets, budget):
+    # one pass sieve streaming facility location, no N x N matrix (models/sieve_streaming.py).
+    # The reference sample is the head of the stream, the pool is streamed in random order.
+    perm = np.random.RandomState(42).permutation(len(data))
+    setf_model = SieveStreamingFacLoc(budget)
+    idxs = setf_model.fit(data[perm[start:start + 4096]] for start in range(0, len(data), 4096))
+    return [perm[idx] for idx in idxs]
+
 def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,fac_loc_idx=None):
     
     torch.manual_seed(42)
@@ -246,7 +256,8 @@ def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,
             setf_model = SetFunctionFacLoc(device, train_batch_size_for_greedy)
             idxs = setf_model.lazy_greedy_max(bud, x_trn,model)
         else:
-            idxs = run_stochastic_Facloc(x_trn, y_trn, bud)
+            idxs = run_sieve_Facloc(x_trn, y_trn, bud) if facloc_method == 'sieve' else \
+                run_stochastic_Facloc(x_trn, y_trn, bud)
 
         facility_loaction_warm_start = copy.deepcopy(idxs)
 
@@ -461,7 +472,8 @@ def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,
         elif func_name == 'Facility Location':
 
             if data_name == 'covertype':
-                new_idxs = run_stochastic_Facloc(curr_X_trn, rem_predict, bud)
+                new_idxs = run_sieve_Facloc(curr_X_trn, rem_predict, bud) if facloc_method == 'sieve' else \
+                    run_stochastic_Facloc(curr_X_trn, rem_predict, bud)
             else:
                 new_idxs = setf_model.lazy_greedy_max(bud, curr_X_trn ,model)
             new_idxs = np.array(list(remainList))[new_idxs]
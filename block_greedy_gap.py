@@ -0,0 +1,75 @@
+import copy
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor
+from utils.custom_dataset import load_dataset_custom
+
+## Approximation gap of the block greedy (naive_greedy_max(..., block_size=k)) against
+## the one pick per validation gradient refresh greedy (k=1) of SetFunctionTaylor,
+## on the toy datasets written by toy_data.py (linsep_4, clf_2, gauss_2, ...).
+## python3 block_greedy_gap.py <datadir> <data_name> [fraction] [block sizes] [warm epochs]
+## e.g. python3 block_greedy_gap.py ./data/linsep_4 linsep_4 0.1 1,5,10,50 20
+
+datadir = sys.argv[1]
+data_name = sys.argv[2]
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+block_sizes = [int(k) for k in sys.argv[4].split(',')] if len(sys.argv) > 4 else [1, 5, 10, 50]
+warm_epochs = int(sys.argv[5]) if len(sys.argv) > 5 else 20
+if 1 not in block_sizes:
+    block_sizes = [1] + block_sizes
+learning_rate = 0.05
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+torch.manual_seed(42)
+np.random.seed(42)
+fullset, valset, testset, num_fea, num_cls = load_dataset_custom(datadir, data_name, 'dss')
+x_trn, y_trn = torch.from_numpy(fullset[0]).float().to(device), torch.from_numpy(fullset[1]).long().to(device)
+x_val, y_val = torch.from_numpy(valset[0]).float().to(device), torch.from_numpy(valset[1]).long().to(device)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+print("Data sizes:", x_trn.shape, x_val.shape, "budget:", bud)
+
+model = TwoLayerNet(num_fea, num_cls, 100).to(device)
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
+# A few full batch epochs so that the selection does not run at the random init
+for i in range(warm_epochs):
+    optimizer.zero_grad()
+    loss = criterion(model(x_trn), y_trn)
+    loss.backward()
+    optimizer.step()
+theta_init = copy.deepcopy(model.state_dict())
+with torch.no_grad():
+    print("Validation loss at theta_init:", criterion(model(x_val), y_val).item())
+
+
+def one_step_val_loss(setf_model, subset):
+    # Validation loss after the one step update with the summed gradients of subset,
+    # i.e. the objective the Taylor greedy is maximising the decrease of.
+    grads = setf_model.grads_per_elem.block(list(subset))
+    model.load_state_dict(theta_init)
+    with torch.no_grad():
+        for param, g in zip(model.parameters(), grads):
+            param.data.sub_(learning_rate * g)
+        return criterion(model(x_val), y_val).item()
+
+
+setf_model = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion,
+                               criterion_nored, learning_rate, device)
+results = {}
+for k in block_sizes:
+    t = time.time()
+    subset = setf_model.naive_greedy_max(bud, copy.deepcopy(theta_init), block_size=k)
+    results[k] = (subset, time.time() - t, one_step_val_loss(setf_model, subset))
+
+subset_1, time_1, loss_1 = results[1]
+print("block_size", "refreshes", "time", "one_step_val_loss", "gap_vs_k1", "overlap_with_k1")
+for k in block_sizes:
+    subset, elapsed, loss = results[k]
+    print(k, int(np.ceil(bud / k)), round(elapsed, 4), round(loss, 6), round(loss - loss_1, 6),
+          round(len(set(subset) & set(subset_1)) / float(len(subset_1)), 4))
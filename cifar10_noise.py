@@ -12,6 +12,7 @@ import torch.optim as optim
 from matplotlib import pyplot as plt
 from models.set_function_all import SetFunctionFacLoc
 from torch.utils.data.sampler import SubsetRandomSampler
+from utils.subset_loader import SubsetBatchLoader
 # from models.simpleNN_net import ThreeLayerNet
 from models.cifar_set_function_grad_computation_taylor import SetFunctionLoader_2 as SetFunction
 from models.cifar_set_function_grad_computation_taylor import WeightedSetFunctionLoader as WtSetFunction
@@ -146,14 +147,12 @@ def random_greedy_train_model_online_taylor(start_rand_idxs, bud, lam):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Randomized Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -203,9 +202,7 @@ def random_greedy_train_model_online_taylor(start_rand_idxs, bud, lam):
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
     end.record()
     torch.cuda.synchronize()
     time = start.elapsed_time(end)/1000
@@ -286,14 +283,12 @@ def train_model_online(start_rand_idxs, bud):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -342,9 +337,7 @@ def train_model_online(start_rand_idxs, bud):
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
             print(len(list(set(prev_idxs).difference(set(idxs)))) + len(list(set(idxs).difference(set(prev_idxs)))))
     end.record()
     # Waits for everything to finish running
@@ -437,14 +430,12 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = WtSetFunction(trainset, x_cmb, y_cmb, len(facloc_idxs), lam, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Facloc regularized Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -492,9 +483,7 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
     end.record()
     torch.cuda.synchronize()
     time = start.elapsed_time(end)/1000
@@ -573,14 +562,12 @@ def train_model_mod_online(start_rand_idxs, bud):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, 10, 1000)
+                             criterion_nored, learning_rate, device, 10, 1000, seed=42)
     print("Starting Modified Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         for batch_idx, (inputs, targets) in enumerate(trainloader):
             #print(batch_idx)
@@ -671,9 +658,7 @@ def train_model_random(start_rand_idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     for i in range(0, num_epochs):
         subtrn_loss = 0
@@ -790,9 +775,7 @@ def train_model_random_online(start_rand_idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         subtrn_loss = 0
         for batch_idx, (inputs, targets) in enumerate(subset_trnloader):
@@ -829,9 +812,7 @@ def train_model_random_online(start_rand_idxs):
 
         if ((i + 1) % select_every) == 0:
             idxs = np.random.choice(N, size=bud, replace=False)
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs),
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
 
     end.record()
     torch.cuda.synchronize()
@@ -938,9 +919,7 @@ def train_model_Facloc(idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     for i in range(0, num_epochs):
         subtrn_loss = 0
@@ -0,0 +1,52 @@
+import copy
+import os
+import sys
+import time
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionCRAIG_Super, SetFunctionTaylorDeep_Super
+from utils.custom_dataset import load_tiled_dataset
+
+## Wall clock of the class parallel class_wise (models/class_parallel.py) against the
+## sequential loop over the classes, for CRAIG (process and thread backends) and the
+## class wise Taylor greedy (process backend), per number of workers. Also checks that
+## the selections are the same as the sequential ones. The training set can be tiled
+## `repeat` times (plus a little noise) for larger classes.
+## python3 class_parallel_benchmark.py <datadir> [data_name] [fraction] [repeat] [workers]
+## e.g. python3 class_parallel_benchmark.py ./data sklearn-digits 0.1 4 2,5,10
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+workers = [int(w) for w in sys.argv[5].split(',')] if len(sys.argv) > 5 else [2, 5, 10]
+learning_rate = 0.05
+
+x_trn, y_trn, x_val, y_val, num_fea, num_cls = load_tiled_dataset(datadir, data_name, repeat)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+print("Data sizes:", x_trn.shape, x_val.shape, "budget:", bud, "classes:", len(torch.unique(y_trn)),
+      "cpus:", os.cpu_count())
+
+model = TwoLayerNet(num_fea, num_cls, 100)
+theta_init = copy.deepcopy(model.state_dict())
+craig = SetFunctionCRAIG_Super('cpu', x_trn, y_trn, True)
+taylor = SetFunctionTaylorDeep_Super(x_trn, y_trn, 1000, x_val, y_val, True, model, nn.CrossEntropyLoss(),
+                                     nn.CrossEntropyLoss(reduction='none'), learning_rate, 'cpu', N)
+
+runs = [('craig', 'process', lambda w: craig.class_wise(bud, model, workers=w)[0]),
+        ('craig', 'thread', lambda w: craig.class_wise(bud, model, workers=w, backend='thread')[0]),
+        ('taylor', 'process', lambda w: taylor.class_wise(bud, copy.deepcopy(theta_init), workers=w))]
+
+print("set_function backend workers time speedup same_as_sequential")
+for name, backend, select in runs:
+    t = time.time()
+    ref = [int(i) for i in select(1)]
+    sequential = time.time() - t
+    print(name, backend, 1, round(sequential, 3), 1.0, True)
+    for w in workers:
+        t = time.time()
+        subset = [int(i) for i in select(w)]
+        elapsed = time.time() - t
+        print(name, backend, w, round(elapsed, 3), round(sequential / elapsed, 2), subset == ref)
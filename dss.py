@@ -18,7 +18,8 @@ from models.set_function_all import SetFunctionFacLoc, SetFunctionTaylor, SetFun
 from models.set_function_craig import SetFunctionCRAIG_Super as CRAIG
 from models.set_function_ideas import SetFunctionTaylorDeep_ReLoss_Mean
 from sklearn.model_selection import train_test_split
-from utils.custom_dataset import load_dataset_numpy, write_knndata
+from utils.custom_dataset import load_dataset_numpy, write_knndata, load_dataset_custom, csr_to_tensor
+from models.per_element_grads import chunk_loader
 from custom_dataset_old import load_dataset_numpy as load_dataset_numpy_old, write_knndata as write_knndata_old
 import math
 import random
@@ -36,6 +37,9 @@ fraction = float(sys.argv[3])
 num_epochs = int(sys.argv[4])
 select_every = int(sys.argv[5])
 feature = sys.argv[6]# 70
+knn = int(sys.argv[7]) if len(sys.argv) > 7 else 0  # k of the sparse k-NN facility location / CRAIG, 0 for dense
+facloc_epsilon = float(sys.argv[8]) if len(sys.argv) > 8 else 0  # epsilon of the threshold greedy facility location, 0 for lazy greedy
+sparse = int(sys.argv[9]) if len(sys.argv) > 9 else 0  # 1: libsvm features as torch sparse tensors (CSR load), 0 for dense
 warm_method = 0  # whether to use warmstart-onestep (1) or online (0)
 num_runs = 1  # number of random runs
 learning_rate = 0.05
@@ -88,7 +92,9 @@ def perform_knnsb_selection(datadir, dset_name, budget, selUsing):
     idxs_knnsb = np.genfromtxt(indices_file, delimiter=',', dtype=int) # since they are indices!
     return idxs_knnsb
 
-if data_name in ['dna','sklearn-digits','satimage','svmguide1','letter','shuttle','ijcnn1','sensorless','connect_4','sensit_seismic','usps']:
+if sparse:
+    fullset, valset, testset, M, num_cls = load_dataset_custom(datadir, data_name, feature, sparse=True)
+elif data_name in ['dna','sklearn-digits','satimage','svmguide1','letter','shuttle','ijcnn1','sensorless','connect_4','sensit_seismic','usps']:
     fullset, valset, testset, num_cls = load_dataset_numpy_old(datadir, data_name,feature=feature)
     write_knndata_old(datadir, data_name,feature=feature)
 elif data_name in ['mnist' , "fashion-mnist"]:
@@ -106,6 +112,12 @@ if data_name == 'mnist' or data_name == "fashion-mnist":
     # Get validation data: Its 10% of the entire (full) training data
     x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
 
+elif sparse:
+    # scipy CSR -> torch sparse COO, SparseInputLinear takes them as they are
+    x_trn, y_trn = csr_to_tensor(fullset[0]), torch.from_numpy(fullset[1]).long()
+    x_tst, y_tst = csr_to_tensor(testset[0]), torch.from_numpy(testset[1]).long()
+    x_val, y_val = csr_to_tensor(valset[0]), torch.from_numpy(valset[1]).long()
+
 else:
     x_trn, y_trn = torch.from_numpy(fullset[0]).float(), torch.from_numpy(fullset[1]).long()
     x_tst, y_tst = torch.from_numpy(testset[0]).float(), torch.from_numpy(testset[1]).long()
@@ -125,25 +137,22 @@ x_trn, y_trn = x_trn.to(device), y_trn.to(device)
 x_val, y_val = x_val.to(device), y_val.to(device)
 print("Transferred data to device in time:", time.time() - d_t)
 print_every = 50
+
+
+def rows(x, idxs):
+    # x[idxs] for dense and sparse COO x (which can not be indexed, only index_select'ed)
+    return x.index_select(0, torch.as_tensor(idxs, dtype=torch.long, device=x.device))
+
+
+# the facility location distances need dense rows, densified a batch at a time
 train_batch_size_for_greedy = 1200
-train_loader_greedy = []
-for item in range(math.ceil(len(x_trn) / train_batch_size_for_greedy)):
-    inputs = x_trn[item * train_batch_size_for_greedy:(item + 1) * train_batch_size_for_greedy]
-    target = y_trn[item * train_batch_size_for_greedy:(item + 1) * train_batch_size_for_greedy]
-    train_loader_greedy.append((inputs, target))
+train_loader_greedy = [(inputs.to_dense() if inputs.is_sparse else inputs, target)
+                       for inputs, target in chunk_loader(x_trn, y_trn, train_batch_size_for_greedy)]
 
-valid_loader = []
 train_batch_size = 128
-for item in range(math.ceil(len(x_val) / train_batch_size)):
-    inputs = x_val[item * train_batch_size:(item + 1) * train_batch_size]
-    target = y_val[item * train_batch_size:(item + 1) * train_batch_size]
-    valid_loader.append((inputs, target))
+valid_loader = chunk_loader(x_val, y_val, train_batch_size)
 
-train_loader = []
-for item in range(math.ceil(len(x_trn) / train_batch_size)):
-    inputs = x_trn[item * train_batch_size:(item + 1) * train_batch_size]
-    target = y_trn[item * train_batch_size:(item + 1) * train_batch_size]
-    train_loader.append((inputs, target))
+train_loader = chunk_loader(x_trn, y_trn, train_batch_size)
 
 
 def train_model_craig(start_rand_idxs, bud, convex=True,every=False):
@@ -168,7 +177,7 @@ def train_model_craig(start_rand_idxs, bud, convex=True,every=False):
     #dataset = TensorDataset(x_trn, y_trn)
     #dataloader = DataLoader(dataset, shuffle=False, batch_size=train_batch_size)
     #setf = CRAIG(device, train_loader, True)
-    setf = CRAIG(device, x_trn,y_trn, True)
+    setf = CRAIG(device, x_trn,y_trn, True, knn=knn or None)
     # idxs = start_rand_idxs
     idxs, gammas = setf.class_wise(bud, model)
     #gammas = gammas.type(torch.float)/N
@@ -176,7 +185,7 @@ def train_model_craig(start_rand_idxs, bud, convex=True,every=False):
     for i in range(num_epochs):
         #print(i)
         # inputs, targets = x_trn[idxs].to(device), y_trn[idxs].to(device)
-        inputs, targets = x_trn[idxs].to(device), y_trn[idxs].to(device)
+        inputs, targets = rows(x_trn, idxs).to(device), y_trn[idxs].to(device)
         optimizer.zero_grad()
         scores = model(inputs)
         losses = criterion_nored(scores, targets)
@@ -203,7 +212,7 @@ def train_model_craig(start_rand_idxs, bud, convex=True,every=False):
     with torch.no_grad():
         full_trn_out = model(x_trn)
         full_trn_loss = criterion(full_trn_out, y_trn).mean()
-        sub_trn_out = model(x_trn[idxs])
+        sub_trn_out = model(rows(x_trn, idxs))
         sub_trn_loss = criterion(sub_trn_out, y_trn[idxs]).mean()
         val_out = model(x_val)
         val_loss = criterion(val_out, y_val)
@@ -257,7 +266,7 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
         idxs = start_rand_idxs
 
     if func_name == 'Facloc Regularized':
-        x_val1 = torch.cat([x_val, x_trn[fac_loc_idx]], dim=0)
+        x_val1 = torch.cat([x_val, rows(x_trn, fac_loc_idx)], dim=0)
         y_val1 = torch.cat([y_val, y_trn[fac_loc_idx]], dim=0)
 
     total_idxs = list(np.arange(len(y_trn)))
@@ -276,7 +285,7 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
                                                        criterion, criterion_nored, learning_rate, device, N)
 
     elif func_name == 'Facility Location':
-        setf_model = SetFunctionFacLoc(device, train_loader_greedy)
+        setf_model = SetFunctionFacLoc(device, train_loader_greedy, knn=knn or None, epsilon=facloc_epsilon or None)
         idxs = setf_model.lazy_greedy_max(bud, model)
 
     elif func_name == 'Facloc Regularized':
@@ -320,7 +329,7 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
     print(count)
     for i in range(num_epochs):
         # inputs, targets = x_trn[idxs].to(device), y_trn[idxs].to(device)
-        inputs, targets = x_trn[idxs], y_trn[idxs]
+        inputs, targets = rows(x_trn, idxs), y_trn[idxs]
         optimizer.zero_grad()
         scores = model(inputs)
         loss = criterion(scores, targets)
@@ -393,7 +402,7 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
     with torch.no_grad():
         full_trn_out = model(x_trn)
         full_trn_loss = criterion(full_trn_out, y_trn).mean()
-        sub_trn_out = model(x_trn[idxs])
+        sub_trn_out = model(rows(x_trn, idxs))
         sub_trn_loss = criterion(sub_trn_out, y_trn[idxs]).mean()
         val_out = model(x_val)
         val_loss = criterion(val_out, y_val)
@@ -464,13 +473,7 @@ def train_model_online_taylor_deep(start_rand_idxs, bud, valid):
     val_losses = np.zeros(num_epochs)
     # idxs = start_rand_idxs
 
-    train_sub_loader = []
-    x_trn_sub = x_trn[idxs]
-    y_trn_sub = y_trn[idxs]
-    for item in range(math.ceil(len(x_trn_sub) / train_batch_size)):
-        inputs = x_trn_sub[item * train_batch_size:(item + 1) * train_batch_size]
-        target = y_trn_sub[item * train_batch_size:(item + 1) * train_batch_size]
-        train_sub_loader.append((inputs, target))
+    train_sub_loader = chunk_loader(rows(x_trn, idxs), y_trn[idxs], train_batch_size)
 
     for i in range(num_epochs):
         # inputs, targets = x_trn[idxs].to(device), y_trn[idxs].to(device)
@@ -523,13 +526,7 @@ def train_model_online_taylor_deep(start_rand_idxs, bud, valid):
             idxs = new_idxs  # update the current set
             random.shuffle(idxs)
             model.load_state_dict(cached_state_dict)
-            train_sub_loader = []
-            x_trn_sub = x_trn[idxs]
-            y_trn_sub = y_trn[idxs]
-            for item in range(math.ceil(len(x_trn_sub) / train_batch_size)):
-                inputs = x_trn_sub[item * train_batch_size:(item + 1) * train_batch_size]
-                target = y_trn_sub[item * train_batch_size:(item + 1) * train_batch_size]
-                train_sub_loader.append((inputs, target))
+            train_sub_loader = chunk_loader(rows(x_trn, idxs), y_trn[idxs], train_batch_size)
 
     # Calculate Final SubsetTrn, FullTrn, Val and Test Loss
     # Calculate Val and Test Accuracy
@@ -537,7 +534,7 @@ def train_model_online_taylor_deep(start_rand_idxs, bud, valid):
     with torch.no_grad():
         full_trn_out = model(x_trn)
         full_trn_loss = criterion(full_trn_out, y_trn).mean()
-        sub_trn_out = model(x_trn[idxs])
+        sub_trn_out = model(rows(x_trn, idxs))
         sub_trn_loss = criterion(sub_trn_out, y_trn[idxs]).mean()
         val_out = model(x_val)
         val_loss = criterion(val_out, y_val)
@@ -596,7 +593,7 @@ def train_model_mod_taylor(start_rand_idxs, bud, valid):
     with torch.no_grad():
         full_trn_out = model(x_trn)
         full_trn_loss = criterion(full_trn_out, y_trn).mean()
-        sub_trn_out = model(x_trn[idxs])
+        sub_trn_out = model(rows(x_trn, idxs))
         sub_trn_loss = criterion(sub_trn_out, y_trn[idxs]).mean()
         val_out = model(x_val)
         val_loss = criterion(val_out, y_val)
@@ -65,7 +65,7 @@ if data_name == 'mnist':
     x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
 else:
 
-    fullset, valset, testset, data_dims,num_cls = load_dataset_custom(datadir, data_name,feature=feature,True)
+    fullset, valset, testset, data_dims,num_cls = load_dataset_custom(datadir, data_name, feature, True, seed=42)
     
     x_trn, y_trn = torch.from_numpy(fullset[0]).float(), torch.from_numpy(fullset[1]).long()
     x_tst, y_tst = torch.from_numpy(testset[0]).float(), torch.from_numpy(testset[1]).long()
@@ -15,6 +15,7 @@ import torch.optim as optim
 from matplotlib import pyplot as plt
 from models.set_function_act_learn import SetFunctionFacLoc
 from torch.utils.data.sampler import SubsetRandomSampler
+from utils.subset_loader import SubsetBatchLoader
 # from models.simpleNN_net import ThreeLayerNet
 #from models.set_function_craig import DeepSetFunction as CRAIG
 from models.cifar_set_function_act_learn import SetFunctionLoader_2 as SetFunction
@@ -249,8 +250,7 @@ def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,
     idxs = list(idxs)
     remainList = remainList.difference(idxs)
 
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     if func_name == 'Taylor Online':
         print("Starting Online OneStep Run with taylor on loss!")
@@ -440,9 +440,7 @@ def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,
             remainList = remainList.difference(new_idxs)
             idxs.extend(new_idxs)
 
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs),
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
 
         elif func_name == 'Facility Location':
 
@@ -452,9 +450,7 @@ def active_learning_taylor(func_name,start_rand_idxs=None, bud=None, valid=True,
             remainList = remainList.difference(new_idxs)
             idxs.extend(new_idxs)
 
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs),
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
 
         else: 
             new_idxs = setf_model.naive_greedy_max(curr_X_trn,rem_predict,no_points, clone_dict)  # , grads_idxs
@@ -495,14 +491,13 @@ def act_learn_online(function,start_rand_idxs, bud,lam=0.9):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Greedy Online OneStep Run with taylor!")
     remainList = set([i for i in range(N)])
     idxs = list(idxs)
     remainList = remainList.difference(idxs)
 
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     val_accies = np.zeros(no_select)
     test_accies = np.zeros(no_select)
@@ -604,9 +599,7 @@ def act_learn_online(function,start_rand_idxs, bud,lam=0.9):
         print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
         model.load_state_dict(cached_state_dict)
         ### Change the subset_trnloader according to new found indices: subset_idxs
-        subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+        subset_trnloader.set_indices(idxs)
             #print(len(list(set(prev_idxs).difference(set(idxs)))) + len(list(set(idxs).difference(set(prev_idxs)))))
     end.record()
     # Waits for everything to finish running
@@ -641,7 +634,7 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = WtSetFunction(trainset, x_cmb, y_cmb, len(facloc_idxs), lam, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Facloc regularized Greedy Online OneStep Run with taylor!")
 
     remainList = set([i for i in range(N)])
@@ -651,9 +644,7 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     val_accies = np.zeros(no_select)
     test_accies = np.zeros(no_select)
     unlab_accies = np.zeros(no_select)
@@ -751,9 +742,7 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
         print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
         model.load_state_dict(cached_state_dict)
         ### Change the subset_trnloader according to new found indices: subset_idxs
-        subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                       sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                       pin_memory=True)
+        subset_trnloader.set_indices(idxs)
         #print(len(list(set(prev_idxs).difference(set(idxs)))) + len(list(set(idxs).difference(set(prev_idxs)))))
     end.record()
     # Waits for everything to finish running
@@ -0,0 +1,72 @@
+import copy
+import os
+import sys
+import time
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor, SetFunctionFacLoc
+from utils.custom_dataset import load_tiled_dataset
+
+## Centralized vs GreeDi two round distributed greedy (distributed_greedy_max, models/greedi.py)
+## for the Taylor and facility location selections. Reports the selection time, the
+## value of the selection (validation loss after the one step update for Taylor, the
+## facility location objective, relative to the centralized one, for facloc) and the
+## overlap with the centralized selection, per number of partitions. The partitions run
+## in min(partitions, processes) forked workers. per_core is the time with one core per
+## partition, the slowest local greedy plus the final one, measured whatever the
+## number of cores here. The training set can be tiled `repeat` times (plus a little
+## noise) for larger ground sets.
+## python3 greedi_benchmark.py <datadir> [data_name] [fraction] [repeat] [partitions] [processes]
+## e.g. python3 greedi_benchmark.py ./data sklearn-digits 0.1 4 2,4,8 4
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+partitions = [int(p) for p in sys.argv[5].split(',')] if len(sys.argv) > 5 else [2, 4, 8]
+processes = int(sys.argv[6]) if len(sys.argv) > 6 else os.cpu_count()
+learning_rate = 0.05
+
+x_trn, y_trn, x_val, y_val, num_fea, num_cls = load_tiled_dataset(datadir, data_name, repeat)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+print("Data sizes:", x_trn.shape, x_val.shape, "budget:", bud, "processes:", processes)
+
+model = TwoLayerNet(num_fea, num_cls, 100)
+theta_init = copy.deepcopy(model.state_dict())
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+taylor = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored, learning_rate, 'cpu')
+facloc = SetFunctionFacLoc('cpu', [(x_trn, y_trn)])
+
+
+def facloc_value(subset):
+    dist = torch.cat([facloc.distance(x_trn[start:start + 1024], x_trn[subset]).min(1)[0]
+                      for start in range(0, N, 1024)])
+    return -dist.sum().item()
+
+
+runs = [('taylor', lambda: taylor.naive_greedy_max(bud, copy.deepcopy(theta_init)),
+         lambda p, timings: taylor.distributed_greedy_max(bud, copy.deepcopy(theta_init), p, min(p, processes),
+                                                          timings=timings),
+         lambda subset: taylor._one_step_val_loss(subset, theta_init)),
+        ('facloc', lambda: facloc.lazy_greedy_max(bud, model),
+         lambda p, timings: facloc.distributed_greedy_max(bud, model, p, min(p, processes), timings=timings),
+         facloc_value)]
+
+print("set_function partitions time per_core value overlap_with_centralized")
+for name, centralized, distributed, value in runs:
+    t = time.time()
+    ref = centralized()
+    elapsed = round(time.time() - t, 3)
+    print(name, 1, elapsed, elapsed, round(value(ref), 4), 1.0)
+    for p in partitions:
+        timings = {}
+        t = time.time()
+        subset = distributed(p, timings)
+        elapsed = time.time() - t
+        per_core = max(timings['local']) + timings['final']
+        print(name, p, round(elapsed, 3), round(per_core, 3), round(value(subset), 4),
+              round(len(set(subset) & set(ref)) / float(bud), 4))
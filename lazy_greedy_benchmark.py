@@ -0,0 +1,111 @@
+import sys
+import time
+import numpy as np
+import torch
+from queue import PriorityQueue
+from models.knn_graph import SparseFacilityLocation
+from models.lazy_greedy import lazy_greedy
+from models.pairwise_distance import pairwise_distances
+
+## Benchmark of the lazy greedy engine (models/lazy_greedy.py) against the
+## queue.PriorityQueue loop the lazy_greedy_max methods used before, on facility
+## location over random points. The dense sim_mat version is only run up to
+## `dense_max` points (N^2 floats), the sparse k-NN version at every size.
+## python3 lazy_greedy_benchmark.py [sizes] [fraction] [k] [dense_max]
+## e.g. python3 lazy_greedy_benchmark.py 10000,50000,200000 0.01 10 10000
+
+sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 50000, 200000]
+fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+dense_max = int(sys.argv[4]) if len(sys.argv) > 4 else 10000
+d = 16
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def priority_queue_greedy(gain, add, N, budget, id_first):
+    # The old lazy_greedy_max loop, one .item() per gain
+    gains = PriorityQueue()
+    for i in range(N):
+        if i == id_first:
+            continue
+        gains.put((-gain(i), i))
+    numSelected = 2
+    second = gains.get()
+    greedyList = [id_first, second[1]]
+    add(second[1])
+    while numSelected < budget:
+        if gains.empty():
+            break
+        elif gains.qsize() == 1:
+            bestId = gains.get()[1]
+        else:
+            bestGain = -np.inf
+            bestId = None
+            while True:
+                first = gains.get()
+                if bestId == first[1]:
+                    break
+                curr_gain = gain(first[1])
+                gains.put((-curr_gain, first[1]))
+                if curr_gain >= bestGain:
+                    bestGain = curr_gain
+                    bestId = first[1]
+        greedyList.append(bestId)
+        numSelected += 1
+        add(bestId)
+    return greedyList
+
+
+class DenseFacLoc(object):
+    # sim_mat / max_sim as in SetFunctionFacLoc
+
+    def __init__(self, x):
+        self.sim_mat = pairwise_distances(x, x)
+        self.sim_mat = self.sim_mat.max() - self.sim_mat
+        self.max_sim = None
+
+    def first(self):
+        bestId = torch.argmax(self.sim_mat.sum(1)).item()
+        self.max_sim = self.sim_mat[bestId].clone()
+        return bestId
+
+    def gain(self, i):
+        return (torch.max(self.max_sim, self.sim_mat[i]) - self.max_sim).sum().item()
+
+    def gains(self, idxs):
+        return self.sim_mat.index_select(0, idxs).sub_(self.max_sim).clamp_(min=0).sum(1)
+
+    def add(self, j):
+        self.max_sim = torch.max(self.max_sim, self.sim_mat[j])
+
+
+torch.manual_seed(42)
+print("N", "budget", "backend", "priority_queue_time", "lazy_greedy_time", "speedup", "same_selection")
+for N in sizes:
+    x = torch.randn(N, d, device=device)
+    budget = max(2, int(fraction * N))
+    if N <= dense_max:
+        f = DenseFacLoc(x)
+        id_first = f.first()
+        t = time.time()
+        old = priority_queue_greedy(f.gain, f.add, N, budget, id_first)
+        t_old = time.time() - t
+        id_first = f.first()
+        t = time.time()
+        new = lazy_greedy(f.gains, f.add, N, budget, [id_first])
+        t_new = time.time() - t
+        print(N, budget, "dense", round(t_old, 3), round(t_new, 3), round(t_old / t_new, 2), old == new)
+        del f
+    f = SparseFacilityLocation(x, k)
+    f.max_sim.zero_()
+    id_first = torch.argmax(f.marginal_gains(torch.arange(N))).item()
+    f.add(id_first)
+    t = time.time()
+    old = priority_queue_greedy(lambda i: f.marginal_gains(torch.tensor([i])).item(), f.add, N, budget, id_first)
+    t_old = time.time() - t
+    f.max_sim.zero_()
+    f.add(id_first)
+    t = time.time()
+    new = lazy_greedy(f.marginal_gains, f.add, N, budget, [id_first])
+    t_new = time.time() - t
+    print(N, budget, "knn_%d" % k, round(t_old, 3), round(t_new, 3), round(t_old / t_new, 2), old == new)
@@ -0,0 +1,60 @@
+import copy
+import os
+import sys
+import tempfile
+import time
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor
+
+## Throughput of the memory-mapped per-element gradient store (grads_store of
+## SetFunctionTaylor) against the in-memory matrix, on synthetic data: gradient
+## computation, the chunked dot against flat_grads_val, and the whole greedy.
+## python3 mmap_grads_benchmark.py [num_points] [hidden_units] [budget] [store_dir]
+## e.g. python3 mmap_grads_benchmark.py 20000 256 200 /tmp
+
+num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+hidden_units = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+budget = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+store_dir = sys.argv[4] if len(sys.argv) > 4 else tempfile.gettempdir()
+num_features = 54
+num_cls = 7
+learning_rate = 0.05
+dot_repeats = 20
+
+torch.manual_seed(42)
+x_trn = torch.randn(num_points, num_features)
+y_trn = torch.randint(0, num_cls, (num_points,))
+x_val = torch.randn(num_points // 10, num_features)
+y_val = torch.randint(0, num_cls, (num_points // 10,))
+model = TwoLayerNet(num_features, num_cls, hidden_units)
+theta_init = copy.deepcopy(model.state_dict())
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+store_path = os.path.join(store_dir, 'mmap_grads_benchmark.npy')
+
+print("mode grads_MB grad_time dot_time dot_GB_per_s greedy_time")
+subsets = {}
+for mode, store in [('memory', None), ('mmap', store_path)]:
+    setf = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored,
+                             learning_rate, 'cpu', grads_store=store)
+    t = time.time()
+    setf._compute_per_element_grads(copy.deepcopy(theta_init))
+    grad_time = time.time() - t
+    setf._compute_init_valloss_grads(copy.deepcopy(theta_init))
+    vec = setf.flatten_params(setf.grads_curr_subset)
+    size = setf.flat_grads_mat.numel() * setf.flat_grads_mat.element_size()
+    t = time.time()
+    for _ in range(dot_repeats):
+        setf.grads_per_elem.dot(vec)
+    dot_time = (time.time() - t) / dot_repeats
+    t = time.time()
+    subsets[mode] = setf.naive_greedy_max(budget, copy.deepcopy(theta_init))
+    greedy_time = time.time() - t
+    print(mode, round(size / 2. ** 20, 1), round(grad_time, 3), round(dot_time, 4),
+          round(size / 2. ** 30 / dot_time, 2), round(greedy_time, 3))
+    del setf
+
+os.remove(store_path)
+print("same selection:", subsets['memory'] == subsets['mmap'])
@@ -12,6 +12,7 @@ import torch.optim as optim
 from matplotlib import pyplot as plt
 from models.set_function_all import SetFunctionFacLoc
 from torch.utils.data.sampler import SubsetRandomSampler
+from utils.subset_loader import SubsetBatchLoader, weighted_cross_entropy
 # from models.simpleNN_net import ThreeLayerNet
 from models.set_function_craig import DeepSetFunction as CRAIG
 from models.set_function_grad_computation_taylor import SetFunctionLoader_2 as SetFunction
@@ -103,6 +104,7 @@ fraction = float(sys.argv[3])
 num_epochs = int(sys.argv[4])
 select_every = int(sys.argv[5])
 feature = sys.argv[6]# 70
+craig_sampling = sys.argv[7] if len(sys.argv) > 7 else 'weighted'  # or 'importance', CRAIG epochs resample the medoids by gamma
 warm_method = 0  # whether to use warmstart-onestep (1) or online (0)
 num_runs = 1  # number of random runs
 learning_rate = 0.05
@@ -209,6 +211,9 @@ def train_model_craig(start_rand_idxs, bud):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
+    # the medoids and their gammas replace start_rand_idxs at the first selection
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size, weights=np.full(len(idxs), 1. / N),
+                                         importance=craig_sampling == 'importance')
     for i in range(0, num_epochs):
         print("selEpoch: %d, Starting Selection:" % i, str(datetime.datetime.now()))
         if (i%select_every) == 0:
@@ -218,25 +223,16 @@ def train_model_craig(start_rand_idxs, bud):
             model.load_state_dict(cached_state_dict)
             gammas = np.array(gammas)
             idxs = subset_idxs
+            subset_trnloader.set_indices(idxs, gammas / N)
         #print(gammas)
         print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
-        subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                       sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                       pin_memory=True)
-        actual_idxs = np.array(trainset.indices)[idxs]
-        batch_wise_indices = list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))
         subtrn_loss = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat(
-                [fullset[actual_idxs[x]][0].view(-1, 1, fullset[actual_idxs[x]][0].shape[1], fullset[actual_idxs[x]][0].shape[2]) for x in batch_idx],
-                dim=0).type(torch.float)
-            targets = torch.tensor([fullset[actual_idxs[x]][1] for x in batch_idx])
+        for inputs, targets, weights in subset_trnloader.weighted_batches():
             inputs, targets = inputs.to(device), targets.to(device, non_blocking=True) # targets can have non_blocking=True.
+            weights = weights.to(device, non_blocking=True)
             optimizer.zero_grad()
             outputs = model(inputs)
-            losses = criterion_nored(outputs, targets)
-            batch_gammas = (1/N) * gammas[batch_idx]
-            loss = torch.dot(torch.from_numpy(batch_gammas).to(device).type(torch.float), losses)
+            loss = weighted_cross_entropy(outputs, targets, weights)
             subtrn_loss += loss.item()
             loss.backward()
             optimizer.step()
@@ -340,14 +336,12 @@ def random_greedy_train_model_online_taylor(start_rand_idxs, bud, lam):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Randomized Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -397,9 +391,7 @@ def random_greedy_train_model_online_taylor(start_rand_idxs, bud, lam):
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
     end.record()
     torch.cuda.synchronize()
     time = start.elapsed_time(end)/1000
@@ -480,14 +472,12 @@ def train_model_online(start_rand_idxs, bud):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -536,9 +526,7 @@ def train_model_online(start_rand_idxs, bud):
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
             print(len(list(set(prev_idxs).difference(set(idxs)))) + len(list(set(idxs).difference(set(prev_idxs)))))
     end.record()
     # Waits for everything to finish running
@@ -631,14 +619,12 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = WtSetFunction(trainset, x_cmb, y_cmb, len(facloc_idxs), lam, model, criterion,
-                             criterion_nored, learning_rate, device, num_cls, 1000)
+                             criterion_nored, learning_rate, device, num_cls, 1000, seed=42)
     print("Starting Facloc regularized Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         actual_idxs = np.array(trainset.indices)[idxs]
         batch_wise_indices = [actual_idxs[x] for x in list(BatchSampler(RandomSampler(actual_idxs), trn_batch_size, drop_last=False))]
@@ -686,9 +672,7 @@ def facloc_reg_train_model_online_taylor(start_rand_idxs, facloc_idxs, bud, lam)
             print("selEpoch: %d, Selection Ended at:" % (i), str(datetime.datetime.now()))
             model.load_state_dict(cached_state_dict)
             ### Change the subset_trnloader according to new found indices: subset_idxs
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs), num_workers=1,
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
     end.record()
     torch.cuda.synchronize()
     time = start.elapsed_time(end)/1000
@@ -767,14 +751,12 @@ def train_model_mod_online(start_rand_idxs, bud):
     criterion_nored = nn.CrossEntropyLoss(reduction='none')
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
     setf_model = SetFunction(trainset, x_val, y_val, model, criterion,
-                             criterion_nored, learning_rate, device, 10, 1000)
+                             criterion_nored, learning_rate, device, 10, 1000, seed=42)
     print("Starting Modified Greedy Online OneStep Run with taylor!")
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         for batch_idx, (inputs, targets) in enumerate(trainloader):
             #print(batch_idx)
@@ -865,9 +847,7 @@ def train_model_random(start_rand_idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     for i in range(0, num_epochs):
         subtrn_loss = 0
@@ -984,9 +964,7 @@ def train_model_random_online(start_rand_idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
     for i in range(0, num_epochs):
         subtrn_loss = 0
         for batch_idx, (inputs, targets) in enumerate(subset_trnloader):
@@ -1023,9 +1001,7 @@ def train_model_random_online(start_rand_idxs):
 
         if ((i + 1) % select_every) == 0:
             idxs = np.random.choice(N, size=bud, replace=False)
-            subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                           sampler=SubsetRandomSampler(idxs),
-                                                           pin_memory=True)
+            subset_trnloader.set_indices(idxs)
 
     end.record()
     torch.cuda.synchronize()
@@ -1132,9 +1108,7 @@ def train_model_Facloc(idxs):
     substrn_losses = np.zeros(num_epochs)
     fulltrn_losses = np.zeros(num_epochs)
     val_losses = np.zeros(num_epochs)
-    subset_trnloader = torch.utils.data.DataLoader(trainset, batch_size=trn_batch_size, shuffle=False,
-                                                   sampler=SubsetRandomSampler(idxs),
-                                                   pin_memory=True)
+    subset_trnloader = SubsetBatchLoader(trainset, idxs, trn_batch_size)
 
     for i in range(0, num_epochs):
         subtrn_loss = 0
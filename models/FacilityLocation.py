@@ -1,27 +1,24 @@
 import numpy as np
 import torch
 
-from queue import PriorityQueue
+from models.pairwise_distance import pairwise_distances
+from models.precision import storage_dtype, to_storage
+from models.lazy_greedy import lazy_greedy, threshold_greedy
+from models.knn_graph import SparseFacilityLocation
 
 class SetFunctionFacLoc(object):
 
-    def __init__(self, device ,train_full_loader):#, valid_loader): 
+    def __init__(self, device ,train_full_loader, knn=None, precision='fp32', epsilon=None):#, valid_loader): 
         
         self.train_loader = train_full_loader      
         self.device = device #torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
+        self.knn = knn # k of the sparse k-NN graph backend, dense dist_mat if None
+        self.epsilon = epsilon # threshold greedy with this epsilon instead of the lazy greedy if set
     
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist 
+      return pairwise_distances(x, y, exp)
 
     def compute_score(self, model):
 
@@ -39,7 +36,7 @@ class SetFunctionFacLoc(object):
           g_is.append(inputs_i)
 
 
-        self.sim_mat = torch.zeros([self.N, self.N],dtype=torch.float32)
+        self.dist_mat = torch.zeros([self.N, self.N],dtype=storage_dtype(self.precision))
 
         first_i = True
 
@@ -51,19 +48,24 @@ class SetFunctionFacLoc(object):
 
           for j, g_j in  enumerate(g_is, 0):
 
-            self.sim_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = self.distance(g_i, g_j)
+            self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = \
+                to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
 
-      dist = self.sim_mat.sum(1)
+      dist = self.dist_mat.sum(1, dtype=torch.float32)
 
+      # Similarities are const - dist_mat, formed in float32 as the rows are read
+      # (see sim_rows), const is far too large for them to be stored in fp16 / bf16.
       self.const = torch.max(dist).item()
-      self.sim_mat = self.const - self.sim_mat
 
       
       bestId = torch.argmax(self.N*self.const - dist).item()
 
-      self.max_sim = self.sim_mat[bestId].to(self.device)
+      self.max_sim = self.sim_rows(torch.tensor([bestId]))[0]
 
       return bestId
+
+    def sim_rows(self, idxs):
+      return self.const - self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).to(self.device, torch.float32)
     
 
     def naive_greedy_max(self, budget, model):
@@ -81,7 +83,7 @@ class SetFunctionFacLoc(object):
           bestGain = -np.inf
           
           for i in not_selected:
-            gain = (torch.max(self.max_sim ,self.sim_mat[i].to(self.device)) - self.max_sim).sum()#L([0]+greedyList+[i]) - L([0]+greedyList)  #s_0 = self.x_trn[0]
+            gain = (torch.max(self.max_sim ,self.sim_rows(torch.tensor([i]))[0]) - self.max_sim).sum()#L([0]+greedyList+[i]) - L([0]+greedyList)  #s_0 = self.x_trn[0]
             if bestGain < gain.item():
               bestGain = gain.item()
               bestId = i
@@ -90,62 +92,29 @@ class SetFunctionFacLoc(object):
           not_selected.remove(bestId)
           numSelected += 1
 
-          self.max_sim = torch.max(self.max_sim,self.sim_mat[bestId].to(self.device))#.to(self.device))
+          self.max_sim = torch.max(self.max_sim,self.sim_rows(torch.tensor([bestId]))[0])#.to(self.device))
 
       return greedyList
 
     def lazy_greedy_max(self, budget, model):
+      if self.knn is not None:
+        with torch.no_grad():
+          x = torch.cat([inputs_i.to(self.device) for inputs_i, _ in self.train_loader], dim=0)
+        self.N = x.shape[0]
+        return SparseFacilityLocation(x, self.knn).lazy_greedy_max(budget, self.epsilon)
 
       id_first = self.compute_score(model)
 
-      self.gains = PriorityQueue()
-      for i in range(self.N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (torch.max(self.max_sim ,self.sim_mat[i].to(self.device)) - self.max_sim).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.max_sim = torch.max(self.max_sim,self.sim_mat[second[1]].to(self.device))
-
-
-      while(numSelected < budget):
-
-          if self.gains.empty():
-            break
+      def gains(idxs):
+        return self.sim_rows(idxs).sub_(self.max_sim).clamp_(min=0).sum(1)
 
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (torch.max(self.max_sim ,self.sim_mat[first[1]].to(self.device)) - self.max_sim).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
-
-          #print(bestGain,end=",")
-          greedyList.append(bestId)
-          numSelected += 1
+      def add(j):
+        self.max_sim = torch.max(self.max_sim, self.sim_rows(torch.tensor([j]))[0])
 
-          self.max_sim = torch.max(self.max_sim,self.sim_mat[bestId].to(self.device))
+      if self.epsilon is not None:
+        greedyList = threshold_greedy(gains, add, self.N, budget, [id_first], self.epsilon)
+      else:
+        greedyList = lazy_greedy(gains, add, self.N, budget, [id_first])
 
       #print()
       #gamma = self.compute_gamma(greedyList)
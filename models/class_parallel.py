@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import torch
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
+## Class parallel executor for the class_wise selections. The per class problems
+## (class distance matrix / per-element grads + greedy) are independent, they are run
+## `workers` at a time on a pool of forked processes ('process', the workers inherit
+## the set function and the model, nothing is pickled but the results) or of threads
+## ('thread', for solves that do not share mutable state, torch releases the GIL in
+## its kernels). costs[k] is the memory of the class k problem in bytes (its dist_mat,
+## its per-element grads), classes are started largest first (the longest ones do not
+## end up last) and, with `max_bytes`, only while the classes in flight fit in it (a
+## class larger than max_bytes runs alone). The results are returned in class order
+## whatever the completion order.
+## The process backend only works on CPU state (CUDA cannot be used again in a forked
+## child), class_parallel refuses it for another `device`, default_backend(device) is
+## 'process' on the CPU and 'thread' otherwise.
+
+BACKENDS = ('process', 'thread')
+
+_solve = None
+
+
+def default_backend(device):
+    return 'process' if torch.device(device).type == 'cpu' else 'thread'
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _run(k):
+    return _solve(k)
+
+
+def class_parallel(solve, costs, workers=None, backend='process', max_bytes=None, device='cpu'):
+    """[solve(k) for k in range(len(costs))], computed concurrently. `device` is the
+    device of the state the solves use."""
+    global _solve
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend: %s (one of %s)" % (backend, ', '.join(BACKENDS)))
+    if backend == 'process' and torch.device(device).type != 'cpu':
+        raise ValueError("the process backend cannot use %s state from forked workers, use backend='thread'"
+                         % device)
+    K = len(costs)
+    workers = min(K, workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [solve(k) for k in range(K)]
+    pending = sorted(range(K), key=lambda k: (-costs[k], k))
+    results = [None] * K
+    if backend == 'process':
+        # intra-op threads split between the workers
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_init_worker,
+                                   initargs=(max(1, torch.get_num_threads() // workers),))
+        run = _run
+    else:
+        pool = ThreadPoolExecutor(workers)
+        run = solve
+    _solve = solve
+    try:
+        with pool:
+            running = {}
+            while pending or running:
+                in_flight = sum(costs[k] for k in running.values())
+                while pending and len(running) < workers and \
+                        (not running or max_bytes is None or in_flight + costs[pending[0]] <= max_bytes):
+                    k = pending.pop(0)
+                    running[pool.submit(run, k)] = k
+                    in_flight += costs[k]
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+    finally:
+        _solve = None
+    return results
@@ -0,0 +1,90 @@
+import math
+import time
+import torch
+from models.per_element_grads import chunk_loader, compute_per_element_grads, iter_per_element_grads
+from models.precision import to_storage
+
+
+## Per-element gradient matrix kept across the selection rounds of the drivers.
+## Every `select_every` epochs naive_greedy_max recomputed all N per-element gradients
+## at the current parameters. A GradientCache given to SetFunctionTaylor(...,
+## grads_cache=...) keeps the N x P matrix between rounds and recomputes only
+## ceil(fraction * N) rows per round, the others are reused from the round they were
+## last computed in (their age, in rounds, is tracked per row).
+## Refresh policies:
+##   'full'  - every row every round, i.e. the old behaviour (for comparisons).
+##   'shard' - a rotating shard, every row is refreshed once per 1 / fraction rounds.
+##   'loss'  - the rows whose loss changed most since their last refresh (one extra
+##             forward pass over the training set per round).
+## Rows older than `max_age` rounds are refreshed first whatever the policy.
+
+POLICIES = ('full', 'shard', 'loss')
+
+
+class GradientCache(object):
+
+    def __init__(self, fraction=0.25, policy='loss', max_age=None):
+        if policy not in POLICIES:
+            raise ValueError("unknown refresh policy: %s (one of %s)" % (policy, ', '.join(POLICIES)))
+        self.fraction = fraction
+        self.policy = policy
+        self.max_age = max_age
+        self.flat_grads_mat = None
+        self.age = None  # rounds since every row was last recomputed
+        self.losses = None  # loss of every row when it was last recomputed
+        self.offset = 0  # start of the next shard
+        self.num_refreshed = 0  # rows recomputed in the last round
+        self.refresh_time = 0.  # seconds spent in the last refresh
+
+    def _current_losses(self, model, loss_nored, x, y, chunk_size):
+        with torch.no_grad():
+            return torch.cat([loss_nored(model(inputs), targets) for inputs, targets in chunk_loader(x, y, chunk_size)])
+
+    def _rows_to_refresh(self, N, losses):
+        k = min(N, int(math.ceil(self.fraction * N)))
+        if self.max_age is not None:
+            # overdue rows first, oldest first
+            overdue = torch.nonzero(self.age >= self.max_age).flatten()
+            overdue = overdue[torch.argsort(self.age[overdue], descending=True, stable=True)][:k]
+        else:
+            overdue = torch.zeros(0, dtype=torch.long, device=self.age.device)
+        score = torch.zeros(N, device=self.age.device)
+        if self.policy == 'loss':
+            score = (losses - self.losses).abs().to(score.device)
+        elif self.policy == 'shard':
+            score = ((torch.arange(N, device=score.device) - self.offset) % N).float().neg_()
+            self.offset = (self.offset + k) % N
+        score[overdue] = math.inf
+        return torch.sort(torch.topk(score, k)[1])[0]
+
+    def refresh(self, model, loss_nored, x, y, params, chunk_size=1024, dtype=None):
+        """The N x P per-element gradient matrix at the current parameters of `model`,
+        recomputing only the rows picked by the policy once the cache is filled."""
+        t = time.time()
+        N = y.shape[0]
+        losses = self._current_losses(model, loss_nored, x, y, chunk_size) if self.policy == 'loss' else None
+        if self.flat_grads_mat is None or self.flat_grads_mat.shape[0] != N or self.policy == 'full':
+            self.flat_grads_mat = compute_per_element_grads(model, loss_nored, chunk_loader(x, y, chunk_size),
+                                                            params, dtype=dtype)
+            self.age = torch.zeros(N, dtype=torch.long, device=self.flat_grads_mat.device)
+            self.losses = losses
+            self.num_refreshed = N
+            self.refresh_time = time.time() - t
+            return self.flat_grads_mat
+        rows = self._rows_to_refresh(N, losses)
+        idxs = rows.to(y.device)
+        loader = chunk_loader(x.index_select(0, idxs), y[idxs], chunk_size)
+        for start, grads in iter_per_element_grads(model, loss_nored, loader, params):
+            self.flat_grads_mat[rows[start:start + grads.shape[0]].to(self.flat_grads_mat.device)] = \
+                to_storage(grads, self.flat_grads_mat.dtype).to(self.flat_grads_mat.device)
+        self.age += 1
+        self.age[rows.to(self.age.device)] = 0
+        if losses is not None:
+            self.losses[idxs] = losses[idxs]
+        self.num_refreshed = len(rows)
+        self.refresh_time = time.time() - t
+        return self.flat_grads_mat
+
+    def staleness(self):
+        # (mean, max) age in rounds of the cached rows
+        return self.age.float().mean().item(), self.age.max().item()
@@ -0,0 +1,73 @@
+import multiprocessing
+import time
+import numpy as np
+import torch
+
+
+## GreeDi two round distributed greedy (Mirzasoleiman et al., "Distributed Submodular
+## Maximization", 2013) for the selection methods that otherwise run one greedy over
+## the whole ground set. The ids are split into random partitions, the greedy runs on
+## every partition in a pool of worker processes, then once more over the union of the
+## local selections. The pool is forked, the workers inherit whatever the set function
+## has computed (per-element grads, features) instead of having it pickled.
+## Forked workers only work on CPU state: CUDA cannot be used again in a forked child
+## ("Cannot re-initialize CUDA in forked subprocess"), so with a non-CPU `device` the
+## local greedies run one after the other in the calling process. Forking after the
+## parent has started its OpenMP / intra-op thread pool can also hang the workers with
+## some OpenMP runtimes. If it does, pass processes=1 (or torch.set_num_threads(1)
+## before the first torch op).
+
+_local_greedy = None
+
+
+def _init_worker():
+    # one intra-op thread per worker, the workers are the parallelism
+    torch.set_num_threads(1)
+
+
+def _run_local(part):
+    t = time.time()
+    selection = [int(i) for i in _local_greedy(part)]
+    return selection, time.time() - t
+
+
+def partition(N, num_partitions, seed=0):
+    """num_partitions random, sorted, nearly equal shards of range(N)."""
+    perm = np.random.RandomState(seed).permutation(N)
+    return [np.sort(part) for part in np.array_split(perm, num_partitions)]
+
+
+def greedi(local_greedy, final_greedy, N, num_partitions, processes=None, seed=0, value=None, device='cpu',
+           timings=None):
+    """local_greedy(part) returns the ids (of range(N)) it selects among the sorted id
+    array part, final_greedy(union) the same over the union of the local selections.
+    The local ones run in `processes` workers (default one per partition, in process if
+    1). With `value` (a set function to maximise) the best of the final and the local
+    selections is returned, as in GreeDi, otherwise the final one. `device` is the
+    device of the state the greedies read, the pool is only used on CPU. A `timings`
+    dict gets the seconds of every local greedy ('local') and of the final one
+    ('final'), max(local) + final is the time with one core per partition."""
+    global _local_greedy
+    parts = partition(N, num_partitions, seed)
+    if processes is None:
+        processes = num_partitions
+    _local_greedy = local_greedy
+    try:
+        if processes == 1 or num_partitions == 1 or torch.device(device).type != 'cpu':
+            results = [_run_local(part) for part in parts]
+        else:
+            with multiprocessing.get_context('fork').Pool(processes, initializer=_init_worker) as pool:
+                results = pool.map(_run_local, parts, chunksize=1)
+    finally:
+        _local_greedy = None
+    local = [sel for sel, _ in results]
+    union = np.unique(np.concatenate([np.asarray(sel, dtype=np.int64) for sel in local]))
+    t = time.time()
+    selection = [int(i) for i in final_greedy(union)]
+    if timings is not None:
+        timings['local'] = [seconds for _, seconds in results]
+        timings['final'] = time.time() - t
+    if value is None:
+        return selection
+    candidates = [selection] + local
+    return max(candidates, key=value)
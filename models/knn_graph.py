@@ -0,0 +1,94 @@
+import numpy as np
+import torch
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy, threshold_greedy
+
+
+## Sparse k nearest neighbour backend for facility location / CRAIG.
+## The dense versions keep an N x N similarity (or distance) matrix, 40GB at N=100k.
+## Here only the k nearest neighbours of every point are kept, in CSR form, built
+## block by block, and marginal gains only look at the points a candidate is a
+## neighbour of. Similarities are max_dist - dist as in the dense versions, with
+## the similarity to every non neighbour taken as 0.
+
+
+def knn_graph(x, k, block_size=1024):
+    """k nearest neighbour graph of the rows of x (each point is its own nearest
+    neighbour). Returns (indptr, indices, dists, max_dist): the neighbours of i are
+    indices[indptr[i]:indptr[i + 1]] at squared distances dists[indptr[i]:indptr[i + 1]],
+    max_dist is the largest pairwise distance."""
+    N = x.shape[0]
+    k = min(k, N)
+    indices = torch.empty((N, k), dtype=torch.long, device=x.device)
+    dists = torch.empty((N, k), dtype=torch.float32, device=x.device)
+    max_dist = 0.0
+    with torch.no_grad():
+        for start in range(0, N, block_size):
+            end = min(N, start + block_size)
+            block = pairwise_distances(x[start:end], x).float()
+            max_dist = max(max_dist, block.max().item())
+            dists[start:end], indices[start:end] = torch.topk(block, k, dim=1, largest=False)
+    indptr = torch.arange(0, N * k + 1, k, device=x.device)
+    return indptr, indices.flatten(), dists.flatten(), max_dist
+
+
+class SparseFacilityLocation(object):
+    """Facility location f(S) = sum_i max_{j in S} sim(i, j) on the k-NN graph of x."""
+
+    def __init__(self, x, k, block_size=1024):
+        self.x = x
+        self.N = x.shape[0]
+        self.indptr, self.indices, self.dists, self.max_dist = knn_graph(x, k, block_size)
+        rows = torch.repeat_interleave(torch.arange(self.N, device=x.device), self.indptr[1:] - self.indptr[:-1])
+        sims = self.max_dist - self.dists
+        # Column major copy: for every candidate j the points i having j as a neighbour
+        order = torch.argsort(self.indices, stable=True)
+        self.col_rows = rows[order]
+        self.col_sims = sims[order]
+        self.col_indptr = torch.zeros(self.N + 1, dtype=torch.long, device=x.device)
+        self.col_indptr[1:] = torch.cumsum(torch.bincount(self.indices, minlength=self.N), dim=0)
+        self.max_sim = torch.zeros(self.N, device=x.device)
+
+    def marginal_gains(self, idxs):
+        # gains of a batch of candidates, summed over the CSR column segments
+        idxs = idxs.to(self.col_indptr.device)
+        starts, ends = self.col_indptr[idxs], self.col_indptr[idxs + 1]
+        lens = ends - starts
+        seg = torch.repeat_interleave(torch.arange(len(idxs), device=self.x.device), lens)
+        pos = torch.arange(int(lens.sum()), device=self.x.device) - torch.repeat_interleave(torch.cumsum(lens, 0) - lens, lens) \
+            + torch.repeat_interleave(starts, lens)
+        vals = (self.col_sims[pos] - self.max_sim[self.col_rows[pos]]).clamp(min=0)
+        return torch.zeros(len(idxs), device=self.x.device).index_add_(0, seg, vals)
+
+    def add(self, j):
+        a, b = self.col_indptr[j].item(), self.col_indptr[j + 1].item()
+        rows = self.col_rows[a:b]
+        self.max_sim[rows] = torch.max(self.max_sim[rows], self.col_sims[a:b])
+
+    def lazy_greedy_max(self, budget, epsilon=None):
+        # with epsilon the decreasing threshold greedy (models/lazy_greedy.py) instead
+        self.max_sim.zero_()
+        # with nothing selected the gain of j is the sum of its column
+        init_gains = torch.zeros(self.N, device=self.x.device).index_add_(0, self.indices, self.max_dist - self.dists)
+        if epsilon is not None:
+            return threshold_greedy(self.marginal_gains, self.add, self.N, budget, epsilon=epsilon, init_gains=init_gains)
+        return lazy_greedy(self.marginal_gains, self.add, self.N, budget, init_gains=init_gains)
+
+    def compute_gamma(self, idxs):
+        # Number of points closest to each selected element. Exact: if any selected
+        # element is among the k nearest neighbours of i, the nearest one is too.
+        idxs = torch.as_tensor(np.asarray(idxs), dtype=torch.long, device=self.x.device)
+        pos = torch.full((self.N,), -1, dtype=torch.long, device=self.x.device)
+        pos[idxs] = torch.arange(len(idxs), device=self.x.device)
+        k = self.indptr[1].item()
+        nbr_pos = pos[self.indices].view(self.N, k)
+        nbr_dists = self.dists.view(self.N, k).masked_fill(nbr_pos < 0, np.inf)
+        best = torch.argmin(nbr_dists, dim=1)
+        assign = nbr_pos.gather(1, best.unsqueeze(1)).squeeze(1)
+        orphans = torch.nonzero(assign < 0, as_tuple=False).flatten()
+        for start in range(0, len(orphans), 1024):
+            block = orphans[start:start + 1024]
+            assign[block] = torch.argmin(pairwise_distances(self.x[block], self.x[idxs]), dim=1)
+        # element of idxs each point is assigned to, as medoid_assignment
+        self.assignment = idxs[assign]
+        return torch.bincount(assign, minlength=len(idxs)).tolist()
@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import SequentialSampler, BatchSampler, Subset, TensorDataset
+
+
+## Closed-form gradients of the cross entropy loss w.r.t. the last linear layer,
+## shared by the SetFunctionLoader variants.
+## For scores z = W h + b, dL/db = softmax(z) - onehot(y) and dL/dW = dL/db (outer) h.
+
+
+def unwrap_subsets(trainset, idxs):
+    # (dataset, idxs) under any Subset / random_split wrappers
+    idxs = np.asarray(idxs)
+    while isinstance(trainset, Subset):
+        idxs = np.asarray(trainset.indices)[idxs]
+        trainset = trainset.dataset
+    return trainset, idxs
+
+
+def index_batch(trainset, idxs):
+    """(inputs, targets) tensors of the elements idxs of trainset. TensorDatasets and
+    datasets with batched_indexing set (the pre-transformed image sets of
+    load_mnist_cifar) give them with one gather, others one element at a time."""
+    dataset, idxs = unwrap_subsets(trainset, idxs)
+    if getattr(dataset, 'batched_indexing', False) or isinstance(dataset, TensorDataset):
+        return dataset[torch.from_numpy(idxs)]
+    inputs = torch.stack([dataset[x][0] for x in idxs]).type(torch.float)
+    targets = torch.tensor([dataset[x][1] for x in idxs])
+    return inputs, targets
+
+
+def dataset_targets(trainset):
+    # Labels of the whole trainset, without loading the inputs when the dataset keeps them apart
+    dataset, idxs = unwrap_subsets(trainset, np.arange(len(trainset)))
+    if getattr(dataset, 'batched_indexing', False):
+        return dataset.targets[torch.from_numpy(idxs)]
+    return torch.tensor([dataset[x][1] for x in idxs])
+
+
+def dataset_batches(trainset, batch_size, idxs=None):
+    # Sequential (inputs, targets) batches over trainset[idxs] (all of trainset by default)
+    if idxs is None:
+        idxs = np.arange(len(trainset))
+    idxs = np.asarray(idxs)
+    for batch in BatchSampler(SequentialSampler(idxs), batch_size, drop_last=False):
+        yield index_batch(trainset, idxs[batch])
+
+
+def last_layer_grads(scores, targets, embedding=None, l0_out=None, l1_out=None):
+    """Per-element last layer gradients of a whole batch.
+
+    Returns (l0_grads, l1_grads): the bias gradients softmax(scores) - onehot(targets),
+    B x C, and, when the penultimate `embedding` (B x D) is given, the weight
+    gradients as their outer product, B x C x D (None otherwise). Results are
+    written into `l0_out` / `l1_out` when those are given."""
+    l0_grads = F.softmax(scores, dim=1)
+    if l0_out is not None:
+        l0_grads = l0_out.copy_(l0_grads)
+    l0_grads[torch.arange(targets.shape[0], device=targets.device), targets] -= 1
+    if embedding is None:
+        return l0_grads, None
+    l1_grads = torch.mul(l0_grads.unsqueeze(2), embedding.unsqueeze(1), out=l1_out) if l1_out is not None \
+        else l0_grads.unsqueeze(2) * embedding.unsqueeze(1)
+    return l0_grads, l1_grads
+
+
+def compute_last_layer_grads(model, batches, N, num_classes, device, embedding=False, factored=False):
+    """Runs `model` over the (inputs, targets) `batches` (N rows in total) and fills
+    preallocated N x C bias gradients and, if `embedding` is set (the model then
+    returns (scores, embedding)), N x C x D weight gradients. With `factored` the
+    N x D embeddings are returned in place of the weight gradients."""
+    l0_grads = torch.empty((N, num_classes), device=device)
+    l1_grads = None
+    start = 0
+    with torch.no_grad():
+        for inputs, targets in batches:
+            inputs, targets = inputs.to(device), targets.to(device, non_blocking=True)
+            end = start + targets.shape[0]
+            if embedding:
+                scores, emb = model(inputs)
+                if l1_grads is None:
+                    shape = (N, emb.shape[1]) if factored else (N, num_classes, emb.shape[1])
+                    l1_grads = torch.empty(shape, device=device)
+                if factored:
+                    l1_grads[start:end] = emb
+                    last_layer_grads(scores, targets, None, l0_grads[start:end])
+                else:
+                    last_layer_grads(scores, targets, emb, l0_grads[start:end], l1_grads[start:end])
+            else:
+                last_layer_grads(model(inputs), targets, None, l0_grads[start:end])
+            start = end
+    return l0_grads, l1_grads
+
+
+def mean_last_layer_grads(l0_grads, embedding=None):
+    # Flattened mean of the per-element gradients [dL/db, dL/dW] without forming the B x C x D outer products
+    if embedding is None:
+        return l0_grads.mean(dim=0)
+    return torch.cat((l0_grads.mean(dim=0), torch.flatten(torch.matmul(l0_grads.t(), embedding) / l0_grads.shape[0])), dim=0)
+
+
+class FactoredLastLayerGrads(object):
+    """Per-element last layer gradients kept as their factors, the N x C bias
+    gradients l0 and the N x D embeddings h; the weight gradient of element i is
+    l0[i] (outer) h[i] and is only formed on indexing.
+    Indexes like the old `grads_per_elem` list of [l0, l1] pairs."""
+
+    def __init__(self, l0_grads, embedding):
+        self.l0_grads = l0_grads
+        self.embedding = embedding
+
+    def __len__(self):
+        return self.l0_grads.shape[0]
+
+    def __getitem__(self, item):
+        return [self.l0_grads[item].clone(), torch.outer(self.l0_grads[item], self.embedding[item])]
+
+    def taylor_gains(self, idxs, grads_val, eta):
+        # eta * <[l0_i, l0_i (outer) h_i], [g_b, G_W]> = eta * (l0_i . g_b + (l0_i G_W) . h_i)
+        if not torch.is_tensor(idxs):
+            idxs = torch.as_tensor(np.asarray(idxs))
+        idxs = idxs.to(self.l0_grads.device)
+        l0 = self.l0_grads.index_select(0, idxs)
+        num_classes = l0.shape[1]
+        val_l0 = grads_val[:num_classes]
+        val_l1 = grads_val[num_classes:].view(num_classes, -1)
+        return eta * (torch.matmul(l0, val_l0) + (torch.matmul(l0, val_l1) * self.embedding.index_select(0, idxs)).sum(dim=1))
+
+
+def forward_in_batches(model, inputs, num_batches):
+    # model(inputs) in num_batches forward passes, for models returning scores or (scores, embedding)
+    size = int(np.ceil(inputs.shape[0] / num_batches))
+    outs = [model(inputs[i:i + size]) for i in range(0, inputs.shape[0], size)]
+    if isinstance(outs[0], tuple):
+        return tuple(torch.cat(o, dim=0) for o in zip(*outs))
+    return torch.cat(outs, dim=0)
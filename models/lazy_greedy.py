@@ -0,0 +1,105 @@
+import heapq
+import torch
+
+
+## Lazy greedy engine shared by the facility location / CRAIG lazy_greedy_max methods.
+## The old versions pushed one (-gain, i) per element into queue.PriorityQueue (lock
+## protected, meant for threads) after a `.item()` per element, and re-evaluated the
+## stale top of the queue one row at a time. Here the initial gains are computed in
+## chunks of rows, the heap is a heapq list built with a single heapify, and stale tops
+## are re-evaluated `batch_size` at a time with one gains() call.
+
+
+def lazy_greedy(gains, add, N, budget, selected=None, init_gains=None, batch_size=8, chunk_size=32):
+    """Lazy greedy maximisation of a monotone submodular function over range(N).
+
+    gains(idxs) returns the marginal gains of a LongTensor of candidates w.r.t. the
+    current selection and add(j) adds j to it. Elements of `selected` are taken to be
+    already added. init_gains, if given, are the gains of all N elements w.r.t.
+    `selected`. Otherwise they are computed `chunk_size` candidates per gains() call,
+    the gains are memory bound and small chunks stay in cache on the CPU (on a GPU a
+    larger chunk_size is faster). Returns the selected ids, `selected` first."""
+    greedyList = [] if selected is None else list(selected)
+    budget = min(budget, N)
+    if len(greedyList) >= budget:
+        return greedyList[:budget]
+    if init_gains is None:
+        init_gains = torch.cat([gains(torch.arange(start, min(N, start + chunk_size)))
+                                for start in range(0, N, chunk_size)])
+    # Ties are broken by the smaller id, as in the PriorityQueue versions
+    heap = list(zip((-init_gains.float()).tolist(), range(N)))
+    for i in sorted(greedyList, reverse=True):
+        heap.pop(i)
+    heapq.heapify(heap)
+    # round in which the heap key of each element was computed
+    fresh = [0] * N
+    curr_round = 0
+    while len(greedyList) < budget and heap:
+        if fresh[heap[0][1]] == curr_round:
+            # up to date gain on top, an upper bound for all the others
+            bestId = heapq.heappop(heap)[1]
+            greedyList.append(bestId)
+            add(bestId)
+            curr_round += 1
+            continue
+        stale = []
+        while heap and len(stale) < batch_size and fresh[heap[0][1]] != curr_round:
+            stale.append(heapq.heappop(heap)[1])
+        for gain, i in zip(gains(torch.tensor(stale)).tolist(), stale):
+            heapq.heappush(heap, (-gain, i))
+            fresh[i] = curr_round
+    return greedyList
+
+
+def threshold_greedy(gains, add, N, budget, selected=None, epsilon=0.1, init_gains=None, block_size=64,
+                     chunk_size=32):
+    """Decreasing threshold greedy (Badanidiyuru & Vondrak, "Fast Algorithms for Maximizing
+    Submodular Functions", 2014), a (1 - 1/e - epsilon) approximation, same arguments
+    as lazy_greedy.
+
+    The threshold starts at the largest gain d and is lowered by a factor (1 - epsilon)
+    per sweep, down to epsilon * d / N (a last sweep at 0 fills the budget). A sweep
+    takes, in id order, every element whose gain reaches the threshold. The last gains
+    computed bound the current ones, only the elements whose bound reaches the threshold
+    are evaluated, up to block_size per gains() call, fewer calls than the lazy heap
+    makes (its stale tops are reevaluated batch_size at a time)."""
+    greedyList = [] if selected is None else list(selected)
+    budget = min(budget, N)
+    if len(greedyList) >= budget:
+        return greedyList[:budget]
+    if init_gains is None:
+        init_gains = torch.cat([gains(torch.arange(start, min(N, start + chunk_size)))
+                                for start in range(0, N, chunk_size)])
+    upper = init_gains.float().clone()
+    remaining = torch.ones(N, dtype=torch.bool, device=upper.device)
+    remaining[torch.tensor(greedyList, dtype=torch.long, device=upper.device)] = False
+    d = upper[remaining].max().item()
+    threshold = d
+    while len(greedyList) < budget:
+        if threshold < epsilon * d / N:
+            threshold = 0.
+        cands = torch.nonzero(remaining & (upper >= threshold)).flatten().cpu()
+        start = 0
+        size = block_size
+        while start < len(cands) and len(greedyList) < budget:
+            block = cands[start:start + size]
+            exact = gains(block).float()
+            upper[block.to(upper.device)] = exact.to(upper.device)
+            passing = torch.nonzero(exact >= threshold).flatten()
+            if len(passing) == 0:
+                start += len(block)
+                size = min(2 * size, block_size)
+                continue
+            # the first passing element is taken, the ones after it are reevaluated in
+            # the next block, sized after the gap to this one
+            p = passing[0].item()
+            j = block[p].item()
+            greedyList.append(j)
+            remaining[j] = False
+            add(j)
+            start += p + 1
+            size = min(2 * (p + 1), block_size)
+        if threshold == 0.:
+            break
+        threshold *= 1 - epsilon
+    return greedyList
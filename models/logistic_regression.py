@@ -1,4 +1,5 @@
 import torch.nn as nn
+from models.sparse_linear import SparseInputLinear
 
 
 #from sklearn import datasets
@@ -25,7 +26,7 @@ import torch.nn as nn
 class LogisticRegNet(nn.Module):
     def __init__(self, input_dim, num_classes):
         super(LogisticRegNet, self).__init__()
-        self.linear = nn.Linear(input_dim, num_classes)
+        self.linear = SparseInputLinear(input_dim, num_classes)
     
     def forward(self, x):
         scores = self.linear(x)
@@ -0,0 +1,27 @@
+import numpy as np
+import torch
+
+
+## Point -> medoid assignment for the CRAIG weights.
+## The compute_gamma methods took argmin over the whole len(idxs) x N slab
+## dist_mat[idxs] and counted the result in a Python loop. Here the argmin is taken
+## `block_size` points (columns) at a time and the counts come from one bincount.
+
+
+def medoid_assignment(dist_mat, idxs, block_size=4096, largest=False):
+    """Nearest element of idxs to every point, by dist_mat[idxs][:, point] (most similar
+    one if `largest`, for similarity matrices). dist_mat can be a tensor or an array.
+
+    Returns (gamma, assignment): gamma[j] is the number of points assigned to idxs[j]
+    (the old compute_gamma) and assignment[i] the element of idxs point i is assigned to."""
+    if isinstance(dist_mat, np.ndarray):
+        dist_mat = torch.from_numpy(dist_mat)
+    idxs = torch.as_tensor(np.asarray(idxs, dtype=np.int64), device=dist_mat.device)
+    N = dist_mat.shape[1]
+    rep = torch.empty(N, dtype=torch.long, device=dist_mat.device)
+    for start in range(0, N, block_size):
+        end = min(N, start + block_size)
+        best = dist_mat[idxs, start:end]
+        rep[start:end] = torch.argmax(best, dim=0) if largest else torch.argmin(best, dim=0)
+    gamma = torch.bincount(rep, minlength=len(idxs)).tolist()
+    return gamma, idxs[rep]
@@ -4,13 +4,18 @@ import torch
 import math
 import torch.nn.functional as F
 from torch.utils.data import SequentialSampler, BatchSampler
-from queue import PriorityQueue
+from models.remaining_set import RemainingSet
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy
+from models.medoid_assignment import medoid_assignment
+from models.last_layer_grads import dataset_batches, compute_last_layer_grads, last_layer_grads, \
+    mean_last_layer_grads, forward_in_batches, index_batch, dataset_targets, FactoredLastLayerGrads
 from torch import random
 
 
 class SetFunctionLoader_2(object):
     def __init__(self, trainset, x_val, y_val, model, loss_criterion,
-                 loss_nored, eta, device, num_classes, batch_size):
+                 loss_nored, eta, device, num_classes, batch_size, seed=None):
         self.trainset = trainset  # assume its a sequential loader.
         self.x_val = x_val.to(device)
         self.y_val = y_val.to(device)
@@ -25,91 +30,38 @@ class SetFunctionLoader_2(object):
         self.theta_init = None
         self.num_classes = num_classes
         self.batch_size = batch_size
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array(
-            [list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat(
-                [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in
-                 batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    out, l1 = self.model(inputs)
-                    data = F.softmax(out, dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                l0_grads = data - outputs
-                l1_grads = torch.zeros(self.batch_size, self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(self.batch_size):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-                cnt = cnt + 1
-            else:
-                with torch.no_grad():
-                    out, l1 = self.model(inputs)
-                    data = F.softmax(out, dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                batch_l0_grads = data - outputs
-                batch_l1_grads = torch.zeros(self.batch_size, self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(self.batch_size):
-                    for j in range(self.num_classes):
-                        batch_l1_grads[i, j, :] = batch_l0_grads[i, j] * l1[i]
-                l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
-                cnt = cnt + 1
+        batches = dataset_batches(self.trainset, self.batch_size)
+        l0_grads, embedding = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes,
+                                                       self.device, embedding=True, factored=True)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
-        grads_list = list()
-        for i in range(l0_grads.shape[0]):
-            grads_list.append([l0_grads[i], l1_grads[i]])
-        self.grads_per_elem = grads_list
+        self.grads_per_elem = FactoredLastLayerGrads(l0_grads, embedding)
 
     def _update_grads_val(self, theta_init, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores and
+            # embeddings at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                out, l1 = self.model(self.x_val)
-                scores = F.softmax(out, dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                l0_grads = scores - one_hot_label
-                l1_grads = torch.zeros(l1.shape[0], self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(l1.shape[0]):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX[0])
-                params[-2].data.sub_(self.eta * grads_currX[1])
-                out, l1 = self.model(self.x_val)
-                scores = F.softmax(out, dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                l0_grads = scores - one_hot_label
-                l1_grads = torch.zeros(l1.shape[0], self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(l1.shape[0]):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-        self.grads_val_curr = torch.cat((torch.flatten(l0_grads.mean(dim=0)), torch.flatten(l1_grads.mean(dim=0))), dim=0)
-
-    def eval_taylor_modular(self, grads):
+                self.val_scores, self.val_embedding = self.model(self.x_val)
+        with torch.no_grad():
+            scores = self.val_scores
+            if not first_init and grads_currX is not None:
+                # one step on the last layer: h (W - eta G_W)^T + (b - eta g_b)
+                scores = scores - self.eta * (torch.matmul(self.val_embedding, grads_currX[1].t()) + grads_currX[0])
+            l0_grads, _ = last_layer_grads(scores, self.y_val)
+        self.grads_val_curr = mean_last_layer_grads(l0_grads, self.val_embedding)
+
+    def eval_taylor_modular(self, idxs):
         grads_val = self.grads_val_curr
         with torch.no_grad():
-            grads_tensor = torch.cat(grads, dim=0)
-            param_update = self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val)
+            gains = self.grads_per_elem.taylor_gains(idxs, grads_val, self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
@@ -134,17 +86,16 @@ class SetFunctionLoader_2(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = list()
-        remainSet = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.l0_grads.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [torch.cat((torch.flatten(self.grads_per_elem[x][0]), torch.flatten(self.grads_per_elem[x][1])), dim=0).reshape(1, -1) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = subset_selected[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.append(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
@@ -164,7 +115,7 @@ class SetFunctionLoader_2(object):
 
 class WeightedSetFunctionLoader(object):
     def __init__(self, trainset, x_val, y_val, facloc_size, lam, model, loss_criterion,
-                 loss_nored, eta, device, num_classes, batch_size):
+                 loss_nored, eta, device, num_classes, batch_size, seed=None):
         self.trainset = trainset  # assume its a sequential loader.
         self.x_val = x_val.to(device)
         self.y_val = y_val.to(device)
@@ -181,120 +132,39 @@ class WeightedSetFunctionLoader(object):
         self.theta_init = None
         self.num_classes = num_classes
         self.batch_size = batch_size
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array(
-            [list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat(
-                [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in
-                 batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    out, l1 = self.model(inputs)
-                    data = F.softmax(out, dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                l0_grads = data - outputs
-                l1_grads = torch.zeros(self.batch_size, self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(self.batch_size):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-                cnt = cnt + 1
-            else:
-                with torch.no_grad():
-                    out, l1 = self.model(inputs)
-                    data = F.softmax(out, dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                batch_l0_grads = data - outputs
-                batch_l1_grads = torch.zeros(self.batch_size, self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(self.batch_size):
-                    for j in range(self.num_classes):
-                        batch_l1_grads[i, j, :] = batch_l0_grads[i, j] * l1[i]
-                l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
-                cnt = cnt + 1
+        batches = dataset_batches(self.trainset, self.batch_size)
+        l0_grads, embedding = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes,
+                                                       self.device, embedding=True, factored=True)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
-        grads_list = list()
-        for i in range(l0_grads.shape[0]):
-            grads_list.append([l0_grads[i], l1_grads[i]])
-        self.grads_per_elem = grads_list
+        self.grads_per_elem = FactoredLastLayerGrads(l0_grads, embedding)
 
     def _update_grads_val(self, theta_init, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores and
+            # embeddings at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                for i in range(10):
-                    batch_out, batch_l1 = self.model(self.x_val[(i) * int((len(self.x_val)) / 10): (i + 1) * int((len(self.x_val)) / 10)])
-                    batch_scores = F.softmax(batch_out, dim=1)
-                    batch_one_hot_label = torch.zeros(
-                        len(self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)]),
-                        self.num_classes).to(self.device)
-                    if (i == 0):
-                        scores = batch_scores
-                        l1 = batch_l1
-                        one_hot_label = batch_one_hot_label.scatter_(1, self.y_val[
-                                                                        (i) * int(len(self.x_val) / 10): (i + 1) * int(
-                                                                            len(self.x_val) / 10)].view(-1, 1), 1)
-                    else:
-                        scores = torch.cat((scores, batch_scores), dim=0)
-                        l1 = torch.cat((scores, batch_l1), dim=0)
-                        one_hot_label = torch.cat((one_hot_label, batch_one_hot_label.scatter_(1, self.y_val[(i) * int(
-                            len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)), dim=0)
-                l0_grads = scores - one_hot_label
-                l0_grads[0:int(self.facloc_size)] = self.lam * l0_grads[0:int(self.facloc_size)]
-                l1_grads = torch.zeros(l0_grads.shape[0], self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(l0_grads.shape[0]):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX[0])
-                params[-2].data.sub_(self.eta * grads_currX[1])
-                for i in range(10):
-                    batch_out, batch_l1 = self.model(
-                        self.x_val[(i) * int((len(self.x_val)) / 10): (i + 1) * int((len(self.x_val)) / 10)])
-                    batch_scores = F.softmax(batch_out, dim=1)
-                    batch_one_hot_label = torch.zeros(
-                        len(self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)]),
-                        self.num_classes).to(self.device)
-                    if (i == 0):
-                        scores = batch_scores
-                        l1 = batch_l1
-                        one_hot_label = batch_one_hot_label.scatter_(1, self.y_val[
-                                                                        (i) * int(len(self.x_val) / 10): (i + 1) * int(
-                                                                            len(self.x_val) / 10)].view(-1, 1), 1)
-                    else:
-                        scores = torch.cat((scores, batch_scores), dim=0)
-                        l1 = torch.cat((scores, batch_l1), dim=0)
-                        one_hot_label = torch.cat((one_hot_label, batch_one_hot_label.scatter_(1, self.y_val[(i) * int(
-                            len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)), dim=0)
-                l0_grads = scores - one_hot_label
-                l0_grads[0:int(self.facloc_size)] = self.lam * l0_grads[0:int(self.facloc_size)]
-                l1_grads = torch.zeros(l0_grads.shape[0], self.num_classes, l1.shape[1]).to(self.device)
-                for i in range(l0_grads.shape[0]):
-                    for j in range(self.num_classes):
-                        l1_grads[i, j, :] = l0_grads[i, j] * l1[i]
-        self.grads_val_curr = torch.cat((torch.flatten(l0_grads.mean(dim=0)), torch.flatten(l1_grads.mean(dim=0))), dim=0)
-
-    def eval_taylor_modular(self, grads):
+                self.val_scores, self.val_embedding = forward_in_batches(self.model, self.x_val, 10)
+        with torch.no_grad():
+            scores = self.val_scores
+            if not first_init and grads_currX is not None:
+                # one step on the last layer: h (W - eta G_W)^T + (b - eta g_b)
+                scores = scores - self.eta * (torch.matmul(self.val_embedding, grads_currX[1].t()) + grads_currX[0])
+            l0_grads, _ = last_layer_grads(scores, self.y_val)
+            l0_grads[0:int(self.facloc_size)] = self.lam * l0_grads[0:int(self.facloc_size)]
+        self.grads_val_curr = mean_last_layer_grads(l0_grads, self.val_embedding)
+
+    def eval_taylor_modular(self, idxs):
         grads_val = self.grads_val_curr
         with torch.no_grad():
-            grads_tensor = torch.cat(grads, dim=0)
-            param_update = self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val)
+            gains = self.grads_per_elem.taylor_gains(idxs, grads_val, self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
@@ -319,17 +189,16 @@ class WeightedSetFunctionLoader(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = list()
-        remainSet = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.l0_grads.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [torch.cat((torch.flatten(self.grads_per_elem[x][0]), torch.flatten(self.grads_per_elem[x][1])), dim=0).reshape(1, -1) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = subset_selected[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.append(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
@@ -358,30 +227,19 @@ class SetFunctionSupervisedCRAIG(object):
         self.model = model
 
     def distance(self, x, y, exp=2):
-
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-
-        dist = torch.pow(x - y, exp).sum(2)
-        return dist  # torch.sqrt(dist)
-
-        # dist = torch.abs(x-y).sum(2)
-        # return dist
+        return pairwise_distances(x, y, exp)
 
     def class_wise(self, bud):
 
         torch.cuda.empty_cache()
 
-        classes = torch.unique(torch.tensor(self.trainset[:][1]))
+        classes = torch.unique(dataset_targets(self.trainset))
 
         self.N = len(self.trainset)
         print(self.N)
         greedyList = []
         full_gamma = []
+        assignment = torch.zeros(self.N, dtype=torch.long)
 
         for i in classes:
 
@@ -390,6 +248,7 @@ class SetFunctionSupervisedCRAIG(object):
 
             id_first = self.compute_score(idx)
             subset, gamma = self.lazy_greedy_max(math.ceil(bud * len(idx) / self.N), id_first)
+            assignment[idx.cpu()] = idx.cpu()[self.assignment.cpu()]
 
             for j in range(len(subset)):
                 greedyList.append(idx[subset[j]])
@@ -399,6 +258,7 @@ class SetFunctionSupervisedCRAIG(object):
         random.shuffle(c)
         greedyList, full_gamma = zip(*c)
 
+        self.assignment = assignment  # medoid of every training point
         return greedyList, full_gamma
 
     def compute_score(self, idxs):
@@ -412,9 +272,7 @@ class SetFunctionSupervisedCRAIG(object):
 
         if self.if_convex:
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat(
-                    [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x
-                     in batch_idx], dim=0).type(torch.float)
+                inputs = index_batch(self.trainset, batch_idx)[0]
                 if cnt == 0:
                     vector = inputs
                     cnt = cnt + 1
@@ -424,10 +282,7 @@ class SetFunctionSupervisedCRAIG(object):
         else:
 
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat(
-                    [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x
-                     in batch_idx], dim=0).type(torch.float)
-                targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
+                inputs, targets = index_batch(self.trainset, batch_idx)
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
                 if cnt == 0:
                     with torch.no_grad():
@@ -464,65 +319,20 @@ class SetFunctionSupervisedCRAIG(object):
         return bestId
 
     def compute_gamma(self, idxs):
-
-        gamma = [0 for i in range(len(idxs))]
-
-        best = self.dist_mat[idxs]
-        # print(best[0])
-        rep = torch.argmin(best, axis=0)
-
-        for i in rep:
-            gamma[i] += 1
-
+        # also keeps the medoid of every point in self.assignment
+        gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
         return gamma
 
     def lazy_greedy_max(self, budget, id_first):
 
-        self.gains = PriorityQueue()
-        for i in range(self.curr_N):
-
-            if i == id_first:
-                continue
-            curr_gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[i])).sum()
-            self.gains.put((-curr_gain.item(), i))
-
-        numSelected = 2
-        second = self.gains.get()
-        greedyList = [id_first, second[1]]
-        self.min_dist = torch.min(self.min_dist, self.dist_mat[second[1]])
-
-        while (numSelected < budget):
-
-            # print(len(greedyList))
-            if self.gains.empty():
-                break
-
-            elif self.gains.qsize() == 1:
-                bestId = self.gains.get()[1]
-
-            else:
+        def gains(idxs):
+            rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device))
+            return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-                bestGain = -np.inf
-                bestId = None
-
-                while True:
-
-                    first = self.gains.get()
-
-                    if bestId == first[1]:
-                        break
-
-                    curr_gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[first[1]])).sum()
-                    self.gains.put((-curr_gain.item(), first[1]))
-
-                    if curr_gain.item() >= bestGain:
-                        bestGain = curr_gain.item()
-                        bestId = first[1]
-
-            greedyList.append(bestId)
-            numSelected += 1
+        def add(j):
+            self.min_dist = torch.min(self.min_dist, self.dist_mat[j])
 
-            self.min_dist = torch.min(self.min_dist, self.dist_mat[bestId])
+        greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
         gamma = self.compute_gamma(greedyList)
         return greedyList, gamma
@@ -0,0 +1,51 @@
+import torch
+
+
+## Shared pairwise distance kernel for the facility location / CRAIG set functions.
+## Replaces the `x.unsqueeze(1).expand(n, m, d)` versions of `distance(x, y)`, which
+## allocate an n x m x d temporary. For exp=2 (squared euclidean, the default
+## everywhere) it uses ||x||^2 + ||y||^2 - 2 x y^T, computed tile by tile over the
+## rows of x so that no temporary exceeds `tile_bytes`.
+
+DEFAULT_TILE_BYTES = 256 * 2 ** 20
+
+
+def _tile_rows(n, row_bytes, tile_bytes):
+    return max(1, min(n, tile_bytes // max(1, row_bytes)))
+
+
+def pairwise_distances(x, y, exp=2, out=None, tile_bytes=DEFAULT_TILE_BYTES, upcast=True):
+    """n x m matrix of sum_k (x_ik - y_jk)^exp, the same as the old distance() methods.
+
+    Half precision inputs are upcast to float32 for the accumulation when `upcast`
+    is set, the norm expansion cancels badly in float16. The result is written into
+    `out` (any device) if given and returned in the input dtype otherwise."""
+    dtype = x.dtype
+    same = x is y
+    if upcast and dtype in (torch.float16, torch.bfloat16):
+        x, y = x.float(), y.float()
+    n, m, d = x.size(0), y.size(0), x.size(1)
+    if out is None:
+        out = torch.empty((n, m), dtype=dtype, device=x.device)
+    if exp == 2:
+        # Distances are translation invariant, centering keeps the norms (and the
+        # cancellation in the expansion) small.
+        center = y.mean(dim=0, keepdim=True)
+        x, y = x - center, y - center
+        x_norm = x.pow(2).sum(1, keepdim=True)
+        y_norm = y.pow(2).sum(1).unsqueeze(0)
+        rows = _tile_rows(n, m * x.element_size(), tile_bytes)
+        for start in range(0, n, rows):
+            end = min(n, start + rows)
+            tile = torch.addmm(y_norm, x[start:end], y.t(), beta=1, alpha=-2)
+            tile.add_(x_norm[start:end]).clamp_(min=0)
+            if same:
+                # exact zeros on the diagonal, as the direct difference gives
+                tile[:, start:end].fill_diagonal_(0)
+            out[start:end] = tile
+    else:
+        rows = _tile_rows(n, m * d * x.element_size(), tile_bytes)
+        for start in range(0, n, rows):
+            end = min(n, start + rows)
+            out[start:end] = torch.pow(x[start:end].unsqueeze(1) - y.unsqueeze(0), exp).sum(2)
+    return out
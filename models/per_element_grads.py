@@ -0,0 +1,451 @@
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+from models.precision import to_storage
+
+try:  # torch >= 2.0
+    from torch.func import functional_call, grad, vmap
+except ImportError:
+    functional_call = None
+
+
+## Batched per-element gradient engine.
+## Replaces the `torch.autograd.grad(losses[item], ..., retain_graph=True)` loop
+## used by the Taylor set functions. Gradients are emitted directly as rows of a
+## flattened N x P matrix (P = total number of entries in `params`), one chunk
+## of the training data at a time.
+##
+## Three backends, tried in order:
+##   'linear' - closed form for parameters that all belong to nn.Linear layers:
+##              dL_i/dW = dL_i/dz_i (outer) a_i and dL_i/db = dL_i/dz_i, where the
+##              per-sample dL_i/dz_i come from a single backward of sum_i L_i.
+##   'vmap'   - torch.func functional_call + vmap(grad(...)) for everything else.
+##   'loop'   - the original per-element autograd loop, chunk by chunk.
+## For sparse inputs (and wide layers in general) compute_factored_linear_grads keeps
+## the dz_i / a_i factors of the 'linear' closed form instead of the N x P matrix.
+## When the N x P matrix does not fit in memory it can be written to a memory-mapped
+## .npy file instead (open_grads_store) and read back by MmapPerElementGrads, or
+## only a d << P dimensional random projection of every row kept (RandomProjection,
+## compute_sketched_grads, SketchedPerElementGrads).
+
+
+def chunk_loader(x, y, chunk_size):
+    if x.is_sparse:
+        # sparse COO tensors can not be sliced, only index_select'ed
+        return [(x.index_select(0, torch.arange(i, min(i + chunk_size, y.shape[0]), device=x.device)),
+                 y[i:i + chunk_size]) for i in range(0, y.shape[0], chunk_size)]
+    return [(x[i:i + chunk_size], y[i:i + chunk_size]) for i in range(0, y.shape[0], chunk_size)]
+
+
+def flatten_params(param_list):
+    return torch.cat([torch.flatten(p) for p in param_list])
+
+
+def num_flat_params(params):
+    return sum(p.numel() for p in params)
+
+
+class PerElementGrads(object):
+    """Read-only view of a flat N x P gradient matrix that indexes like the old
+    `grads_per_elem` list, i.e. `grads[i]` is a tuple shaped like `params`.
+    The tuple entries are views into the matrix, clone before updating in place.
+
+    The matrix may be stored in float16 / bfloat16 (see models/precision.py): rows
+    and blocks then come back in the dtype of `params` and dot upcasts `chunk_rows`
+    rows at a time (by default as many as fit in ~1MB, the upcast chunk stays in
+    cache), the products are accumulated in the dtype of `vec`."""
+
+    def __init__(self, flat_grads_mat, params, chunk_rows=None):
+        self.flat_grads_mat = flat_grads_mat
+        self.shapes = [p.shape for p in params]
+        self.numels = [p.numel() for p in params]
+        self.dtype = params[0].dtype
+        if chunk_rows is None:
+            chunk_rows = max(1, 2 ** 20 // (4 * sum(self.numels)))
+        self.chunk_rows = chunk_rows
+
+    def __len__(self):
+        return self.flat_grads_mat.shape[0]
+
+    def __getitem__(self, item):
+        return self._unflatten(self.flat_grads_mat[item].to(self.dtype))
+
+    def block(self, items):
+        # Summed gradient of the elements `items`, shaped like `params`
+        return self._unflatten(self.flat_grads_mat[items].sum(dim=0, dtype=self.dtype))
+
+    def dot(self, vec):
+        # Inner products of every per-element gradient with the flattened `vec`
+        if self.flat_grads_mat.dtype == vec.dtype:
+            return torch.matmul(self.flat_grads_mat, vec)
+        return chunked_dot(self.flat_grads_mat, vec, self.chunk_rows)
+
+    def rows(self, idxs):
+        # the same view over the elements idxs only (a LongTensor), the rows are copied
+        view = copy.copy(self)
+        view.flat_grads_mat = self.flat_grads_mat[idxs.to(self.flat_grads_mat.device)]
+        return view
+
+    def _unflatten(self, row):
+        return tuple(g.view(shape) for g, shape in zip(torch.split(row, self.numels), self.shapes))
+
+
+def chunked_dot(mat, vec, chunk_rows):
+    """mat @ vec, `chunk_rows` rows of mat at a time moved to the device (and dtype) of vec."""
+    N = mat.shape[0]
+    out = torch.empty(N, device=vec.device, dtype=vec.dtype)
+    for start in range(0, N, chunk_rows):
+        chunk = mat[start:start + chunk_rows]
+        out[start:start + chunk.shape[0]] = torch.matmul(chunk.to(vec.device, vec.dtype), vec)
+    return out
+
+
+class MmapPerElementGrads(PerElementGrads):
+    """PerElementGrads over a matrix on disk, see open_grads_store. dot streams the
+    matrix `chunk_rows` rows at a time onto the device of `vec`, rows and blocks are
+    gathered from the file and moved to `device`. Only the pages of the chunk being
+    multiplied need to be resident, so N x P can exceed the RAM (and GPU memory).
+    rows() reads the rows it keeps into memory."""
+
+    def __init__(self, flat_grads_mat, params, chunk_rows=4096, device=None):
+        super(MmapPerElementGrads, self).__init__(flat_grads_mat, params, chunk_rows)
+        self.device = device
+
+    def __getitem__(self, item):
+        return self._unflatten(self.flat_grads_mat[item].to(self.device, self.dtype))
+
+    def block(self, items):
+        return self._unflatten(self.flat_grads_mat[items].sum(dim=0, dtype=self.dtype).to(self.device))
+
+    def dot(self, vec):
+        return chunked_dot(self.flat_grads_mat, vec, self.chunk_rows)
+
+
+def open_grads_store(path, N, num_params, dtype=torch.float32):
+    """N x P tensor backed by the .npy file `path` (created, or overwritten), to be
+    filled by compute_per_element_grads(..., out=...) and wrapped in MmapPerElementGrads.
+    Stays readable with np.load(path, mmap_mode='r'), bfloat16 as its uint16 bits."""
+    if dtype == torch.bfloat16:
+        # no numpy bfloat16, the file holds the raw bits
+        mat = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(N, num_params))
+        return torch.from_numpy(mat).view(torch.bfloat16)
+    np_dtype = torch.empty((), dtype=dtype).numpy().dtype
+    return torch.from_numpy(np.lib.format.open_memmap(path, mode='w+', dtype=np_dtype, shape=(N, num_params)))
+
+
+class RandomProjection(object):
+    """Seeded P -> d random projection R with E[R R^T] = I, so that inner products
+    <R^T g, R^T v> are unbiased estimates of <g, v>.
+    'gaussian': dense R with N(0, 1/d) entries (P x d floats).
+    'sparse':   sparse JL / count sketch, every coordinate goes to one of the d
+                outputs with a random sign (two length P vectors)."""
+
+    def __init__(self, num_params, dim, kind='gaussian', seed=0, device='cpu', dtype=torch.float32):
+        gen = torch.Generator().manual_seed(seed)
+        self.num_params = num_params
+        self.dim = dim
+        self.kind = kind
+        if kind == 'gaussian':
+            self.mat = (torch.randn((num_params, dim), generator=gen, dtype=dtype) / dim ** 0.5).to(device)
+        elif kind == 'sparse':
+            self.buckets = torch.randint(0, dim, (num_params,), generator=gen).to(device)
+            self.signs = (torch.randint(0, 2, (num_params,), generator=gen) * 2 - 1).to(device=device, dtype=dtype)
+        else:
+            raise ValueError("unknown projection: %s" % kind)
+
+    def project(self, mat):
+        # mat: P vector or n x P rows, projected to d / n x d
+        if self.kind == 'gaussian':
+            return torch.matmul(mat, self.mat)
+        out = torch.zeros(mat.shape[:-1] + (self.dim,), device=mat.device, dtype=mat.dtype)
+        return out.index_add_(mat.dim() - 1, self.buckets, mat * self.signs)
+
+
+class SketchedPerElementGrads(object):
+    """Per-element gradients kept only as their sketch (N x d, see compute_sketched_grads).
+    dot works in sketch space. Rows and blocks, i.e. the gradients of picked elements,
+    are recomputed exactly from x / y on the model as it is when they are asked for,
+    so call them with the model at the parameters the sketch was taken at."""
+
+    def __init__(self, sketch, projection, model, loss_nored, x, y, params):
+        self.sketch = sketch
+        self.projection = projection
+        self.model = model
+        self.loss_nored = loss_nored
+        self.x = x
+        self.y = y
+        self.params = params
+
+    def __len__(self):
+        return self.sketch.shape[0]
+
+    def __getitem__(self, item):
+        return self.block([item])
+
+    def block(self, items):
+        # Summed gradient of the elements `items`, shaped like `params`
+        idxs = torch.as_tensor(items, device=self.y.device)
+        losses = self.loss_nored(self.model(self.x[idxs]), self.y[idxs])
+        return torch.autograd.grad(losses.sum(), self.params)
+
+    def dot(self, vec):
+        return torch.matmul(self.sketch, self.projection.project(vec))
+
+    def rows(self, idxs):
+        view = copy.copy(self)
+        view.sketch = self.sketch[idxs.to(self.sketch.device)]
+        view.x, view.y = self.x[idxs.to(self.x.device)], self.y[idxs.to(self.y.device)]
+        return view
+
+
+class FactoredLinearGrads(object):
+    """Per-element gradients of nn.Linear parameters kept as the factors of the closed
+    form, dL_i/dW = dz_i (outer) a_i and dL_i/db = dz_i, with the layer inputs a as they
+    come, i.e. sparse for a sparse first layer input. Indexes like PerElementGrads
+    without forming the N x P matrix, the outer products stay implicit in dot/block."""
+
+    def __init__(self, dzs, acts, param_owners):
+        self.dzs = dzs
+        self.acts = acts
+        # COO rows are needed for index_select, CSR is several times faster in dot()
+        self.acts_csr = dict((m, a.to_sparse_csr()) for m, a in acts.items() if a.is_sparse)
+        self.param_owners = param_owners
+        self.numels = [dzs[m].shape[1] * (acts[m].shape[1] if kind == 'weight' else 1) for m, kind in param_owners]
+
+    def __len__(self):
+        return self.dzs[self.param_owners[0][0]].shape[0]
+
+    def rows(self, idxs):
+        idxs = idxs.to(self.dzs[self.param_owners[0][0]].device)
+        dzs = dict((m, dz.index_select(0, idxs)) for m, dz in self.dzs.items())
+        acts = dict((m, a.index_select(0, idxs)) for m, a in self.acts.items())
+        acts = dict((m, a.coalesce() if a.is_sparse else a) for m, a in acts.items())
+        return FactoredLinearGrads(dzs, acts, self.param_owners)
+
+    def _rows(self, m, idxs):
+        a = self.acts[m].index_select(0, idxs)
+        return a.to_dense() if a.is_sparse else a
+
+    def __getitem__(self, item):
+        idxs = torch.tensor([item], device=self.dzs[self.param_owners[0][0]].device)
+        return tuple(torch.ger(self.dzs[m][item], self._rows(m, idxs)[0]) if kind == 'weight' else self.dzs[m][item]
+                     for m, kind in self.param_owners)
+
+    def block(self, items):
+        # Summed gradient of the elements `items`, shaped like `params`
+        idxs = torch.as_tensor(items, device=self.dzs[self.param_owners[0][0]].device)
+        grads = []
+        for m, kind in self.param_owners:
+            dz = self.dzs[m].index_select(0, idxs)
+            if kind == 'bias':
+                grads.append(dz.sum(dim=0))
+            elif self.acts[m].is_sparse:
+                grads.append(torch.sparse.mm(self.acts[m].index_select(0, idxs).t(), dz).t())
+            else:
+                grads.append(torch.matmul(dz.t(), self.acts[m].index_select(0, idxs)))
+        return tuple(grads)
+
+    def dot(self, vec):
+        # sum over layers of dz_i . (G_W a_i + g_b) for vec = flattened (G_W, g_b, ...)
+        out = 0
+        for (m, kind), g in zip(self.param_owners, torch.split(vec, self.numels)):
+            dz = self.dzs[m]
+            if kind == 'bias':
+                out = out + torch.matmul(dz, g)
+            else:
+                g = g.view(dz.shape[1], -1).t()
+                proj = torch.sparse.mm(self.acts_csr[m], g) if m in self.acts_csr else torch.matmul(self.acts[m], g)
+                out = out + (proj * dz).sum(dim=1)
+        return out
+
+
+class _UnsupportedLinearGraph(Exception):
+    pass
+
+
+def _has_train_batchnorm(model):
+    for m in model.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training:
+            return True
+    return False
+
+
+def _linear_param_owners(model, params):
+    # Maps every param to (linear module, 'weight' | 'bias'); None if any param
+    # is not owned by an nn.Linear.
+    owners = {}
+    for m in model.modules():
+        if isinstance(m, nn.Linear):
+            owners[id(m.weight)] = (m, 'weight')
+            if m.bias is not None:
+                owners[id(m.bias)] = (m, 'bias')
+    param_owners = []
+    for p in params:
+        if id(p) not in owners:
+            return None
+        param_owners.append(owners[id(p)])
+    return param_owners
+
+
+def select_backend(model, params):
+    if _has_train_batchnorm(model):
+        # Batch statistics couple the samples, only the loop matches the old semantics.
+        return 'loop'
+    if _linear_param_owners(model, params) is not None:
+        return 'linear'
+    if functional_call is not None:
+        return 'vmap'
+    return 'loop'
+
+
+def _linear_modules(param_owners):
+    modules = []
+    for m, _ in param_owners:
+        if m not in modules:
+            modules.append(m)
+    return modules
+
+
+def _linear_chunk_factors(model, loss_nored, inputs, targets, modules):
+    # inputs a and output grads dz of every module, from one forward / backward
+    acts = {}
+    pre_acts = {}
+
+    def save_io(module, inp, outp):
+        if module in acts:
+            raise _UnsupportedLinearGraph("nn.Linear called more than once per forward")
+        acts[module] = inp[0].detach()
+        pre_acts[module] = outp
+
+    handles = [m.register_forward_hook(save_io) for m in modules]
+    try:
+        losses = loss_nored(model(inputs), targets)
+    finally:
+        for h in handles:
+            h.remove()
+    if any(a.dim() != 2 for a in acts.values()):
+        raise _UnsupportedLinearGraph("closed form per-element grads need 2D nn.Linear inputs")
+
+    outs = [pre_acts[m] for m in modules]
+    return acts, dict(zip(modules, torch.autograd.grad(losses.sum(), outs)))
+
+
+def _linear_chunk_grads(model, loss_nored, inputs, targets, param_owners, out):
+    acts, dzs = _linear_chunk_factors(model, loss_nored, inputs, targets, _linear_modules(param_owners))
+    col = 0
+    for m, kind in param_owners:
+        dz = dzs[m]
+        if kind == 'bias':
+            width = dz.shape[1]
+            out[:, col:col + width] = dz
+        else:
+            a = acts[m].to_dense() if acts[m].is_sparse else acts[m]
+            width = dz.shape[1] * a.shape[1]
+            out[:, col:col + width] = (dz.unsqueeze(2) * a.unsqueeze(1)).view(dz.shape[0], width)
+        col += width
+
+
+def _vmap_chunk_grads(model, loss_nored, inputs, targets, params, out):
+    named = dict(model.named_parameters())
+    names = {id(p): n for n, p in named.items()}
+    diff_names = [names[id(p)] for p in params]
+    fixed = {n: p.detach() for n, p in named.items() if n not in diff_names}
+    fixed.update(dict(model.named_buffers()))
+
+    def sample_loss(diff_params, x, y):
+        state = dict(fixed)
+        state.update(diff_params)
+        scores = functional_call(model, state, (x.unsqueeze(0),))
+        return loss_nored(scores, y.unsqueeze(0)).sum()
+
+    diff_params = {n: named[n].detach() for n in diff_names}
+    grads = vmap(grad(sample_loss), in_dims=(None, 0, 0), randomness='different')(diff_params, inputs, targets)
+    col = 0
+    for n in diff_names:
+        g = grads[n].reshape(inputs.shape[0], -1)
+        out[:, col:col + g.shape[1]] = g
+        col += g.shape[1]
+
+
+def _loop_chunk_grads(model, loss_nored, inputs, targets, params, out):
+    losses = loss_nored(model(inputs), targets)
+    for item in range(losses.shape[0]):
+        out[item] = flatten_params(torch.autograd.grad(losses[item], params, retain_graph=True))
+
+
+def iter_per_element_grads(model, loss_nored, loader, params=None, backend=None):
+    """Yields (start, grads) for every (inputs, targets) batch of `loader`, where
+    grads is the len(targets) x P block of flattened per-element gradients."""
+    if params is None:
+        params = [p for p in model.parameters() if p.requires_grad]
+    auto_backend = backend is None
+    if auto_backend:
+        backend = select_backend(model, params)
+    param_owners = _linear_param_owners(model, params) if backend == 'linear' else None
+    num_params = num_flat_params(params)
+    start = 0
+    for inputs, targets in loader:
+        out = torch.empty((targets.shape[0], num_params), device=params[0].device, dtype=params[0].dtype)
+        if backend == 'linear':
+            try:
+                _linear_chunk_grads(model, loss_nored, inputs, targets, param_owners, out)
+            except _UnsupportedLinearGraph:
+                if not auto_backend:
+                    raise
+                # e.g. a shared Linear layer, retry this and later chunks generically
+                backend = 'vmap' if functional_call is not None else 'loop'
+        if backend == 'vmap':
+            _vmap_chunk_grads(model, loss_nored, inputs, targets, params, out)
+        elif backend == 'loop':
+            _loop_chunk_grads(model, loss_nored, inputs, targets, params, out)
+        yield start, out
+        start += targets.shape[0]
+
+
+def compute_per_element_grads(model, loss_nored, loader, params=None, out=None, backend=None, dtype=None):
+    """Fills (and returns) the N x P matrix of flattened per-element gradients,
+    where N is the total number of rows in `loader`. `out` can be preallocated
+    by the caller, e.g. on a different device. `dtype` is the storage dtype of the
+    matrix (default the dtype of params), rows are rounded to it chunk by chunk
+    (ValueError if float16 cannot hold them, see models/precision.py)."""
+    if params is None:
+        params = [p for p in model.parameters() if p.requires_grad]
+    if out is None:
+        N = sum(targets.shape[0] for _, targets in loader)
+        dtype = params[0].dtype if dtype is None else dtype
+        out = torch.zeros((N, num_flat_params(params)), device=params[0].device, dtype=dtype)
+    for start, grads in iter_per_element_grads(model, loss_nored, loader, params, backend):
+        out[start:start + grads.shape[0]] = to_storage(grads, out.dtype).to(out.device)
+    return out
+
+
+def compute_factored_linear_grads(model, loss_nored, loader, params=None):
+    """FactoredLinearGrads of `params` (all of them nn.Linear parameters) over `loader`."""
+    if params is None:
+        params = [p for p in model.parameters() if p.requires_grad]
+    param_owners = _linear_param_owners(model, params)
+    if param_owners is None or _has_train_batchnorm(model):
+        raise ValueError("factored per-element grads need nn.Linear parameters and no batchnorm in train mode")
+    modules = _linear_modules(param_owners)
+    acts = dict((m, []) for m in modules)
+    dzs = dict((m, []) for m in modules)
+    for inputs, targets in loader:
+        chunk_acts, chunk_dzs = _linear_chunk_factors(model, loss_nored, inputs, targets, modules)
+        for m in modules:
+            acts[m].append(chunk_acts[m])
+            dzs[m].append(chunk_dzs[m])
+    acts = dict((m, torch.cat(acts[m], dim=0)) for m in modules)
+    acts = dict((m, a.coalesce() if a.is_sparse else a) for m, a in acts.items())
+    return FactoredLinearGrads(dict((m, torch.cat(dzs[m], dim=0)) for m in modules), acts, param_owners)
+
+
+def compute_sketched_grads(model, loss_nored, loader, projection, params=None, backend=None):
+    """N x d matrix of the projected per-element gradients over `loader`. Every chunk
+    of gradients is projected as it comes out of iter_per_element_grads, at no point
+    more than one chunk x P block exists."""
+    if params is None:
+        params = [p for p in model.parameters() if p.requires_grad]
+    sketches = [projection.project(grads) for _, grads in
+                iter_per_element_grads(model, loss_nored, loader, params, backend)]
+    return torch.cat(sketches, dim=0)
@@ -0,0 +1,33 @@
+import torch
+
+
+## Storage precision policy of the matrices cached by the set functions: the
+## per-element gradients (flat_grads_mat / grads_per_elem) and the distance matrices
+## (dist_mat). With 'fp16' or 'bf16' they take half the memory and half the bandwidth
+## of every greedy pass over them, while the gains, row sums and dot products reading
+## them still accumulate in float32 (rows are upcast as they are read), so only the
+## stored entries are rounded. The facility location similarities const - dist are
+## formed from dist_mat row by row for the same reason, stored they would lose the
+## small distances to the rounding of values near const.
+## float16 saturates at 65504, bf16 keeps the float32 range (with 8 bit mantissas)
+## and is the safe choice for large squared distances. Blocks are written through
+## to_storage, which refuses float16 values beyond that range: rounded to inf they
+## would make const inf and every similarity const - dist NaN.
+
+PRECISIONS = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def storage_dtype(precision):
+    if precision not in PRECISIONS:
+        raise ValueError("unknown precision: %s (one of %s)" % (precision, ', '.join(sorted(PRECISIONS))))
+    return PRECISIONS[precision]
+
+
+def to_storage(t, dtype):
+    """t rounded to the storage dtype, ValueError if float16 cannot hold its values."""
+    if dtype == torch.float16 and t.numel() > 0:
+        largest = t.detach().abs().max().item()
+        if not largest <= torch.finfo(torch.float16).max:
+            raise ValueError("values up to %g overflow float16 storage (max %g), use precision 'bf16' or 'fp32'"
+                             % (largest, torch.finfo(torch.float16).max))
+    return t.to(dtype)
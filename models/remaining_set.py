@@ -0,0 +1,77 @@
+import numpy as np
+import torch
+
+
+## Remaining ground set of the greedy selection loops.
+## Replaces `remainSet = list(range(N))` + `remainSet.remove(bestId)` (O(N) per pick)
+## and the `np.array(list(remainSet))` rebuild before every `np.random.choice`.
+## The live ids are kept in the prefix of an index pool (O(1) removal by swapping
+## with the last live id) next to a boolean availability mask over range(N) that
+## can be applied to gains computed for the whole ground set.
+
+
+class RemainingSet(object):
+
+    def __init__(self, N, idxs=None, device='cpu'):
+        self.pool = np.arange(N) if idxs is None else np.array(idxs, dtype=np.int64)
+        self.size = len(self.pool)
+        self.pos = np.full(N, -1, dtype=np.int64)
+        self.pos[self.pool] = np.arange(self.size)
+        self.mask = torch.zeros(N, dtype=torch.bool, device=device)
+        self.mask[torch.from_numpy(self.pool).to(device)] = True
+        self.pool_t = None  # copy of pool on the mask device, made by sample_tensor
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, idx):
+        return self.pos[idx] >= 0
+
+    def __iter__(self):
+        return iter(self.pool[:self.size].tolist())
+
+    def remove(self, idx):
+        p = self.pos[idx]
+        if p < 0:
+            raise KeyError(idx)
+        last = self.pool[self.size - 1]
+        self.pool[p] = last
+        self.pos[last] = p
+        self.pool[self.size - 1] = idx
+        self.pos[idx] = -1
+        self.size -= 1
+        self.mask[idx] = False
+        if self.pool_t is not None:
+            self.pool_t[p] = int(last)
+            self.pool_t[self.size] = int(idx)
+
+    def indices(self):
+        # live ids in pool order (a view, do not keep across removals)
+        return self.pool[:self.size]
+
+    def sorted_indices(self):
+        # live ids in increasing order, i.e. the order of the old remainList
+        return torch.nonzero(self.mask, as_tuple=False).flatten()
+
+    def sample(self, size):
+        return self.pool[np.random.choice(self.size, size=size, replace=False)]
+
+    def sample_tensor(self, size, generator=None):
+        # size live ids without replacement as a LongTensor, drawn on the device of the
+        # mask (from `generator`, a torch.Generator on that device, if given). O(size):
+        # positions in the pool are drawn uniformly and redrawn, all of them, until they
+        # are distinct (a uniform size-subset), unless collisions are likely
+        size = min(size, self.size)
+        if self.pool_t is None:
+            self.pool_t = torch.from_numpy(self.pool).to(self.mask.device)
+        if size * size > self.size:
+            pos = torch.randperm(self.size, generator=generator, device=self.mask.device)[:size]
+        else:
+            pos = torch.randint(self.size, (size,), generator=generator, device=self.mask.device)
+            while len(torch.unique(pos)) < size:
+                pos = torch.randint(self.size, (size,), generator=generator, device=self.mask.device)
+        return self.pool_t[pos]
+
+    def masked_gains(self, gains):
+        # gains over the whole ground set, -inf on the removed ids
+        return gains.masked_fill(~self.mask, -np.inf)
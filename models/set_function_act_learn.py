@@ -3,7 +3,9 @@ import numpy as np
 import time
 import torch
 import torch.nn.functional as F
-from queue import PriorityQueue
+from models.per_element_grads import PerElementGrads, chunk_loader, compute_per_element_grads
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy
 
 class SetFunctionTaylor(object):
     
@@ -151,20 +153,7 @@ class SetFunctionFacLoc(object):
     
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      #print(x)
-      #print(x.shape)
-      #print(y.shape)
-      #print("n="+str(n)+" m="+str(m)+" d="+str(d))
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist 
+      return pairwise_distances(x, y, exp)
 
     def compute_score(self, x_trn, model):
       
@@ -191,52 +180,15 @@ class SetFunctionFacLoc(object):
     def lazy_greedy_max(self, budget, x_trn, model):
       
       id_first = self.compute_score(x_trn,model)
-      self.gains = PriorityQueue()
-      for i in range(self.N):
-        if i == id_first :
-          continue
-        curr_gain = (torch.max(self.max_sim ,self.sim_mat[i].to(self.device)) - self.max_sim).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first, second[1]]
-      self.max_sim = torch.max(self.max_sim,self.sim_mat[second[1]].to(self.device))
-
-
-      while(numSelected < budget):
-
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
 
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
+      def gains(idxs):
+        rows = self.sim_mat.index_select(0, idxs.to(self.sim_mat.device)).to(self.device)
+        return rows.sub_(self.max_sim).clamp_(min=0).sum(1)
 
-              first =  self.gains.get()
+      def add(j):
+        self.max_sim = torch.max(self.max_sim, self.sim_mat[j].to(self.device))
 
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (torch.max(self.max_sim, self.sim_mat[first[1]].to(self.device)) - self.max_sim).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
-
-          greedyList.append(bestId)
-          numSelected += 1
-
-          self.max_sim = torch.max(self.max_sim,self.sim_mat[bestId].to(self.device))
+      greedyList = lazy_greedy(gains, add, self.N, budget, [id_first])
 
       #print()
       #gamma = self.compute_gamma(greedyList)
@@ -245,7 +197,7 @@ class SetFunctionFacLoc(object):
 
 class SetFunctionBatch(object):
     
-    def __init__(self, X_val, Y_val, model, loss_criterion, loss_nored, eta, device):
+    def __init__(self, X_val, Y_val, model, loss_criterion, loss_nored, eta, device, grad_chunk_size=1024):
         
         self.x_val = X_val
         self.y_val = Y_val
@@ -257,18 +209,17 @@ class SetFunctionBatch(object):
         
         self.grads_per_elem = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
     def _compute_per_element_grads(self, x_trn,y_trn,theta_init):
         
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(x_trn)
-        losses = self.loss_nored(scores, y_trn)
         self.N_trn = y_trn.shape[0]
-        grads_vec = [0 for _ in range(self.N_trn)]   # zero is just a placeholder
-        for item in range(self.N_trn):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(x_trn, y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _simple_eval(self, grads_X, theta_init):
@@ -332,7 +283,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:   # If 1st selection, then just set it to bestId grads
-                grads_currX = list(self.grads_per_elem[bestId]) # Making it a list so that is mutable!                            
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]] # Making it a list so that is mutable!                            
             if numSelected % 500 == 0:
                 # Printing bestGain and Selection time for 1 element.
                print("numSelected:", numSelected, "Time for 1:", time.time()-t_one_elem, "bestGain:", bestGain)
@@ -1,33 +1,34 @@
+import copy
 import math
 import numpy as np
 import time
 import torch
-from queue import PriorityQueue
+from models.per_element_grads import PerElementGrads, MmapPerElementGrads, RandomProjection, \
+    SketchedPerElementGrads, chunk_loader, compute_per_element_grads, compute_factored_linear_grads, \
+    compute_sketched_grads, num_flat_params, open_grads_store
+from models.remaining_set import RemainingSet
+from models.precision import storage_dtype, to_storage
+from models.class_parallel import class_parallel, default_backend
+from models.greedi import greedi
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy, threshold_greedy
+from models.medoid_assignment import medoid_assignment
+from models.knn_graph import SparseFacilityLocation
 
 
 class SetFunctionFacLoc(object):
 
-    def __init__(self, device, train_full_loader):#, valid_loader):
+    def __init__(self, device, train_full_loader, knn=None, precision='fp32', epsilon=None):#, valid_loader):
         
         self.train_loader = train_full_loader      
         self.device = device #torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
+        self.knn = knn # k of the sparse k-NN graph backend, dense dist_mat if None
+        self.epsilon = epsilon # threshold greedy with this epsilon instead of the lazy greedy if set
     
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      #print(x)
-      #print(x.shape)
-      #print(y.shape)
-      #print("n="+str(n)+" m="+str(m)+" d="+str(d))
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist 
+      return pairwise_distances(x, y, exp)
 
     def compute_score(self, model):
       self.N = 0
@@ -38,7 +39,7 @@ class SetFunctionFacLoc(object):
           inputs_i = inputs_i.to(self.device) #, target_i.to(self.device)
           self.N += inputs_i.size()[0]
           g_is.append(inputs_i)
-        self.sim_mat = torch.zeros([self.N, self.N],dtype=torch.float32)
+        self.dist_mat = torch.zeros([self.N, self.N],dtype=storage_dtype(self.precision))
 
         first_i = True
 
@@ -49,70 +50,90 @@ class SetFunctionFacLoc(object):
             first_i = False
 
           for j, g_j in enumerate(g_is, 0):
-            self.sim_mat[i*size_b: i*size_b + g_i.size(0), j*size_b: j*size_b + g_j.size(0)] = self.distance(g_i, g_j)
-      self.const = torch.max(self.sim_mat).item()
-      self.sim_mat = self.const - self.sim_mat
-      #self.sim_mat = self.sim_mat.to(self.device)
-      dist = self.sim_mat.sum(1)
+            self.dist_mat[i*size_b: i*size_b + g_i.size(0), j*size_b: j*size_b + g_j.size(0)] = \
+                to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
+      # Similarities are const - dist_mat, formed in float32 as the rows are read. Stored
+      # as such they would lose the small distances to the rounding of values near const.
+      self.const = torch.max(self.dist_mat).item()
+      dist = torch.cat([self.sim_rows(torch.arange(start, min(self.N, start + 1024))).sum(1)
+                        for start in range(0, self.N, 1024)])
       bestId = torch.argmax(dist).item()
-      self.max_sim = self.sim_mat[bestId].to(self.device)
+      self.max_sim = self.sim_rows(torch.tensor([bestId]))[0]
       return bestId
 
+    def sim_rows(self, idxs):
+      return self.const - self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).to(self.device, torch.float32)
+
 
     def lazy_greedy_max(self, budget, model):
+      if self.knn is not None:
+        with torch.no_grad():
+          x = torch.cat([inputs_i.to(self.device) for inputs_i, _ in self.train_loader], dim=0)
+        self.N = x.shape[0]
+        return SparseFacilityLocation(x, self.knn).lazy_greedy_max(budget, self.epsilon)
       id_first = self.compute_score(model)
-      self.gains = PriorityQueue()
-      for i in range(self.N):
-        if i == id_first :
-          continue
-        curr_gain = (torch.max(self.max_sim ,self.sim_mat[i].to(self.device)) - self.max_sim).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first, second[1]]
-      self.max_sim = torch.max(self.max_sim,self.sim_mat[second[1]].to(self.device))
-
-
-      while(numSelected < budget):
-
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
 
-              first =  self.gains.get()
+      def gains(idxs):
+        return self.sim_rows(idxs).sub_(self.max_sim).clamp_(min=0).sum(1)
 
-              if bestId == first[1]: 
-                break
+      def add(j):
+        self.max_sim = torch.max(self.max_sim, self.sim_rows(torch.tensor([j]))[0])
 
-              curr_gain = (torch.max(self.max_sim, self.sim_mat[first[1]].to(self.device)) - self.max_sim).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
+      if self.epsilon is not None:
+        greedyList = threshold_greedy(gains, add, self.N, budget, [id_first], self.epsilon)
+      else:
+        greedyList = lazy_greedy(gains, add, self.N, budget, [id_first])
 
+      #print()
+      #gamma = self.compute_gamma(greedyList)
 
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
+      return greedyList
 
-          greedyList.append(bestId)
-          numSelected += 1
+    def _candidate_greedy(self, cands, x, budget):
+      # facility location of the points x, with medoids restricted to the points cands.
+      # Returns ids into cands.
+      dist = torch.cat([to_storage(self.distance(cands[start:start + 1024], x), storage_dtype(self.precision))
+                        for start in range(0, cands.shape[0], 1024)])
+      const = torch.max(dist).item()
+      sim_rows = lambda idxs: const - dist.index_select(0, idxs).float()
+      id_first = torch.argmax(torch.cat([sim_rows(torch.arange(start, min(dist.shape[0], start + 1024))).sum(1)
+                                         for start in range(0, dist.shape[0], 1024)])).item()
+      max_sim = [sim_rows(torch.tensor([id_first]))[0]]
+
+      def gains(idxs):
+        return sim_rows(idxs).sub_(max_sim[0]).clamp_(min=0).sum(1)
+
+      def add(j):
+        max_sim[0] = torch.max(max_sim[0], sim_rows(torch.tensor([j]))[0])
+
+      return lazy_greedy(gains, add, dist.shape[0], budget, [id_first])
+
+    def distributed_greedy_max(self, budget, model, num_partitions, processes=None, seed=0, timings=None):
+      """GreeDi two round greedy (models/greedi.py): every worker selects among (and
+      for) the points of one random shard (in process, one shard after the other, if
+      self.device is not the CPU), the final greedy selects among the union of
+      their selections for the whole training set. No N x N dist_mat is built, the
+      largest one is N / num_partitions square (union x N for the final round)."""
+      with torch.no_grad():
+        x = torch.cat([inputs_i.to(self.device) for inputs_i, _ in self.train_loader], dim=0)
+      self.N = x.shape[0]
 
-          self.max_sim = torch.max(self.max_sim,self.sim_mat[bestId].to(self.device))
+      def local(part):
+        part = torch.from_numpy(part).to(self.device)
+        return part[self._candidate_greedy(x[part], x[part], budget)].tolist()
 
-      #print()
-      #gamma = self.compute_gamma(greedyList)
+      def final(union):
+        union = torch.from_numpy(union).to(self.device)
+        return union[self._candidate_greedy(x[union], x, budget)].tolist()
 
-      return greedyList
+      def value(subset):
+        # facility location objective sum_i max_j (const - d_ij), up to the constant
+        dist = torch.cat([self.distance(x[start:start + 1024], x[subset]).min(1)[0]
+                          for start in range(0, self.N, 1024)])
+        return -dist.sum().item()
 
+      return greedi(local, final, self.N, num_partitions, processes, seed, value=value, device=self.device,
+                    timings=timings)
 
 class SetFunctionTaylorDeep_SuperRep(object):
     def __init__(self, x_trn, y_trn, trn_batch, x_val, y_val,valid, model, loss_criterion, loss_nored, eta,device,N_trn):
@@ -138,72 +159,83 @@ class SetFunctionTaylorDeep_SuperRep(object):
         #print(len(next(iter(self.valid_loader))[0]))
         #print(next(iter(self.valid_loader))[0][0])
 
-    def class_wise(self,bud,theta_init):
+    def class_wise(self,bud,theta_init,workers=None,backend=None):
+      # workers > 1 runs the classes concurrently (models/class_parallel.py, backend
+      # 'process' on the CPU and 'thread' otherwise by default, the threads work on
+      # copies of the model)
 
       classes = torch.unique(self.y_trn)      
 
       self.N = self.y_trn.shape[0]
       greedyList =[]
 
-      for cl in classes:
-
-        idx = (self.y_trn == cl).nonzero().flatten()
-        idx.tolist()
-
-        curr_x_trn = self.x_trn[idx]
-        curr_y_trn = self.y_trn[idx]
-        self.curr_N = curr_y_trn.shape[0]
-        #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+      if workers is None or workers == 1:
+        results = [self._class_subset(cl, bud, theta_init) for cl in classes]
+      else:
+        # memory of a class: its curr_N x P per-element grads
+        num_params = sum(p.numel() for p in self.model.parameters())
+        costs = [(self.y_trn == cl).sum().item() * num_params * 4 for cl in classes]
+        backend = backend or default_backend(self.device)
+        solve = lambda k: self._class_copy(backend)._class_subset(classes[k], bud, theta_init)
+        results = class_parallel(solve, costs, workers, backend, device=self.device)
 
-        self.train_loader =[]
-        for item in range(math.ceil(self.curr_N /self.trn_batch)):
-          inputs = curr_x_trn[item*self.trn_batch:(item+1)*self.trn_batch]
-          target  = curr_y_trn[item*self.trn_batch:(item+1)*self.trn_batch]
-          self.train_loader.append((inputs,target))
+      for class_list in results:
+        greedyList.extend(class_list)
 
-        if self.valid:
-          ind = (self.y_val == cl).nonzero().flatten()
-          ind.tolist()
-
-          curr_x_val = self.x_val[ind]
-          curr_y_val = self.y_val[ind]
-          self.curr_val_N = len(curr_y_val)
-
-          self.valid_loader =[]
-          for item in range(math.ceil(len(curr_y_val) /self.trn_batch)): #curr_y_val.shape[0]
-            inputs = curr_x_val[item*self.trn_batch:(item+1)*self.trn_batch]
-            target  = curr_y_val[item*self.trn_batch:(item+1)*self.trn_batch]
-            self.valid_loader.append((inputs,target))
+      greedyList.sort()
+      return greedyList
 
-        else:
-          self.curr_val_N = self.curr_N
-          self.valid_loader = self.train_loader
+    def _class_copy(self, backend):
+      # self for a forked worker, a copy with its own model for a thread
+      if backend == 'process':
+        return self
+      clone = copy.copy(self)
+      clone.model = copy.deepcopy(self.model)
+      return clone
+
+    def _class_subset(self, cl, bud, theta_init):
+      # selection among the points of class cl, as ids of the training set
+
+      idx = (self.y_trn == cl).nonzero().flatten()
+
+      curr_x_trn = self.x_trn[idx]
+      curr_y_trn = self.y_trn[idx]
+      self.curr_N = curr_y_trn.shape[0]
+      #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+
+      self.train_loader =[]
+      for item in range(math.ceil(self.curr_N /self.trn_batch)):
+        inputs = curr_x_trn[item*self.trn_batch:(item+1)*self.trn_batch]
+        target  = curr_y_trn[item*self.trn_batch:(item+1)*self.trn_batch]
+        self.train_loader.append((inputs,target))
+
+      if self.valid:
+        ind = (self.y_val == cl).nonzero().flatten()
+        ind.tolist()
+
+        curr_x_val = self.x_val[ind]
+        curr_y_val = self.y_val[ind]
+        self.curr_val_N = len(curr_y_val)
+
+        self.valid_loader =[]
+        for item in range(math.ceil(len(curr_y_val) /self.trn_batch)): #curr_y_val.shape[0]
+          inputs = curr_x_val[item*self.trn_batch:(item+1)*self.trn_batch]
+          target  = curr_y_val[item*self.trn_batch:(item+1)*self.trn_batch]
+          self.valid_loader.append((inputs,target))
+
+      else:
+        self.curr_val_N = self.curr_N
+        self.valid_loader = self.train_loader
         
-        subset = self.naive_greedy_max(math.ceil(bud*self.curr_N / self.N), theta_init)
+      subset = self.naive_greedy_max(math.ceil(bud*self.curr_N / self.N), theta_init)
 
-        for j in range(len(subset)):
-          greedyList.append(idx[subset[j]])
-
-      greedyList.sort()
-      return greedyList
+      return [idx[j] for j in subset]
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
 
-        losses =[]
-        for i, data_i in  enumerate(self.train_loader, 0):
-          inputs_i, target_i = data_i
-          #inputs_i, target_i = inputs_i.to(self.device), target_i.to(self.device)
-          scores = self.model(inputs_i)
-          losses.append(self.loss_nored(scores, target_i))
-
-        losses = torch.cat(losses,0)
-
-        N = self.curr_N
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-
         for name,_ in self.model.named_children():
             self.last_layer_name = name
 
@@ -214,10 +246,8 @@ class SetFunctionTaylorDeep_SuperRep(object):
             else:
                 self.last_params.append(param)
 
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item],self.last_params , retain_graph=True) #self.model.parameters()
-
-        self.grads_per_elem = grads_vec
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, self.train_loader, self.last_params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, self.last_params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -241,11 +271,11 @@ class SetFunctionTaylorDeep_SuperRep(object):
         
 
     def _update_gradients_subset(self, grads_X, element, theta_init):
-        
+        # element can also be a list of ids (block greedy), added in one go
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.last_params):#self.model.parameters()):
                 grads_X[i] += grads_e[i]
 
@@ -292,30 +322,26 @@ class SetFunctionTaylorDeep_SuperRep(object):
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
         #remainSet = set(range(self.curr_N))
-        remainList = list(range(self.curr_N))
+        remainSet = RemainingSet(self.curr_N, device=self.device)
         #t_ng_start = time.time()    # naive greedy start time
 
         flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device) ## Total parameter size
         #flat_grads_val = flat_grads_val.to(self.device)
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in remainList:
-          flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = (-1.0 * self.eta * flat_grads_mat).to(self.device)
+        flat_grads_mat = (-1.0 * self.eta * self.flat_grads_mat).to(self.device)
 
         bestGain = -np.inf # value for current iteration (validation loss)
 
         #idxs_remain = list(remainSet)
-        all_gains = torch.matmul(flat_grads_mat[remainList], flat_grads_val)
+        all_gains = remainSet.masked_gains(torch.matmul(flat_grads_mat, flat_grads_val))
         
         # print(all_gains.shape)
-        tmpid = torch.argmax(all_gains).item()
-        bestId = remainList[tmpid]
-        #bestGain = all_gains[tmpid]
+        bestId = torch.argmax(all_gains).item()
+        #bestGain = all_gains[bestId]
 
         greedySet.add(bestId)
-        remainList.remove(bestId)  
+        remainSet.remove(bestId)  
         numSelected = 1
 
         grads_currX = self._update_gradients_subset(grads_currX, bestId, theta_init)    
@@ -329,8 +355,8 @@ class SetFunctionTaylorDeep_SuperRep(object):
             # Try Using a List comprehension here!
             #bestGain = -np.inf # value for current iteration (validation loss)
 
-            #idxs_remain = list(remainSet)
-            tay_approx = self.val_losses+torch.matmul(flat_grads_mat[remainList],torch.transpose(flat_val_grads_mat,0,1))
+            idxs_remain = remainSet.sorted_indices()
+            tay_approx = self.val_losses+torch.matmul(flat_grads_mat[idxs_remain],torch.transpose(flat_val_grads_mat,0,1))
             all_gains = (torch.max(self.val_losses,tay_approx) -self.val_losses).sum(axis=0)
                       
             print(all_gains.shape)
@@ -338,12 +364,12 @@ class SetFunctionTaylorDeep_SuperRep(object):
             tmpid = torch.argmax(all_gains).item()
             #print(all_gains.item(),end=",")
             #if bestGain < all_gains[tmpid].item() :
-            bestId = remainList[tmpid]
+            bestId = idxs_remain[tmpid].item()
             bestGain = all_gains[tmpid].item()
                 
             print(bestGain,end=",")
             greedySet.add(bestId)
-            remainList.remove(bestId)            
+            remainSet.remove(bestId)            
             grads_currX = self._update_gradients_subset(grads_currX, bestId,theta_init)    
 
             flat_val_grads_mat = torch.zeros((self.curr_val_N, num_params))
@@ -384,70 +410,81 @@ class SetFunctionTaylorDeep_Super(object):
         #print(len(next(iter(self.valid_loader))[0]))
         #print(next(iter(self.valid_loader))[0][0])
 
-    def class_wise(self,bud,theta_init):
+    def class_wise(self,bud,theta_init,block_size=1,workers=None,backend=None):
+      # workers > 1 runs the classes concurrently (models/class_parallel.py, backend
+      # 'process' on the CPU and 'thread' otherwise by default, the threads work on
+      # copies of the model)
 
       classes = torch.unique(self.y_trn)      
 
       self.N = self.y_trn.shape[0]
       greedyList =[]
 
-      for cl in classes:
-
-        idx = (self.y_trn == cl).nonzero().flatten()
-        idx.tolist()
-
-        curr_x_trn = self.x_trn[idx]
-        curr_y_trn = self.y_trn[idx]
-        self.curr_N = curr_y_trn.shape[0]
-        #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+      if workers is None or workers == 1:
+        results = [self._class_subset(cl, bud, theta_init, block_size) for cl in classes]
+      else:
+        # memory of a class: its curr_N x P per-element grads
+        num_params = sum(p.numel() for p in self.model.parameters())
+        costs = [(self.y_trn == cl).sum().item() * num_params * 4 for cl in classes]
+        backend = backend or default_backend(self.device)
+        solve = lambda k: self._class_copy(backend)._class_subset(classes[k], bud, theta_init, block_size)
+        results = class_parallel(solve, costs, workers, backend, device=self.device)
 
-        self.train_loader =[]
-        for item in range(math.ceil(self.curr_N /self.trn_batch)):
-          inputs = curr_x_trn[item*self.trn_batch:(item+1)*self.trn_batch]
-          target  = curr_y_trn[item*self.trn_batch:(item+1)*self.trn_batch]
-          self.train_loader.append((inputs,target))
+      for class_list in results:
+        greedyList.extend(class_list)
 
-        if self.valid:
-          ind = (self.y_val == cl).nonzero().flatten()
-          ind.tolist()
-
-          curr_x_val = self.x_val[ind]
-          curr_y_val = self.y_val[ind]
-
-          self.valid_loader =[]
-          for item in range(math.ceil(len(curr_y_val) /self.trn_batch)): #curr_y_val.shape[0]
-            inputs = curr_x_val[item*self.trn_batch:(item+1)*self.trn_batch]
-            target  = curr_y_val[item*self.trn_batch:(item+1)*self.trn_batch]
-            self.valid_loader.append((inputs,target))
+      greedyList.sort()
+      return greedyList
 
-        else:
-          self.valid_loader = self.train_loader
+    def _class_copy(self, backend):
+      # self for a forked worker, a copy with its own model for a thread
+      if backend == 'process':
+        return self
+      clone = copy.copy(self)
+      clone.model = copy.deepcopy(self.model)
+      return clone
+
+    def _class_subset(self, cl, bud, theta_init, block_size):
+      # selection among the points of class cl, as ids of the training set
+
+      idx = (self.y_trn == cl).nonzero().flatten()
+
+      curr_x_trn = self.x_trn[idx]
+      curr_y_trn = self.y_trn[idx]
+      self.curr_N = curr_y_trn.shape[0]
+      #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+
+      self.train_loader =[]
+      for item in range(math.ceil(self.curr_N /self.trn_batch)):
+        inputs = curr_x_trn[item*self.trn_batch:(item+1)*self.trn_batch]
+        target  = curr_y_trn[item*self.trn_batch:(item+1)*self.trn_batch]
+        self.train_loader.append((inputs,target))
+
+      if self.valid:
+        ind = (self.y_val == cl).nonzero().flatten()
+        ind.tolist()
+
+        curr_x_val = self.x_val[ind]
+        curr_y_val = self.y_val[ind]
+
+        self.valid_loader =[]
+        for item in range(math.ceil(len(curr_y_val) /self.trn_batch)): #curr_y_val.shape[0]
+          inputs = curr_x_val[item*self.trn_batch:(item+1)*self.trn_batch]
+          target  = curr_y_val[item*self.trn_batch:(item+1)*self.trn_batch]
+          self.valid_loader.append((inputs,target))
+
+      else:
+        self.valid_loader = self.train_loader
         
-        subset = self.naive_greedy_max(math.ceil(bud*self.curr_N / self.N), theta_init)
+      subset = self.naive_greedy_max(math.ceil(bud*self.curr_N / self.N), theta_init, block_size)
 
-        for j in range(len(subset)):
-          greedyList.append(idx[subset[j]])
-
-      greedyList.sort()
-      return greedyList
+      return [idx[j] for j in subset]
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
 
-        losses =[]
-        for i, data_i in  enumerate(self.train_loader, 0):
-          inputs_i, target_i = data_i
-          #inputs_i, target_i = inputs_i.to(self.device), target_i.to(self.device)
-          scores = self.model(inputs_i)
-          losses.append(self.loss_nored(scores, target_i))
-
-        losses = torch.cat(losses,0)
-
-        N = self.curr_N
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-
         for name,_ in self.model.named_children():
             self.last_layer_name = name
 
@@ -458,10 +495,8 @@ class SetFunctionTaylorDeep_Super(object):
             else:
                 self.last_params.append(param)
 
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item],self.last_params , retain_graph=True) #self.model.parameters()
-
-        self.grads_per_elem = grads_vec
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, self.train_loader, self.last_params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, self.last_params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -481,11 +516,11 @@ class SetFunctionTaylorDeep_Super(object):
         
 
     def _update_gradients_subset(self, grads_X, element, theta_init):
-        
+        # element can also be a list of ids (block greedy), added in one go
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.last_params):#self.model.parameters()):
                 grads_X[i] += grads_e[i]
 
@@ -531,7 +566,7 @@ class SetFunctionTaylorDeep_Super(object):
         return flat
 
 
-    def naive_greedy_max(self, budget, theta_init):
+    def naive_greedy_max(self, budget, theta_init, block_size=1):
         self._compute_per_element_grads(theta_init)
         self._compute_init_valloss_grads(theta_init)
         #print("Computed train set gradients")
@@ -539,16 +574,13 @@ class SetFunctionTaylorDeep_Super(object):
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
         #remainSet = set(range(self.curr_N))
-        remainList = list(range(self.curr_N))
+        remainSet = RemainingSet(self.curr_N, device=self.device)
         t_ng_start = time.time()    # naive greedy start time
         flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device) ## Total parameter size
         #flat_grads_val = flat_grads_val.to(self.device)
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in remainList:
-          flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = (-1.0 * self.eta * flat_grads_mat).to(self.device)
+        flat_grads_mat = (-1.0 * self.eta * self.flat_grads_mat).to(self.device)
 
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -557,15 +589,24 @@ class SetFunctionTaylorDeep_Super(object):
             t_one_elem = time.time()
 
             #idxs_remain = list(remainSet)
-            all_gains = torch.matmul(flat_grads_mat[remainList], flat_grads_val)
+            all_gains = remainSet.masked_gains(torch.matmul(flat_grads_mat, flat_grads_val))
             
             # print(all_gains.shape)
-            tmpid = torch.argmax(all_gains).item()
-            bestId = remainList[tmpid]
-            bestGain = all_gains[tmpid]
+            if block_size > 1:
+                # top-k of the current gains, one validation gradient refresh per block
+                bestIds = torch.topk(all_gains, min(block_size, budget - numSelected))[1].tolist()
+                for bestId in bestIds:
+                    greedySet.add(bestId)
+                    remainSet.remove(bestId)
+                grads_currX = self._update_gradients_subset(grads_currX, bestIds, theta_init)
+                flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device)
+                numSelected += len(bestIds)
+                continue
+            bestId = torch.argmax(all_gains).item()
+            bestGain = all_gains[bestId]
 
             greedySet.add(bestId)
-            remainList.remove(bestId)            
+            remainSet.remove(bestId)            
             grads_currX = self._update_gradients_subset(grads_currX, bestId, theta_init)    
             flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device)                 
             
@@ -607,18 +648,6 @@ class SetFunctionTaylorDeep(object):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
 
-        losses =[]
-        for i, data_i in  enumerate(self.train_loader, 0):
-          inputs_i, target_i = data_i
-          #inputs_i, target_i = inputs_i.to(self.device), target_i.to(self.device)
-          scores = self.model(inputs_i)
-          losses.append(self.loss_nored(scores, target_i))
-
-        losses = torch.cat(losses,0)
-
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-
         '''for name,_ in self.model.named_children():
             self.last_layer_name = name
 
@@ -629,10 +658,9 @@ class SetFunctionTaylorDeep(object):
             else:
                 self.last_params.append(param)'''
 
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True) #self.last_params
-
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters()) #self.last_params
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, self.train_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -652,11 +680,11 @@ class SetFunctionTaylorDeep(object):
         
 
     def _update_gradients_subset(self, grads_X, element,theta_init):
-        
+        # element can also be a list of ids (block greedy), added in one go
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):#self.last_params):
                 grads_X[i] += grads_e[i]
 
@@ -684,7 +712,7 @@ class SetFunctionTaylorDeep(object):
         return flat
 
 
-    def naive_greedy_max(self, budget, theta_init,remainList=None):
+    def naive_greedy_max(self, budget, theta_init,remainList=None,block_size=1):
         self._compute_per_element_grads(theta_init)
         self._compute_init_valloss_grads(theta_init)
         #print("Computed train set gradients")
@@ -692,18 +720,14 @@ class SetFunctionTaylorDeep(object):
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
         #remainSet = set(range(self.N_trn))
-        if remainList == None:
-          remainList = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, remainList, device=self.device)
         
         t_ng_start = time.time()    # naive greedy start time
         flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device) ## Total parameter size
         #flat_grads_val = flat_grads_val.to(self.device)
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = (-1.0 * self.eta * flat_grads_mat).to(self.device)
+        flat_grads_mat = (-1.0 * self.eta * self.flat_grads_mat).to(self.device)
         
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -712,14 +736,23 @@ class SetFunctionTaylorDeep(object):
             t_one_elem = time.time()
 
             #idxs_remain = list(remainSet)
-            all_gains = torch.matmul(flat_grads_mat[remainList], flat_grads_val)
+            all_gains = remainSet.masked_gains(torch.matmul(flat_grads_mat, flat_grads_val))
             # print(all_gains.shape)
-            tmpid = int(torch.argmax(all_gains))
-            bestId = remainList[tmpid]
-            bestGain = all_gains[tmpid]
+            if block_size > 1:
+                # top-k of the current gains, one validation gradient refresh per block
+                bestIds = torch.topk(all_gains, min(block_size, budget - numSelected))[1].tolist()
+                for bestId in bestIds:
+                    greedySet.add(bestId)
+                    remainSet.remove(bestId)
+                grads_currX = self._update_gradients_subset(grads_currX, bestIds, theta_init)
+                flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device)
+                numSelected += len(bestIds)
+                continue
+            bestId = int(torch.argmax(all_gains))
+            bestGain = all_gains[bestId]
 
             greedySet.add(bestId)
-            remainList.remove(bestId)            
+            remainSet.remove(bestId)            
             grads_currX = self._update_gradients_subset(grads_currX, bestId, theta_init)    
             flat_grads_val = self.flatten_params(self.grads_curr_subset).to(self.device)                 
             
@@ -734,7 +767,8 @@ class SetFunctionTaylorDeep(object):
 class SetFunctionTaylor(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid,model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024, grads_store=None,
+            sketch_dim=None, sketch='gaussian', sketch_seed=0, precision='fp32', grads_cache=None):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -752,18 +786,64 @@ class SetFunctionTaylor(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
+        # .npy path: keep the N x P per-element grads memory-mapped on disk instead of in memory
+        self.grads_store = grads_store
+        # gains from sketch_dim dimensional random projections of the per-element grads
+        # ('gaussian' or 'sparse', see RandomProjection), the picks still use exact grads
+        self.sketch_dim = sketch_dim
+        self.sketch = sketch
+        self.sketch_seed = sketch_seed
+        self.precision = precision # storage dtype of the per-element grads (models/precision.py)
+        # GradientCache: per-element grads kept across calls, partially refreshed every call
+        self.grads_cache = grads_cache
+        # _compute_per_element_grads uses one of these backends, the others would be ignored
+        backends = [name for name, value in [('sketch_dim', sketch_dim), ('grads_cache', grads_cache),
+                                             ('grads_store', grads_store)] if value is not None]
+        if X_trn.is_sparse:
+            backends.insert(0, 'sparse x_trn')
+        if len(backends) > 1:
+            raise ValueError("per-element grads backends cannot be combined: %s" % ', '.join(backends))
+        if precision != 'fp32' and backends[:1] in (['sparse x_trn'], ['sketch_dim']):
+            raise ValueError("precision %s is not supported with %s, its grads are kept in fp32" % (precision, backends[0]))
+        if self.x_val.is_sparse:
+            # CSR makes the validation forward after every pick several times faster
+            self.x_val = self.x_val.to_sparse_csr()
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        if self.x_trn.is_sparse:
+            # First layer grads as sparse outer products, never densified
+            self.flat_grads_mat = None
+            self.grads_per_elem = compute_factored_linear_grads(self.model, self.loss_nored, trn_loader, params)
+            return
+        if self.sketch_dim is not None:
+            projection = RandomProjection(num_flat_params(params), self.sketch_dim, self.sketch,
+                                          self.sketch_seed, params[0].device, params[0].dtype)
+            self.flat_grads_mat = None
+            self.grads_per_elem = SketchedPerElementGrads(
+                compute_sketched_grads(self.model, self.loss_nored, trn_loader, projection, params),
+                projection, self.model, self.loss_nored, self.x_trn, self.y_trn, params)
+            return
+        if self.grads_cache is not None:
+            self.flat_grads_mat = self.grads_cache.refresh(self.model, self.loss_nored, self.x_trn, self.y_trn, params,
+                                                           self.grad_chunk_size, storage_dtype(self.precision))
+            self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
+            return
+        if self.grads_store is not None:
+            # drop the previous mapping before the file is recreated
+            self.flat_grads_mat = self.grads_per_elem = None
+            out = open_grads_store(self.grads_store, self.N_trn, num_flat_params(params), storage_dtype(self.precision))
+            self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params, out=out)
+            self.grads_per_elem = MmapPerElementGrads(self.flat_grads_mat, params, device=self.device)
+            return
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params,
+                                                        dtype=storage_dtype(self.precision))
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -780,15 +860,17 @@ class SetFunctionTaylor(object):
     #Also computes F'(theta_X) part of taylor approx
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element,theta_init):
+        # element can also be a list of ids (block greedy), added in one go
+        # sketched grads recompute the picked rows on the model, hence at theta_init
+        self.model.load_state_dict(theta_init)
+        self.model.zero_grad()
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
                 grads_X[i] += grads_e[i]
 
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         with torch.no_grad(): # perform one-step update
             for i, param in enumerate(self.model.parameters()):                                
                 param.data.sub_(self.eta * grads_X[i])  
@@ -807,8 +889,49 @@ class SetFunctionTaylor(object):
         return flat
 
 
-    def naive_greedy_max(self, budget, theta_init,remainList=None,previous=None,random=False):
+    def naive_greedy_max(self, budget, theta_init,remainList=None,previous=None,random=False,block_size=1):
         self._compute_per_element_grads(theta_init)
+        return self._greedy_max(budget, theta_init, remainList, previous, random, block_size)
+
+
+    def distributed_greedy_max(self, budget, theta_init, num_partitions, processes=None, seed=0, block_size=1,
+                               timings=None):
+        """GreeDi two round greedy (models/greedi.py): the per-element grads are computed once,
+        the greedy runs on num_partitions random shards of the ids in a pool of forked
+        workers (in process, one shard after the other, if the model is not on the CPU)
+        and once more over the union of their selections. Every greedy only reads the
+        rows of its own ids, a step costs |shard| x P in the gains, but each of its
+        budget / block_size steps still refreshes the validation gradient on the whole
+        validation set, as a step of the centralized greedy does."""
+        self._compute_per_element_grads(theta_init)
+        greedy = lambda idxs: self._shard_greedy_max(budget, theta_init, idxs, block_size)
+        return greedi(greedy, greedy, self.N_trn, num_partitions, processes, seed,
+                      value=lambda subset: -self._one_step_val_loss(subset, theta_init), device=self.device,
+                      timings=timings)
+
+
+    def _shard_greedy_max(self, budget, theta_init, idxs, block_size=1):
+        # greedy among the ids idxs (sorted numpy array) over a copy of self holding only
+        # their per-element grads, the selection is mapped back to ids of range(N_trn)
+        shard = copy.copy(self)
+        shard.grads_per_elem = self.grads_per_elem.rows(torch.from_numpy(idxs))
+        shard.N_trn = len(idxs)
+        selection = shard._greedy_max(min(budget, len(idxs)), theta_init, block_size=block_size)
+        return idxs[selection].tolist()
+
+
+    def _one_step_val_loss(self, subset, theta_init):
+        # validation loss after the one step update with the summed grads of subset
+        self.model.load_state_dict(theta_init)
+        grads = self.grads_per_elem.block(list(subset))
+        with torch.no_grad():
+            for param, g in zip(self.model.parameters(), grads):
+                param.data.sub_(self.eta * g)
+            return self.loss(self.model(self.x_val), self.y_val).item()
+
+
+    def _greedy_max(self, budget, theta_init, remainList=None, previous=None, random=False, block_size=1):
+        # greedy over the per-element grads of the last _compute_per_element_grads
         self._compute_init_valloss_grads(theta_init)
         #print("Computed train set gradients")
         numSelected = 0
@@ -816,20 +939,14 @@ class SetFunctionTaylor(object):
         greedySet = set()
         #remainSet = set(range(self.N_trn))
 
-        if remainList == None:
-          remainList = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, remainList, device=self.device)
 
-        #print(len(remainList))
+        #print(len(remainSet))
         
         t_ng_start = time.time()    # naive greedy start time
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
-        
         while(numSelected < budget):
             # Try Using a List comprehension here!
             bestGain = -np.inf # value for current iteration (validation loss)
@@ -838,19 +955,29 @@ class SetFunctionTaylor(object):
             flat_grads_val = self.flatten_params(self.grads_curr_subset)
             #idxs_remain = list(remainSet)
             if previous == None:
-              all_gains = torch.matmul(-1.0 * self.eta * flat_grads_mat[remainList], flat_grads_val)
+              all_gains = -1.0 * self.eta * self.grads_per_elem.dot(flat_grads_val)
             else:
-              all_gains = torch.matmul(-1.0 * self.eta * flat_grads_mat[remainList], flat_grads_val) - previous[remainList]
+              all_gains = -1.0 * self.eta * self.grads_per_elem.dot(flat_grads_val) - previous
             
             if random :
-              all_gains = all_gains - self.eta*torch.randn(len(remainList), device= self.device)
+              # same noise per remaining element (in increasing id order) as before
+              all_gains[remainSet.mask] -= self.eta*torch.randn(len(remainSet), device= self.device)
 
             # print(all_gains.shape)
-            tmpid = int(torch.argmax(all_gains))
-            bestId = remainList[tmpid]
-            bestGain = all_gains[tmpid]
+            all_gains = remainSet.masked_gains(all_gains)
+            if block_size > 1:
+                # top-k of the current gains, one validation gradient refresh per block
+                bestIds = torch.topk(all_gains, min(block_size, budget - numSelected))[1].tolist()
+                for bestId in bestIds:
+                    greedySet.add(bestId)
+                    remainSet.remove(bestId)
+                grads_currX = self._update_gradients_subset(grads_currX, bestIds, theta_init)
+                numSelected += len(bestIds)
+                continue
+            bestId = int(torch.argmax(all_gains))
+            bestGain = all_gains[bestId]
             greedySet.add(bestId)
-            remainList.remove(bestId)            
+            remainSet.remove(bestId)            
             grads_currX = self._update_gradients_subset(grads_currX, bestId, theta_init)                           
             # print("numSelected:", numSelected, "Time for 1:", time.time()-t_one_elem, "bestGain:", bestGain)
             '''if numSelected % 500 == 0:
@@ -874,27 +1001,16 @@ class SetFunctionTaylor(object):
 
 class SetFunctionCRAIG(object):
 
-    def __init__(self, device ,train_full_loader,if_convex):#, valid_loader): 
+    def __init__(self, device ,train_full_loader,if_convex, precision='fp32'):#, valid_loader): 
         
         self.train_loader = train_full_loader      
         self.if_convex = if_convex
         self.device = device #torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
     
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist #torch.sqrt(dist)
-
-      #dist = torch.abs(x-y).sum(2)
-      #return dist
+      return pairwise_distances(x, y, exp)
 
     def compute_score(self, model):
 
@@ -921,7 +1037,7 @@ class SetFunctionCRAIG(object):
         #temp = torch.stack(g_is[:-1])
         #print(g_is.shape)
 
-        self.dist_mat = torch.zeros([self.N, self.N],dtype=torch.float32)
+        self.dist_mat = torch.zeros([self.N, self.N],dtype=storage_dtype(self.precision))
 
         first_i = True
 
@@ -934,26 +1050,19 @@ class SetFunctionCRAIG(object):
 
           for j, g_j in  enumerate(g_is, 0):
 
-            self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = self.distance(g_i, g_j)
+            self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = \
+                to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
         
-      dist = self.dist_mat.sum(1)
+      dist = self.dist_mat.sum(1, dtype=torch.float32)
       bestId = torch.argmin(dist).item()
 
-      self.min_dist = self.dist_mat[bestId]
+      self.min_dist = self.dist_mat[bestId].float()
 
       return bestId
 
-    def compute_gamma(self,idxs):
-
-      gamma = [0 for i in range(len(idxs))]
-
-      best = self.dist_mat[idxs]
-      #print(best[0])
-      rep = torch.argmin(best,axis = 0)
-
-      for i in rep:
-        gamma[i] += 1
-
+    def compute_gamma(self, idxs):
+      # also keeps the medoid of every point in self.assignment
+      gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
       return gamma
     
 
@@ -972,7 +1081,7 @@ class SetFunctionCRAIG(object):
           bestGain = -np.inf
           
           for i in not_selected:
-            gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[i])).sum()#L([0]+greedyList+[i]) - L([0]+greedyList)  #s_0 = self.x_trn[0]
+            gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[i].float())).sum()#L([0]+greedyList+[i]) - L([0]+greedyList)  #s_0 = self.x_trn[0]
             if bestGain < gain.item():
               bestGain = gain.item()
               bestId = i
@@ -981,7 +1090,7 @@ class SetFunctionCRAIG(object):
           not_selected.remove(bestId)
           numSelected += 1
 
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId].float())
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
@@ -991,50 +1100,14 @@ class SetFunctionCRAIG(object):
       id_first = self.compute_score(model)
       #print("model updated")
 
-      self.gains = PriorityQueue()
-      for i in range(self.N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
-
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first = self.gains.get()
-              if bestId == first[1]: 
-                break
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).float()
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j].float())
 
-              if curr_gain.item() >= bestGain:
-                bestGain = curr_gain.item()
-                bestId = first[1]
-
-          greedyList.append(bestId)
-          numSelected += 1
-
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.N, budget, [id_first])
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
@@ -1044,7 +1117,7 @@ class SetFunctionCRAIG(object):
 class SetFunctionBatch(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, 
-            loss_criterion, loss_nored, eta, device):
+            loss_criterion, loss_nored, eta, device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:   # Use Validation Data to do the selection
@@ -1060,17 +1133,15 @@ class SetFunctionBatch(object):
         self.N_trn = X_trn.shape[0]
         self.grads_per_elem = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _simple_eval(self, grads_X, theta_init):
@@ -1133,7 +1204,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:   # If 1st selection, then just set it to bestId grads
-                grads_currX = list(self.grads_per_elem[bestId]) # Making it a list so that is mutable!                            
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]] # Making it a list so that is mutable!                            
             if numSelected % 500 == 0:
                 # Printing bestGain and Selection time for 1 element.
                print("numSelected:", numSelected, "Time for 1:", time.time()-t_one_elem, "bestGain:", bestGain)
@@ -1145,30 +1216,23 @@ class SetFunctionBatch(object):
 
 class SetFunctionCRAIG_Super(object):
 
-    def __init__(self, device ,X_trn, Y_trn,if_convex):#, valid_loader): 
+    def __init__(self, device ,X_trn, Y_trn,if_convex,knn=None, precision='fp32'):#, valid_loader): 
         
         self.x_trn = X_trn
         self.y_trn = Y_trn      
         self.if_convex = if_convex
         self.device = device #torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
+        self.knn = knn # k of the sparse k-NN graph backend, dense dist_mat if None
     
 
     def distance(self,x, y, exp = 2):
+      return pairwise_distances(x, y, exp)
 
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist #torch.sqrt(dist)
-
-      #dist = torch.abs(x-y).sum(2)
-      #return dist
-
-    def class_wise(self,bud,model):
+    def class_wise(self,bud,model,workers=None,backend=None,max_bytes=None):
+      # workers > 1 runs the classes concurrently (models/class_parallel.py, backend
+      # 'process' on the CPU and 'thread' otherwise by default), the dist_mat of the last
+      # class is then not kept on self
 
       torch.cuda.empty_cache()
 
@@ -1177,32 +1241,56 @@ class SetFunctionCRAIG_Super(object):
       self.N = self.y_trn.shape[0]
       greedyList =[]
       full_gamma= []
+      assignment = torch.zeros(self.N, dtype=torch.long)
 
-      for i in classes:
-
-        idx = (self.y_trn == i).nonzero().flatten()
-        idx.tolist()
+      if workers is None or workers == 1:
+        results = [self._class_subset(i, bud, model) for i in classes]
+      else:
+        # memory of a class: its curr_N x curr_N dist_mat
+        costs = [(self.y_trn == i).sum().item() ** 2 * (torch.finfo(storage_dtype(self.precision)).bits // 8)
+                 for i in classes]
+        results = class_parallel(lambda k: copy.copy(self)._class_subset(classes[k], bud, model), costs,
+                                 workers, backend or default_backend(self.device), max_bytes, self.device)
 
-        self.curr_x_trn = self.x_trn[idx]
-        self.curr_y_trn = self.y_trn[idx]
-        self.curr_N = self.curr_y_trn.shape[0]
-        #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
-
-        id_first = self.compute_score(model)
-        subset, gamma = self.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N), id_first)
+      for idx, subset, gamma, class_assignment in results:
+        assignment[idx.cpu()] = idx.cpu()[class_assignment.cpu()]
 
         for j in range(len(subset)):
           greedyList.append(idx[subset[j]])
           full_gamma.append(gamma[j])
 
+      self.assignment = assignment  # medoid of every training point
       return greedyList, full_gamma
 
+    def _class_subset(self, i, bud, model):
+      # selection among the points of class i: their ids, the subset (ids into them),
+      # its gammas and the medoid of every point
+
+      idx = (self.y_trn == i).nonzero().flatten()
+
+      self.curr_x_trn = self.x_trn.index_select(0, idx)
+      if self.curr_x_trn.is_sparse:
+        # sparse inputs (dss.py sparse mode): the distances need dense rows, one class at a time
+        self.curr_x_trn = self.curr_x_trn.to_dense()
+      self.curr_y_trn = self.y_trn[idx]
+      self.curr_N = self.curr_y_trn.shape[0]
+      #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+
+      if self.knn is not None:
+        facloc = SparseFacilityLocation(torch.cat(self._class_features(model), dim=0), self.knn)
+        subset = facloc.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N))
+        gamma = facloc.compute_gamma(subset)
+        self.assignment = facloc.assignment
+      else:
+        id_first = self.compute_score(model)
+        subset, gamma = self.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N), id_first)
+      return idx, subset, gamma, self.assignment
 
-    def compute_score(self, model):
 
-      with torch.no_grad():
+    def _class_features(self, model):
+      # gradient proxies (or inputs if convex) of the current class, in batches
 
-        self.dist_mat = torch.zeros([self.curr_N, self.curr_N],dtype=torch.float32)
+      with torch.no_grad():
 
         train_batch_size = 1200
         train_loader = []
@@ -1228,6 +1316,15 @@ class SetFunctionCRAIG_Super(object):
           else:
             g_is.append(inputs_i)
 
+      return g_is
+
+    def compute_score(self, model):
+
+      g_is = self._class_features(model)
+
+      with torch.no_grad():
+
+        self.dist_mat = torch.zeros([self.curr_N, self.curr_N],dtype=storage_dtype(self.precision))
 
         first_i = True
         for i, g_i in  enumerate(g_is, 0):
@@ -1238,80 +1335,34 @@ class SetFunctionCRAIG_Super(object):
             first_i = False
 
           for j, g_j in  enumerate(g_is, 0):
-              self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = self.distance(g_i, g_j)
+              self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = \
+                  to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
 
-      dist = self.dist_mat.sum(1)
+      dist = self.dist_mat.sum(1, dtype=torch.float32)
       bestId = torch.argmin(dist).item()
 
       self.dist_mat = self.dist_mat.to(self.device)
 
-      self.min_dist = self.dist_mat[bestId].to(self.device)
+      self.min_dist = self.dist_mat[bestId].to(self.device, torch.float32)
 
       return bestId
 
-    def compute_gamma(self,idxs):
-
-      gamma = [0 for i in range(len(idxs))]
-
-      best = self.dist_mat[idxs]
-      #print(best[0])
-      rep = torch.argmin(best,axis = 0)
-
-      for i in rep:
-        gamma[i] += 1
-
+    def compute_gamma(self, idxs):
+      # also keeps the medoid of every point in self.assignment
+      gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
       return gamma
     
     def lazy_greedy_max(self, budget, id_first):
 
 
-      self.gains = PriorityQueue()
-      for i in range(self.curr_N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
-
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).float()
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j].float())
 
-          greedyList.append(bestId)
-          numSelected += 1
-
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
@@ -1321,7 +1372,7 @@ class SetFunctionCRAIG_Super(object):
 class SetFunctionBatch(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, 
-            loss_criterion, loss_nored, eta, device):
+            loss_criterion, loss_nored, eta, device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:   # Use Validation Data to do the selection
@@ -1337,17 +1388,15 @@ class SetFunctionBatch(object):
         self.N_trn = X_trn.shape[0]
         self.grads_per_elem = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _simple_eval(self, grads_X, theta_init):
@@ -1409,7 +1458,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:   # If 1st selection, then just set it to bestId grads
-                grads_currX = list(self.grads_per_elem[bestId]) # Making it a list so that is mutable!                            
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]] # Making it a list so that is mutable!                            
             if numSelected % 500 == 0:
                 # Printing bestGain and Selection time for 1 element.
                print("numSelected:", numSelected, "Time for 1:", time.time()-t_one_elem, "bestGain:", bestGain)
@@ -1424,7 +1473,7 @@ class SetFunctionBatch(object):
 class SetFunctionCompare(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid,model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -1442,18 +1491,16 @@ class SetFunctionCompare(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
     ## Non-tay version
     def _simple_eval(self, grads_X, theta_init):
@@ -1517,10 +1564,11 @@ class SetFunctionCompare(object):
     #Also computes F'(theta_X) part of taylor approx
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element,theta_init):
+        # element can also be a list of ids (block greedy), added in one go
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
                 grads_X[i] += grads_e[i]
 
@@ -1551,8 +1599,7 @@ class SetFunctionCompare(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
-        remainSet = set(range(self.N_trn))
-        remainList = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.device)
 
         old_grads_currX = []   # basically stores grads_X for the current greedy set X
         old_greedySet = set()
@@ -1562,10 +1609,7 @@ class SetFunctionCompare(object):
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         l2_diff_all = torch.zeros(budget)
         l1_diff_all = torch.zeros(budget)
@@ -1582,14 +1626,12 @@ class SetFunctionCompare(object):
             
             t_one_elem = time.time()
             flat_grads_val = self.flatten_params(self.grads_curr_subset)
-            idxs_remain = list(remainSet)
-            curr_gains = torch.matmul(-1.0 * self.eta * flat_grads_mat[idxs_remain], flat_grads_val)
             all_gains = torch.matmul(-1.0 * self.eta * flat_grads_mat, flat_grads_val)
+            curr_gains = remainSet.masked_gains(all_gains)
             
             # print(all_gains.shape)
-            tmpid = int(torch.argmax(curr_gains))
-            bestId = idxs_remain[tmpid]
-            bestGain = curr_gains[tmpid]
+            bestId = int(torch.argmax(curr_gains))
+            bestGain = curr_gains[bestId]
 
             # Update the greedy set and remaining set
             greedySet.add(bestId)
@@ -1658,7 +1700,7 @@ class SetFunctionCompare(object):
 class SetFunctionTaylorMeta(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid,model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -1676,18 +1718,16 @@ class SetFunctionTaylorMeta(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -1704,10 +1744,11 @@ class SetFunctionTaylorMeta(object):
     #Also computes F'(theta_X) part of taylor approx
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element,theta_init):
+        # element can also be a list of ids (block greedy), added in one go
+        grads_e = self.grads_per_elem.block(element) if isinstance(element, list) else self.grads_per_elem[element]
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in grads_e]
         else:
-            grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
                 grads_X[i] += grads_e[i]
 
@@ -1738,16 +1779,12 @@ class SetFunctionTaylorMeta(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
-        remainSet = set(range(self.N_trn))
-        remainList = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.device)
         t_ng_start = time.time()    # naive greedy start time
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -1755,12 +1792,10 @@ class SetFunctionTaylorMeta(object):
             bestId = -1 # element to pick
             t_one_elem = time.time()
             flat_grads_val = self.flatten_params(self.grads_curr_subset)
-            idxs_remain = list(remainSet)
-            all_gains = torch.matmul(-1.0 * self.eta * flat_grads_mat[idxs_remain], flat_grads_val)
+            all_gains = remainSet.masked_gains(torch.matmul(-1.0 * self.eta * flat_grads_mat, flat_grads_val))
             # print(all_gains.shape)
-            tmpid = int(torch.argmax(all_gains))
-            bestId = idxs_remain[tmpid]
-            bestGain = all_gains[tmpid]
+            bestId = int(torch.argmax(all_gains))
+            bestGain = all_gains[bestId]
 
             # for i in remainSet:
             #     grads_i = self.flatten_params(self.grads_per_elem[i])
@@ -1,26 +1,28 @@
+import copy
 import numpy as np
 import torch
-from queue import PriorityQueue
 import torch.nn.functional as F
 import apricot
 from torch.utils.data import random_split, SequentialSampler, BatchSampler
 import math
+from models.pairwise_distance import pairwise_distances
+from models.precision import storage_dtype, to_storage
+from models.class_parallel import class_parallel, default_backend
+from models.lazy_greedy import lazy_greedy
+from models.medoid_assignment import medoid_assignment
+from models.knn_graph import SparseFacilityLocation
+from models.last_layer_grads import index_batch, dataset_targets
 
 class SetFunction(object):
 
-    def __init__(self, device, train_full_loader, if_convex):
+    def __init__(self, device, train_full_loader, if_convex, precision='fp32'):
         self.train_loader = train_full_loader
         self.if_convex = if_convex
         self.device = device  # torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
 
     def distance(self, x, y, exp=2):
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-        dist = torch.pow(x - y, exp).sum(2)
-        return dist
+        return pairwise_distances(x, y, exp)
 
     def compute_score(self, model):
 
@@ -41,7 +43,7 @@ class SetFunction(object):
                 else:
                     g_is.append(inputs_i)
 
-            self.dist_mat = torch.zeros([self.N, self.N], dtype=torch.float32)
+            self.dist_mat = torch.zeros([self.N, self.N], dtype=storage_dtype(self.precision))
             first_i = True
             for i, g_i in enumerate(g_is, 0):
                 # print(i,end=",")
@@ -50,18 +52,16 @@ class SetFunction(object):
                     first_i = False
                 for j, g_j in enumerate(g_is, 0):
                     self.dist_mat[i * size_b: i * size_b + g_i.size(0),
-                    j * size_b: j * size_b + g_j.size(0)] = self.distance(g_i, g_j)
-        dist = self.dist_mat.sum(1)
+                    j * size_b: j * size_b + g_j.size(0)] = \
+                        to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
+        dist = self.dist_mat.sum(1, dtype=torch.float32)
         bestId = torch.argmin(dist).item()
-        self.min_dist = self.dist_mat[bestId].to(self.device)
+        self.min_dist = self.dist_mat[bestId].to(self.device, torch.float32)
         return bestId
 
     def compute_gamma(self, idxs):
-        gamma = [0 for i in range(len(idxs))]
-        best = self.dist_mat[idxs].to(self.device)
-        rep = torch.argmin(best, axis=0)
-        for i in rep:
-            gamma[i] += 1
+        # also keeps the medoid of every point in self.assignment
+        gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
         return gamma
 
     def naive_greedy_max(self, budget, model):
@@ -84,42 +84,21 @@ class SetFunction(object):
             greedyList.append(bestId)
             not_selected.remove(bestId)
             numSelected += 1
-            self.min_dist = torch.min(self.min_dist, self.dist_mat[bestId])  # .to(self.device))
+            self.min_dist = torch.min(self.min_dist, self.dist_mat[bestId].float())  # .to(self.device))
         gamma = self.compute_gamma(greedyList)
         return greedyList, gamma
 
     def lazy_greedy_max(self, budget, model):
         id_first = self.compute_score(model)
-        self.gains = PriorityQueue()
-        for i in range(self.N):
-            if i == id_first:
-                continue
-            curr_gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[i])).sum()
-            self.gains.put((-curr_gain.item(), i))
-        numSelected = 2
-        second = self.gains.get()
-        greedyList = [id_first, second[1]]
-        self.min_dist = torch.min(self.min_dist, self.dist_mat[second[1]])
-        while (numSelected < budget):
-            if self.gains.empty():
-                break
-            elif self.gains.qsize() == 1:
-                bestId = self.gains.get()[1]
-            else:
-                bestGain = -np.inf
-                bestId = None
-                while True:
-                    first = self.gains.get()
-                    if bestId == first[1]:
-                        break
-                    curr_gain = (self.min_dist - torch.min(self.min_dist, self.dist_mat[first[1]])).sum()
-                    self.gains.put((-curr_gain.item(), first[1]))
-                    if curr_gain.item() >= bestGain:
-                        bestGain = curr_gain.item()
-                        bestId = first[1]
-            greedyList.append(bestId)
-            numSelected += 1
-            self.min_dist = torch.min(self.min_dist, self.dist_mat[bestId])
+
+        def gains(idxs):
+            rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).float()
+            return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
+
+        def add(j):
+            self.min_dist = torch.min(self.min_dist, self.dist_mat[j].float())
+
+        greedyList = lazy_greedy(gains, add, self.N, budget, [id_first])
         gamma = self.compute_gamma(greedyList)
         return greedyList, gamma
 
@@ -132,13 +111,7 @@ class SetFunction2(object):
         self.device = device
 
     def distance(self, x, y, exp=2):
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-        dist = torch.exp(-1 * torch.pow(x - y, 2).sum(2))
-        return dist
+        return torch.exp(-1 * pairwise_distances(x, y))
 
     def compute_score(self, model):
         self.N = 0
@@ -171,11 +144,8 @@ class SetFunction2(object):
         self.dist_mat = self.dist_mat.cpu().numpy()
 
     def compute_gamma(self, idxs):
-        gamma = [0 for i in range(len(idxs))]
-        best = self.dist_mat[idxs]  # .to(self.device)
-        rep = np.argmax(best, axis=0)
-        for i in rep:
-            gamma[i] += 1
+        # also keeps the medoid of every point in self.assignment
+        gamma, self.assignment = medoid_assignment(self.dist_mat, idxs, largest=True)
         return gamma
 
     def get_similarity_kernel(self):
@@ -216,13 +186,7 @@ class DeepSetFunction(object):
         self.batch_size = batch_size
 
     def distance(self, x, y, exp=2):
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-        dist = torch.exp(-1 * torch.pow(x - y, 2).sum(2))
-        return dist
+        return torch.exp(-1 * pairwise_distances(x, y))
 
     def compute_score(self, model_params):
         self.model.load_state_dict(model_params)
@@ -232,10 +196,7 @@ class DeepSetFunction(object):
             [list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
         with torch.no_grad():
             for batch_idx in batch_wise_indices:
-                inputs_i = torch.cat(
-                    [self.trainset[x][0].view(-1, self.trainset[x][0].shape[0], self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x
-                     in batch_idx], dim=0).type(torch.float)
-                target_i = torch.tensor([self.trainset[x][1] for x in batch_idx])
+                inputs_i, target_i = index_batch(self.trainset, batch_idx)
                 inputs_i, target_i = inputs_i.to(self.device), target_i.to(self.device)
                 self.N += inputs_i.size()[0]
                 if not self.if_convex:
@@ -258,15 +219,12 @@ class DeepSetFunction(object):
         self.dist_mat = self.dist_mat.cpu().numpy()
 
     def compute_gamma(self, idxs):
-        gamma = [0 for i in range(len(idxs))]
-        best = self.dist_mat[idxs]  # .to(self.device)
-        rep = np.argmax(best, axis=0)
-        for i in rep:
-            gamma[i] += 1
+        # also keeps the medoid of every point in self.assignment
+        gamma, self.assignment = medoid_assignment(self.dist_mat, idxs, largest=True)
         return gamma
 
     def get_similarity_kernel(self):
-        targets = np.array([self.trainset[x][1] for x in range(self.N_trn)])
+        targets = dataset_targets(self.trainset).numpy()
         kernel = np.zeros((targets.shape[0], targets.shape[0]))
         for target in np.unique(targets):
             x = np.where(targets == target)[0]
@@ -289,30 +247,23 @@ class DeepSetFunction(object):
 
 class SetFunctionCRAIG_Super(object):
 
-    def __init__(self, device ,X_trn, Y_trn,if_convex):#, valid_loader): 
+    def __init__(self, device ,X_trn, Y_trn,if_convex,knn=None, precision='fp32'):#, valid_loader): 
         
         self.x_trn = X_trn
         self.y_trn = Y_trn      
         self.if_convex = if_convex
         self.device = device #torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
+        self.knn = knn # k of the sparse k-NN graph backend, dense dist_mat if None
     
 
     def distance(self,x, y, exp = 2):
+      return pairwise_distances(x, y, exp)
 
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist #torch.sqrt(dist)
-
-      #dist = torch.abs(x-y).sum(2)
-      #return dist
-
-    def class_wise(self,bud,model):
+    def class_wise(self,bud,model,workers=None,backend=None,max_bytes=None):
+      # workers > 1 runs the classes concurrently (models/class_parallel.py, backend
+      # 'process' on the CPU and 'thread' otherwise by default), the dist_mat of the last
+      # class is then not kept on self
 
       torch.cuda.empty_cache()
 
@@ -321,33 +272,57 @@ class SetFunctionCRAIG_Super(object):
       self.N = self.y_trn.shape[0]
       greedyList =[]
       full_gamma= []
+      assignment = torch.zeros(self.N, dtype=torch.long)
 
-      for i in classes:
+      if workers is None or workers == 1:
+        results = [self._class_subset(i, bud, model) for i in classes]
+      else:
+        # memory of a class: its curr_N x curr_N dist_mat
+        costs = [(self.y_trn == i).sum().item() ** 2 * (torch.finfo(storage_dtype(self.precision)).bits // 8)
+                 for i in classes]
+        results = class_parallel(lambda k: copy.copy(self)._class_subset(classes[k], bud, model), costs,
+                                 workers, backend or default_backend(self.device), max_bytes, self.device)
 
-        idx = (self.y_trn == i).nonzero().flatten()
-        idx.tolist()
-
-        self.curr_x_trn = self.x_trn[idx]
-        self.curr_y_trn = self.y_trn[idx]
-        self.curr_N = self.curr_y_trn.shape[0]
-        #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
-
-        id_first = self.compute_score(model)
-        subset, gamma = self.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N), id_first)
-        #print("Class ",i,"fnished")
+      for idx, subset, gamma, class_assignment in results:
+        assignment[idx.cpu()] = idx.cpu()[class_assignment.cpu()]
 
         for j in range(len(subset)):
           greedyList.append(idx[subset[j]])
           full_gamma.append(gamma[j])
 
+      self.assignment = assignment  # medoid of every training point
       return greedyList, full_gamma
 
+    def _class_subset(self, i, bud, model):
+      # selection among the points of class i: their ids, the subset (ids into them),
+      # its gammas and the medoid of every point
+
+      idx = (self.y_trn == i).nonzero().flatten()
+
+      self.curr_x_trn = self.x_trn.index_select(0, idx)
+      if self.curr_x_trn.is_sparse:
+        # sparse inputs (dss.py sparse mode): the distances need dense rows, one class at a time
+        self.curr_x_trn = self.curr_x_trn.to_dense()
+      self.curr_y_trn = self.y_trn[idx]
+      self.curr_N = self.curr_y_trn.shape[0]
+      #self.curr_bud = math.ceil(bud*self.curr_N / self.N)
+
+      if self.knn is not None:
+        facloc = SparseFacilityLocation(torch.cat(self._class_features(model), dim=0), self.knn)
+        subset = facloc.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N))
+        gamma = facloc.compute_gamma(subset)
+        self.assignment = facloc.assignment
+      else:
+        id_first = self.compute_score(model)
+        subset, gamma = self.lazy_greedy_max(math.ceil(bud*self.curr_N / self.N), id_first)
+      #print("Class ",i,"fnished")
+      return idx, subset, gamma, self.assignment
 
-    def compute_score(self, model):
 
-      with torch.no_grad():
+    def _class_features(self, model):
+      # gradient proxies (or inputs if convex) of the current class, in batches
 
-        self.dist_mat = torch.zeros([self.curr_N, self.curr_N],dtype=torch.float32).to(self.device)
+      with torch.no_grad():
 
         train_batch_size = 2400
         train_loader = []
@@ -369,10 +344,19 @@ class SetFunctionCRAIG_Super(object):
             y_i = torch.zeros(target_i.size(0),scores_i.size(1)).to(self.device)
             y_i[range(y_i.shape[0]), target_i]=1
 
-            g_is.append(F.softmax(scores_i, dim=1), - y_i)
+            g_is.append(F.softmax(scores_i, dim=1) - y_i)
           else:
             g_is.append(inputs_i)
 
+      return g_is
+
+    def compute_score(self, model):
+
+      g_is = self._class_features(model)
+
+      with torch.no_grad():
+
+        self.dist_mat = torch.zeros([self.curr_N, self.curr_N],dtype=storage_dtype(self.precision)).to(self.device)
 
         first_i = True
         for i, g_i in  enumerate(g_is, 0):
@@ -383,81 +367,34 @@ class SetFunctionCRAIG_Super(object):
             first_i = False
 
           for j, g_j in  enumerate(g_is, 0):
-              self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = self.distance(g_i, g_j)
+              self.dist_mat[i*size_b: i*size_b + g_i.size(0) ,j*size_b: j*size_b + g_j.size(0)] = \
+                  to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
 
-      dist = self.dist_mat.sum(1)
+      dist = self.dist_mat.sum(1, dtype=torch.float32)
       bestId = torch.argmin(dist).item()
 
       #self.dist_mat = self.dist_mat.to(self.device)
 
-      self.min_dist = self.dist_mat[bestId]#.to(self.device)
+      self.min_dist = self.dist_mat[bestId].float()#.to(self.device)
 
       return bestId
 
-    def compute_gamma(self,idxs):
-
-      gamma = [0 for i in range(len(idxs))]
-
-      #self.dist_mat = self.dist_mat.cpu()
-      best = self.dist_mat[idxs]
-      #print(best[0])
-      rep = torch.argmin(best,axis = 0)
-
-      for i in rep:
-        gamma[i] += 1
-
+    def compute_gamma(self, idxs):
+      # also keeps the medoid of every point in self.assignment
+      gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
       return gamma
     
     def lazy_greedy_max(self, budget, id_first):
 
 
-      self.gains = PriorityQueue()
-      for i in range(self.curr_N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).float()
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j].float())
 
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
-
-          greedyList.append(bestId)
-          numSelected += 1
-
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
@@ -465,29 +402,18 @@ class SetFunctionCRAIG_Super(object):
 
 class SetFunctionCRAIG_Super_MNIST(object):
 
-    def __init__(self, trainset, trn_batch_size, if_convex, num_classes, model, device):  # , valid_loader):
+    def __init__(self, trainset, trn_batch_size, if_convex, num_classes, model, device, precision='fp32'):  # , valid_loader):
 
         self.trainset = trainset
         self.trn_batch_size = trn_batch_size
         self.if_convex = if_convex
         self.device = device  # torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.precision = precision # storage dtype of dist_mat: 'fp32', 'fp16' or 'bf16' (models/precision.py)
         self.model = model
         self.num_classes = num_classes
 
     def distance(self, x, y, exp=2):
-
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-
-        dist = torch.pow(x - y, exp).sum(2)
-        return dist  # torch.sqrt(dist)
-
-        # dist = torch.abs(x-y).sum(2)
-        # return dist
+        return pairwise_distances(x, y, exp)
 
     def class_wise(self, bud):
 
@@ -496,12 +422,13 @@ class SetFunctionCRAIG_Super_MNIST(object):
         self.N = len(self.trainset)
         # print(self.N)
 
-        targets = torch.tensor([self.trainset[x][1] for x in range(self.N)])
+        targets = dataset_targets(self.trainset)
 
         classes = torch.unique(targets)
 
         greedyList = []
         full_gamma = []
+        assignment = torch.zeros(self.N, dtype=torch.long)
 
         for i in classes:
 
@@ -512,6 +439,7 @@ class SetFunctionCRAIG_Super_MNIST(object):
             id_first = self.compute_score(idx)
             subset, gamma = self.lazy_greedy_max(math.ceil(bud * self.curr_N / self.N), id_first)
             print("Class",i,"finished")
+            assignment[idx.cpu()] = idx.cpu()[self.assignment.cpu()]
 
             for j in range(len(subset)):
                 greedyList.append(idx[subset[j]])
@@ -521,12 +449,13 @@ class SetFunctionCRAIG_Super_MNIST(object):
         random.shuffle(c)
         greedyList, full_gamma = zip(*c)
 
+        self.assignment = assignment  # medoid of every training point
         return greedyList, full_gamma
 
 
     def compute_score(self, model):
 
-        self.dist_mat = torch.zeros([self.curr_N, self.curr_N], dtype=torch.float32)
+        self.dist_mat = torch.zeros([self.curr_N, self.curr_N], dtype=storage_dtype(self.precision))
 
         actual_idxs = np.array(idxs)
         batch_wise_indices = [actual_idxs[x] for x in
@@ -535,10 +464,7 @@ class SetFunctionCRAIG_Super_MNIST(object):
 
         if self.if_convex:
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat(
-                    [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x
-                     in
-                     batch_idx], dim=0).type(torch.float)
+                inputs = index_batch(self.trainset, batch_idx)[0]
                 if cnt == 0:
                     vector = inputs
                     cnt = cnt + 1
@@ -548,11 +474,7 @@ class SetFunctionCRAIG_Super_MNIST(object):
         else:
 
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat(
-                    [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x
-                     in
-                     batch_idx], dim=0).type(torch.float)
-                targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
+                inputs, targets = index_batch(self.trainset, batch_idx)
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
                 if cnt == 0:
                     with torch.no_grad():
@@ -577,80 +499,33 @@ class SetFunctionCRAIG_Super_MNIST(object):
                 g_j = vector[j * self.trn_batch_size:(j + 1) * self.trn_batch_size]
                 self.dist_mat[i * self.trn_batch_size: (i + 1) * self.trn_batch_size,
                 j * self.trn_batch_size: (j + 1) * self.trn_batch_size] \
-                    = self.distance(g_i, g_j)
+                    = to_storage(self.distance(g_i, g_j), self.dist_mat.dtype)
 
-        dist = self.dist_mat.sum(1)
+        dist = self.dist_mat.sum(1, dtype=torch.float32)
         bestId = torch.argmin(dist).item()
 
         self.dist_mat = self.dist_mat.to(self.device)
 
-        self.min_dist = self.dist_mat[bestId].to(self.device)
+        self.min_dist = self.dist_mat[bestId].to(self.device, torch.float32)
 
         return bestId
 
-    def compute_gamma(self,idxs):
-
-      gamma = [0 for i in range(len(idxs))]
-
-      best = self.dist_mat[idxs]
-      #print(best[0])
-      rep = torch.argmin(best,axis = 0)
-
-      for i in rep:
-        gamma[i] += 1
-
+    def compute_gamma(self, idxs):
+      # also keeps the medoid of every point in self.assignment
+      gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
       return gamma
     
     def lazy_greedy_max(self, budget, id_first):
 
 
-      self.gains = PriorityQueue()
-      for i in range(self.curr_N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
-
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device)).float()
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-          greedyList.append(bestId)
-          numSelected += 1
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j].float())
 
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
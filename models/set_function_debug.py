@@ -1,12 +1,13 @@
 import numpy as np
 import time
 import torch
+from models.per_element_grads import PerElementGrads, chunk_loader, compute_per_element_grads
 
 
 ## One Step Set Functions on Validation Loss using just the last layer
 class SetFunctionTaylorDeep(object):
     
-    def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, loss_criterion, loss_nored, eta,device):
+    def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         
         self.x_trn = X_trn
         self.y_trn = Y_trn
@@ -25,15 +26,12 @@ class SetFunctionTaylorDeep(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
 
         for name,_ in self.model.named_children():
             self.last_layer_name = name
@@ -45,10 +43,9 @@ class SetFunctionTaylorDeep(object):
             else:
                 self.last_params.append(param)
 
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.last_params, only_inputs=True, retain_graph=True)
-
-        self.grads_per_elem = grads_vec
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, self.last_params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, self.last_params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -68,7 +65,7 @@ class SetFunctionTaylorDeep(object):
     def _update_gradients_subset(self, grads_X, element,theta_init):
         
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in self.grads_per_elem[element]]
         else:
             grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.last_params):
@@ -108,10 +105,7 @@ class SetFunctionTaylorDeep(object):
         #flat_grads_val = flat_grads_val.to(self.device)
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -140,7 +134,7 @@ class SetFunctionTaylorDeep(object):
 class SetFunctionTaylor(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -158,18 +152,16 @@ class SetFunctionTaylor(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -187,7 +179,7 @@ class SetFunctionTaylor(object):
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element, theta_init):
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in self.grads_per_elem[element]]
         else:
             grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
@@ -224,10 +216,7 @@ class SetFunctionTaylor(object):
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -259,7 +248,7 @@ class SetFunctionTaylor(object):
 class SetFunctionBatch(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, 
-            loss_criterion, loss_nored, eta, device):
+            loss_criterion, loss_nored, eta, device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:   # Use Validation Data to do the selection
@@ -275,17 +264,15 @@ class SetFunctionBatch(object):
         self.N_trn = X_trn.shape[0]
         self.grads_per_elem = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _simple_eval(self, grads_X, theta_init):
@@ -347,7 +334,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:   # If 1st selection, then just set it to bestId grads
-                grads_currX = list(self.grads_per_elem[bestId]) # Making it a list so that is mutable!                            
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]] # Making it a list so that is mutable!                            
             if numSelected % 500 == 0:
                 # Printing bestGain and Selection time for 1 element.
                print("numSelected:", numSelected, "Time for 1:", time.time()-t_one_elem, "bestGain:", bestGain)
@@ -364,7 +351,7 @@ class SetFunctionBatch(object):
 class SetFunctionCompare(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid,model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -382,18 +369,16 @@ class SetFunctionCompare(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
     ## Non-tay version
     def _simple_eval(self, grads_X, theta_init):
@@ -458,7 +443,7 @@ class SetFunctionCompare(object):
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element,theta_init):
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in self.grads_per_elem[element]]
         else:
             grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
@@ -502,10 +487,7 @@ class SetFunctionCompare(object):
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         l2_diff_all = torch.zeros(budget)
         l1_diff_all = torch.zeros(budget)
@@ -597,7 +579,7 @@ class SetFunctionCompare(object):
 class SetFunctionTaylorDebug(object):
     
     def __init__(self, X_trn, Y_trn, X_val, Y_val, valid, model, 
-            loss_criterion, loss_nored, eta,device):
+            loss_criterion, loss_nored, eta,device, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.y_trn = Y_trn
         if valid:
@@ -615,18 +597,16 @@ class SetFunctionTaylorDebug(object):
         self.first_element = True
         self.grads_val_curr = None
         self.device = device
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]   # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
 
     def _compute_init_valloss_grads(self, theta_init):
@@ -645,7 +625,7 @@ class SetFunctionTaylorDebug(object):
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element, theta_init):
         if not grads_X:
-            grads_X = list(self.grads_per_elem[element])
+            grads_X = [g.clone() for g in self.grads_per_elem[element]]
         else:
             grads_e = self.grads_per_elem[element]
             for i, _ in enumerate(self.model.parameters()):
@@ -683,10 +663,7 @@ class SetFunctionTaylorDebug(object):
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
 
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         while(numSelected < budget):
             # Try Using a List comprehension here!
@@ -765,11 +742,7 @@ class SetFunctionTaylorDebug(object):
         self._compute_init_valloss_grads(theta_init)
         flat_grads_val = self.flatten_params(self.grads_curr_subset) ## Total parameter size
         num_params = flat_grads_val.shape[0]
-        flat_grads_mat = torch.zeros((self.N_trn, num_params))
-        
-        for i in range(self.N_trn):
-            flat_grads_mat[i] = self.flatten_params(self.grads_per_elem[i])
-        flat_grads_mat = flat_grads_mat.to(self.device)
+        flat_grads_mat = self.flat_grads_mat.to(self.device)
         
         for curr_cls in classes:
             greedySet = set()
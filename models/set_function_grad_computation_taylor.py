@@ -4,12 +4,17 @@ import torch
 import math
 import torch.nn.functional as F
 from torch.utils.data import random_split, SequentialSampler, BatchSampler
-from queue import PriorityQueue
+from models.remaining_set import RemainingSet
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy
+from models.medoid_assignment import medoid_assignment
+from models.last_layer_grads import dataset_batches, compute_last_layer_grads, last_layer_grads, \
+    mean_last_layer_grads, forward_in_batches, index_batch, dataset_targets
 from torch import random
 
 class SetFunctionLoader_2(object):
     def __init__(self, trainset, x_val, y_val, model, loss_criterion,
-                 loss_nored, eta, device, num_classes, batch_size):
+                 loss_nored, eta, device, num_classes, batch_size, seed=None):
         self.trainset = trainset  # assume its a sequential loader.
         self.x_val = x_val.to(device)
         self.y_val = y_val.to(device)
@@ -24,53 +29,30 @@ class SetFunctionLoader_2(object):
         self.theta_init = None
         self.num_classes = num_classes
         self.batch_size = batch_size
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array([list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat([self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    data = F.softmax(self.model(inputs), dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1,1), 1)
-                outputs = tmp_tensor
-                cnt = cnt + 1
-            else:
-                cnt = cnt + 1
-                with torch.no_grad():
-                    data = torch.cat((data, F.softmax(self.model(inputs), dim=1)), dim=0)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = torch.cat((outputs, tmp_tensor), dim=0)
-        grads_vec = data - outputs
+        batches = dataset_batches(self.trainset, self.batch_size)
+        grads_vec, _ = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes, self.device)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
         self.grads_per_elem = grads_vec
 
     def _update_grads_val(self, theta_init, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                scores = F.softmax(self.model(self.x_val), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                grads = scores - one_hot_label
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX)
-                scores = F.softmax(self.model(self.x_val), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                grads = scores - one_hot_label
+                self.val_scores = self.model(self.x_val)
+        with torch.no_grad():
+            scores = self.val_scores
+            if not first_init and grads_currX is not None:
+                # one step on the last layer bias
+                scores = scores - self.eta * grads_currX
+            grads, _ = last_layer_grads(scores, self.y_val)
         self.grads_val_curr = grads.mean(dim=0)  # reset parm.grads to zero!
 
     def eval_taylor(self, grads_elem, theta_init):
@@ -82,13 +64,11 @@ class SetFunctionLoader_2(object):
             dot_prod += torch.sum(grads_val[0] * (params[-1].data - self.eta * grads_elem[0]))
         return dot_prod.data
 
-    def eval_taylor_modular(self, grads, theta_init):
+    def eval_taylor_modular(self, idxs):
+        # gains of the elements idxs (a LongTensor), one gather and one matmul
         grads_val = self.grads_val_curr
-        self.model.load_state_dict(theta_init)
         with torch.no_grad():
-            grads_tensor = torch.cat(grads, dim=0)
-            param_update = self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val)
+            gains = torch.matmul(self.grads_per_elem.index_select(0, idxs), grads_val).mul_(self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
@@ -112,24 +92,23 @@ class SetFunctionLoader_2(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = list()
-        remainSet = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [self.grads_per_elem[x].view(1, self.grads_per_elem[0].shape[0]) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads, theta_init)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = subset_selected[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.append(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = self.grads_per_elem[bestId]  # Making it a list so that is mutable!
+                grads_currX = self.grads_per_elem[bestId].clone()  # a copy, it is updated in place
             # Update the grads_val_current using current greedySet grads
             self._update_grads_val(theta_init, grads_currX)
             if numSelected % 1000 == 0:
@@ -142,7 +121,7 @@ class SetFunctionLoader_2(object):
 
 class NonDeepSetFunctionLoader_2(object):
     def __init__(self, trainset, x_val, y_val, model, loss_criterion,
-                 loss_nored, eta, device, num_classes, batch_size):
+                 loss_nored, eta, device, num_classes, batch_size, seed=None):
         self.trainset = trainset  # assume its a sequential loader.
         self.x_val = x_val.to(device)
         self.y_val = y_val.to(device)
@@ -157,53 +136,31 @@ class NonDeepSetFunctionLoader_2(object):
         self.theta_init = None
         self.num_classes = num_classes
         self.batch_size = batch_size
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array([list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat([self.trainset[x][0].view(1, -1) for x in batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    data = F.softmax(self.model(inputs), dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1,1), 1)
-                outputs = tmp_tensor
-                cnt = cnt + 1
-            else:
-                cnt = cnt + 1
-                with torch.no_grad():
-                    data = torch.cat((data, F.softmax(self.model(inputs), dim=1)), dim=0)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = torch.cat((outputs, tmp_tensor), dim=0)
-        grads_vec = data - outputs
+        batches = ((inputs.view(inputs.shape[0], -1), targets) for inputs, targets in
+                   dataset_batches(self.trainset, self.batch_size))
+        grads_vec, _ = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes, self.device)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
         self.grads_per_elem = grads_vec
 
     def _update_grads_val(self, theta_init, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                scores = F.softmax(self.model(self.x_val), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                grads = scores - one_hot_label
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX)
-                scores = F.softmax(self.model(self.x_val), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val), self.num_classes).to(self.device)
-                one_hot_label.scatter_(1, self.y_val.view(-1, 1), 1)
-                grads = scores - one_hot_label
+                self.val_scores = self.model(self.x_val)
+        with torch.no_grad():
+            scores = self.val_scores
+            if not first_init and grads_currX is not None:
+                # one step on the last layer bias
+                scores = scores - self.eta * grads_currX
+            grads, _ = last_layer_grads(scores, self.y_val)
         self.grads_val_curr = grads.mean(dim=0)  # reset parm.grads to zero!
 
     def eval_taylor(self, grads_elem, theta_init):
@@ -215,13 +172,11 @@ class NonDeepSetFunctionLoader_2(object):
             dot_prod += torch.sum(grads_val[0] * (params[-1].data - self.eta * grads_elem[0]))
         return dot_prod.data
 
-    def eval_taylor_modular(self, grads, theta_init):
+    def eval_taylor_modular(self, idxs):
+        # gains of the elements idxs (a LongTensor), one gather and one matmul
         grads_val = self.grads_val_curr
-        self.model.load_state_dict(theta_init)
         with torch.no_grad():
-            grads_tensor = torch.cat(grads, dim=0)
-            param_update = self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val)
+            gains = torch.matmul(self.grads_per_elem.index_select(0, idxs), grads_val).mul_(self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
@@ -245,24 +200,23 @@ class NonDeepSetFunctionLoader_2(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = list()
-        remainSet = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [self.grads_per_elem[x].view(1, self.grads_per_elem[0].shape[0]) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads, theta_init)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = subset_selected[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.append(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = self.grads_per_elem[bestId]  # Making it a list so that is mutable!
+                grads_currX = self.grads_per_elem[bestId].clone()  # a copy, it is updated in place
             # Update the grads_val_current using current greedySet grads
             self._update_grads_val(theta_init, grads_currX)
             if numSelected % 1000 == 0:
@@ -294,51 +248,25 @@ class PriorSetFunctionLoader_2(object):
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array([list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat([self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    data = F.softmax(self.model(inputs), dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1,1), 1)
-                outputs = tmp_tensor
-                cnt = cnt + 1
-            else:
-                cnt = cnt + 1
-                with torch.no_grad():
-                    data = torch.cat((data, F.softmax(self.model(inputs), dim=1)), dim=0)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = torch.cat((outputs, tmp_tensor), dim=0)
-        grads_vec = data - outputs
+        batches = dataset_batches(self.trainset, self.batch_size)
+        grads_vec, _ = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes, self.device)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
         self.grads_per_elem = grads_vec
 
     def _update_grads_val(self, theta_init, label, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         label_indices = torch.where(self.y_val == label)[0]
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                scores = F.softmax(self.model(self.x_val[label_indices]), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val[label_indices]), self.num_classes).to(self.device)
-                one_hot_label[:, label] = 1
-                grads = scores - one_hot_label
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX)
-                scores = F.softmax(self.model(self.x_val[label_indices]), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val[label_indices]), self.num_classes).to(self.device)
-                one_hot_label[:, label] = 1
-                grads = scores - one_hot_label
+                self.val_scores = self.model(self.x_val)
+        with torch.no_grad():
+            scores = self.val_scores[label_indices]
+            if not first_init and grads_currX is not None:
+                # one step on the last layer bias
+                scores = scores - self.eta * grads_currX
+            grads, _ = last_layer_grads(scores, self.y_val[label_indices])
         self.grads_val_curr = grads.mean(dim=0)  # reset parm.grads to zero!
 
     def eval_taylor(self, grads_elem, theta_init):
@@ -388,12 +316,12 @@ class PriorSetFunctionLoader_2(object):
                 self._update_grads_val(theta_init, i, grads_currX)
             numSelected = 0
             greedySet = list()
-            remainSet = [x.item() for x in torch.where(self.trainset.dataset.targets[self.trainset.indices] == i)[0]]
+            remainSet = RemainingSet(self.N_trn, torch.where(self.trainset.dataset.targets[self.trainset.indices] == i)[0].cpu().numpy())
             subset_size = int((len(remainSet) / per_class_budget) * math.log(100))
             while (numSelected < per_class_budget):
                 # Try Using a List comprehension here!
                 t_one_elem = time.time()
-                subset_selected = remainSet#list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
+                subset_selected = list(remainSet)#list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
                 rem_grads = [self.grads_per_elem[x].view(1, self.grads_per_elem[0].shape[0]) for x in subset_selected]
                 gains = self.eval_taylor_modular(rem_grads, theta_init)
                 # Update the greedy set and remaining set
@@ -417,7 +345,7 @@ class PriorSetFunctionLoader_2(object):
 
 class WeightedSetFunctionLoader(object):
     def __init__(self, trainset, x_val, y_val, facloc_size, lam, model, loss_criterion,
-                 loss_nored, eta, device, num_classes, batch_size):
+                 loss_nored, eta, device, num_classes, batch_size, seed=None):
         self.trainset = trainset  # assume its a sequential loader.
         self.x_val = x_val.to(device)
         self.y_val = y_val.to(device)
@@ -434,72 +362,31 @@ class WeightedSetFunctionLoader(object):
         self.theta_init = None
         self.num_classes = num_classes
         self.batch_size = batch_size
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array(
-            [list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat(
-                [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in
-                 batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    data = F.softmax(self.model(inputs), dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                cnt = cnt + 1
-            else:
-                cnt = cnt + 1
-                with torch.no_grad():
-                    data = torch.cat((data, F.softmax(self.model(inputs), dim=1)), dim=0)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = torch.cat((outputs, tmp_tensor), dim=0)
-        grads_vec = data - outputs
+        batches = dataset_batches(self.trainset, self.batch_size)
+        grads_vec, _ = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes, self.device)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
         self.grads_per_elem = grads_vec
 
     def _update_grads_val(self, theta_init, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                for i in range(10):
-                    batch_scores = F.softmax(self.model(
-                        self.x_val[(i) * int((len(self.x_val)) / 10): (i + 1) * int((len(self.x_val)) / 10)]), dim=1)
-                    batch_one_hot_label = torch.zeros(len(self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)]), self.num_classes).to(self.device)
-                    if (i == 0):
-                        scores = batch_scores
-                        one_hot_label = batch_one_hot_label.scatter_(1, self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)
-                    else:
-                        scores = torch.cat((scores, batch_scores), dim=0)
-                        one_hot_label = torch.cat((one_hot_label, batch_one_hot_label.scatter_(1, self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)), dim=0)
-                grads = scores - one_hot_label
-                grads[0:int(self.facloc_size)] = self.lam * grads[0:int(self.facloc_size)]
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX)
-                for i in range(10):
-                    batch_scores = F.softmax(self.model(
-                        self.x_val[(i) * int((len(self.x_val)) / 10): (i + 1) * int((len(self.x_val)) / 10)]), dim=1)
-                    batch_one_hot_label = torch.zeros(len(self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)]), self.num_classes).to(self.device)
-                    if (i == 0):
-                        scores = batch_scores
-                        one_hot_label = batch_one_hot_label.scatter_(1, self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)
-                    else:
-                        scores = torch.cat((scores, batch_scores), dim=0)
-                        one_hot_label = torch.cat((one_hot_label, batch_one_hot_label.scatter_(1, self.y_val[(i) * int(len(self.x_val) / 10): (i + 1) * int(len(self.x_val) / 10)].view(-1, 1), 1)), dim=0)
-                grads = scores - one_hot_label
-                grads[0:int(self.facloc_size)] = self.lam * grads[0:int(self.facloc_size)]
+                self.val_scores = forward_in_batches(self.model, self.x_val, 10)
+        with torch.no_grad():
+            scores = self.val_scores
+            if not first_init and grads_currX is not None:
+                # one step on the last layer bias
+                scores = scores - self.eta * grads_currX
+            grads, _ = last_layer_grads(scores, self.y_val)
+            grads[0:int(self.facloc_size)] = self.lam * grads[0:int(self.facloc_size)]
         self.grads_val_curr = grads.mean(dim=0)  # reset parm.grads to zero!
 
     def eval_taylor(self, grads_elem, theta_init):
@@ -511,13 +398,11 @@ class WeightedSetFunctionLoader(object):
             dot_prod += torch.sum(grads_val[0] * (params[-1].data - self.eta * grads_elem[0]))
         return dot_prod.data
 
-    def eval_taylor_modular(self, grads, theta_init):
+    def eval_taylor_modular(self, idxs):
+        # gains of the elements idxs (a LongTensor), one gather and one matmul
         grads_val = self.grads_val_curr
-        self.model.load_state_dict(theta_init)
         with torch.no_grad():
-            grads_tensor = torch.cat(grads, dim=0)
-            param_update = self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val)
+            gains = torch.matmul(self.grads_per_elem.index_select(0, idxs), grads_val).mul_(self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
@@ -541,24 +426,23 @@ class WeightedSetFunctionLoader(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = list()
-        remainSet = list(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [self.grads_per_elem[x].view(1, self.grads_per_elem[0].shape[0]) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads, theta_init)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = subset_selected[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.append(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = self.grads_per_elem[bestId]  # Making it a list so that is mutable!
+                grads_currX = self.grads_per_elem[bestId].clone()  # a copy, it is updated in place
             # Update the grads_val_current using current greedySet grads
             self._update_grads_val(theta_init, grads_currX)
             if numSelected % 1000 == 0:
@@ -590,57 +474,27 @@ class PriorWeightedSetFunctionLoader(object):
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
-        batch_wise_indices = np.array(
-            [list(BatchSampler(SequentialSampler(np.arange(self.N_trn)), self.batch_size, drop_last=False))][0])
-        cnt = 0
-        for batch_idx in batch_wise_indices:
-            inputs = torch.cat(
-                [self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in
-                 batch_idx], dim=0).type(torch.float)
-            targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if cnt == 0:
-                with torch.no_grad():
-                    data = F.softmax(self.model(inputs), dim=1)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = tmp_tensor
-                cnt = cnt + 1
-            else:
-                cnt = cnt + 1
-                with torch.no_grad():
-                    data = torch.cat((data, F.softmax(self.model(inputs), dim=1)), dim=0)
-                tmp_tensor = torch.zeros(len(inputs), self.num_classes).to(self.device)
-                tmp_tensor.scatter_(1, targets.view(-1, 1), 1)
-                outputs = torch.cat((outputs, tmp_tensor), dim=0)
-        grads_vec = data - outputs
+        batches = dataset_batches(self.trainset, self.batch_size)
+        grads_vec, _ = compute_last_layer_grads(self.model, batches, self.N_trn, self.num_classes, self.device)
         torch.cuda.empty_cache()
         print("Per Element Gradient Computation is Completed")
         self.grads_per_elem = grads_vec
 
     def _update_grads_val(self, theta_init, label, grads_currX=None, first_init=False):
-        self.model.load_state_dict(theta_init)
-        self.model.zero_grad()
         label_indices = torch.where(self.y_val == label)[0]
         facloc_size = torch.where(label_indices < self.facloc_size)[0].shape[0]
         if first_init:
+            # only the last layer moves during the greedy, cache the validation scores at theta_init
+            self.model.load_state_dict(theta_init)
             with torch.no_grad():
-                scores = F.softmax(self.model(self.x_val[label_indices]), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val[label_indices]), self.num_classes).to(self.device)
-                one_hot_label[:, label] = 1
-                grads = scores - one_hot_label
-                grads[0:int(self.facloc_size)] = self.lam * grads[0:int(self.facloc_size)]
-        # populate the gradients in model params based on loss.
-        elif grads_currX is not None:
-            # update params:
-            with torch.no_grad():
-                params = [param for param in self.model.parameters()]
-                params[-1].data.sub_(self.eta * grads_currX)
-                scores = F.softmax(self.model(self.x_val[label_indices]), dim=1)
-                one_hot_label = torch.zeros(len(self.y_val[label_indices]), self.num_classes).to(self.device)
-                one_hot_label[:, label] = 1
-                grads = scores - one_hot_label
-                grads[0:int(facloc_size)] = self.lam * grads[0:int(facloc_size)]
+                self.val_scores = self.model(self.x_val)
+        with torch.no_grad():
+            scores = self.val_scores[label_indices]
+            if not first_init and grads_currX is not None:
+                # one step on the last layer bias
+                scores = scores - self.eta * grads_currX
+            grads, _ = last_layer_grads(scores, self.y_val[label_indices])
+            grads[0:int(facloc_size)] = self.lam * grads[0:int(facloc_size)]
         self.grads_val_curr = grads.mean(dim=0)  # reset parm.grads to zero!
 
     def eval_taylor(self, grads_elem, theta_init):
@@ -690,12 +544,12 @@ class PriorWeightedSetFunctionLoader(object):
                 self._update_grads_val(theta_init, i, grads_currX)
             numSelected = 0
             greedySet = list()
-            remainSet = [x.item() for x in torch.where(self.trainset.dataset.targets[self.trainset.indices] == i)[0]]
+            remainSet = RemainingSet(self.N_trn, torch.where(self.trainset.dataset.targets[self.trainset.indices] == i)[0].cpu().numpy())
             subset_size = int((len(remainSet) / per_class_budget) * math.log(100))
             while (numSelected < per_class_budget):
                 # Try Using a List comprehension here!
                 t_one_elem = time.time()
-                subset_selected = remainSet  # list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
+                subset_selected = list(remainSet)  # list(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
                 rem_grads = [self.grads_per_elem[x].view(1, self.grads_per_elem[0].shape[0]) for x in subset_selected]
                 gains = self.eval_taylor_modular(rem_grads, theta_init)
                 # Update the greedy set and remaining set
@@ -729,30 +583,19 @@ class SetFunctionSupervisedCRAIG(object):
     
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist #torch.sqrt(dist)
-
-      #dist = torch.abs(x-y).sum(2)
-      #return dist
+      return pairwise_distances(x, y, exp)
 
     def class_wise(self,bud):
 
         torch.cuda.empty_cache()
 
-        classes = torch.unique(torch.tensor(self.trainset[:][1]) )      
+        classes = torch.unique(dataset_targets(self.trainset))      
 
         self.N = len(self.trainset)
         print(self.N)
         greedyList =[]
         full_gamma= []
+        assignment = torch.zeros(self.N, dtype=torch.long)
 
         for i in classes:
 
@@ -761,6 +604,7 @@ class SetFunctionSupervisedCRAIG(object):
 
             id_first = self.compute_score(idx)
             subset, gamma = self.lazy_greedy_max(math.ceil(bud*len(idx) / self.N), id_first)
+            assignment[idx.cpu()] = idx.cpu()[self.assignment.cpu()]
 
             for j in range(len(subset)):
               greedyList.append(idx[subset[j]])
@@ -770,6 +614,7 @@ class SetFunctionSupervisedCRAIG(object):
         random.shuffle(c)
         greedyList, full_gamma = zip(*c)
 
+        self.assignment = assignment  # medoid of every training point
         return greedyList, full_gamma
 
 
@@ -783,7 +628,7 @@ class SetFunctionSupervisedCRAIG(object):
 
         if self.if_convex:
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat([self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in batch_idx], dim=0).type(torch.float)
+                inputs = index_batch(self.trainset, batch_idx)[0]
                 if cnt == 0:
                     vector = inputs
                     cnt = cnt + 1
@@ -793,8 +638,7 @@ class SetFunctionSupervisedCRAIG(object):
         else:
 
             for batch_idx in batch_wise_indices:
-                inputs = torch.cat([self.trainset[x][0].view(-1, 1, self.trainset[x][0].shape[1], self.trainset[x][0].shape[2]) for x in batch_idx], dim=0).type(torch.float)
-                targets = torch.tensor([self.trainset[x][1] for x in batch_idx])
+                inputs, targets = index_batch(self.trainset, batch_idx)
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
                 if cnt == 0:
                     with torch.no_grad():
@@ -831,69 +675,22 @@ class SetFunctionSupervisedCRAIG(object):
 
         return bestId
             
-    def compute_gamma(self,idxs):
-
-      gamma = [0 for i in range(len(idxs))]
-
-      best = self.dist_mat[idxs]
-      #print(best[0])
-      rep = torch.argmin(best,axis = 0)
-
-      for i in rep:
-        gamma[i] += 1
-
+    def compute_gamma(self, idxs):
+      # also keeps the medoid of every point in self.assignment
+      gamma, self.assignment = medoid_assignment(self.dist_mat, idxs)
       return gamma
     
     def lazy_greedy_max(self, budget, id_first):
 
 
-      self.gains = PriorityQueue()
-      for i in range(self.curr_N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
-
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device))
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-          greedyList.append(bestId)
-          numSelected += 1
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j])
 
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
       gamma = self.compute_gamma(greedyList)
       return greedyList, gamma
@@ -5,8 +5,9 @@ import copy
 import time
 
 import math
-from queue import PriorityQueue
 import random
+from models.pairwise_distance import pairwise_distances
+from models.lazy_greedy import lazy_greedy
 
 class SetFunctionTaylorDeep_SuperRep(object):
     
@@ -415,19 +416,7 @@ class SetFunctionTaylorDeep_SuperDistance(object):
         self.first_element = False    
 
     def distance(self,x, y, exp = 2):
-
-      n = x.size(0)
-      m = y.size(0)
-      d = x.size(1)
-
-      x = x.unsqueeze(1).expand(n, m, d)
-      y = y.unsqueeze(0).expand(n, m, d)
-
-      dist = torch.pow(x - y, exp).sum(2) 
-      return dist #torch.sqrt(dist)
-
-      #dist = torch.abs(x-y).sum(2)
-      #return dist
+      return pairwise_distances(x, y, exp)
 
     def compute_score(self, theta_init):
 
@@ -483,53 +472,14 @@ class SetFunctionTaylorDeep_SuperDistance(object):
     def lazy_greedy_max(self, budget, id_first):
 
 
-      self.gains = PriorityQueue()
-      for i in range(self.curr_N):
-        
-        if i == id_first :
-          continue
-        curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[i])).sum()
-        self.gains.put((-curr_gain.item(),i))
-
-      numSelected = 2
-      second = self.gains.get()
-      greedyList = [id_first,second[1]]
-      self.min_dist = torch.min(self.min_dist,self.dist_mat[second[1]])
-
-      while(numSelected < budget):
-
-          #print(len(greedyList)) 
-          if self.gains.empty():
-            break
-
-          elif self.gains.qsize() == 1:
-            bestId = self.gains.get()[1]
-
-          else:
-   
-            bestGain = -np.inf
-            bestId = None
-            
-            while True:
-
-              first =  self.gains.get()
-
-              if bestId == first[1]: 
-                break
-
-              curr_gain = (self.min_dist - torch.min(self.min_dist,self.dist_mat[first[1]])).sum()
-              self.gains.put((-curr_gain.item(), first[1]))
-
-
-              if curr_gain.item() >= bestGain:
-                  
-                bestGain = curr_gain.item()
-                bestId = first[1]
+      def gains(idxs):
+        rows = self.dist_mat.index_select(0, idxs.to(self.dist_mat.device))
+        return rows.neg_().add_(self.min_dist).clamp_(min=0).sum(1)
 
-          greedyList.append(bestId)
-          numSelected += 1
+      def add(j):
+        self.min_dist = torch.min(self.min_dist, self.dist_mat[j])
 
-          self.min_dist = torch.min(self.min_dist,self.dist_mat[bestId])
+      greedyList = lazy_greedy(gains, add, self.curr_N, budget, [id_first])
 
       return greedyList
     
@@ -3,6 +3,7 @@ import time
 import torch
 from queue import PriorityQueue  # lazy greedy
 import sys
+from models.per_element_grads import PerElementGrads, chunk_loader, compute_per_element_grads
 
 
 ## One Step Set Functions on Validation Loss
@@ -12,7 +13,7 @@ import sys
 class SetFunctionBatch(object):
 
     def __init__(self, X_trn, Y_trn, X_val, Y_val, model,
-                 loss_criterion, loss_nored, eta):
+                 loss_criterion, loss_nored, eta, grad_chunk_size=1024):
         self.x_trn = X_trn
         self.x_val = X_val
         self.y_trn = Y_trn
@@ -23,18 +24,16 @@ class SetFunctionBatch(object):
         self.eta = eta  # step size for the one step gradient update
         self.N_trn = X_trn.shape[0]
         self.grads_per_elem = None
+        self.grad_chunk_size = grad_chunk_size  # rows per batched per-element gradient call
 
     def _compute_per_element_grads(self, theta_init):
         self.model.load_state_dict(theta_init)
         self.model.zero_grad()
 
-        scores = self.model(self.x_trn)
-        losses = self.loss_nored(scores, self.y_trn)
-        N = self.N_trn
-        grads_vec = [0 for _ in range(N)]  # zero is just a placeholder
-        for item in range(N):
-            grads_vec[item] = torch.autograd.grad(losses[item], self.model.parameters(), retain_graph=True)
-        self.grads_per_elem = grads_vec
+        params = list(self.model.parameters())
+        trn_loader = chunk_loader(self.x_trn, self.y_trn, self.grad_chunk_size)
+        self.flat_grads_mat = compute_per_element_grads(self.model, self.loss_nored, trn_loader, params)
+        self.grads_per_elem = PerElementGrads(self.flat_grads_mat, params)
 
     def _simple_eval(self, grads_X, theta_init):
         self.model.load_state_dict(theta_init)
@@ -99,8 +98,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = list(
-                    self.grads_per_elem[bestId])  # Making it a list so that is mutable!
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]]  # Making it a list so that is mutable!
             if numSelected % 500 == 0:
                 # Printing bestGain and Selection time for 1 element.
                 print("numSelected:", numSelected, "Time for 1:", time.time() - t_one_elem, "bestGain:", bestGain)
@@ -209,8 +207,7 @@ class SetFunctionBatch(object):
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = list(
-                    self.grads_per_elem[bestId])  # Making it a list so that is mutable!
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]]  # Making it a list so that is mutable!
             numSelected += 1
 
         print("Lazy greedy total time:", time.time() - t_lg_start)
@@ -315,7 +312,7 @@ class SetFunctionLoader(object):
             else:
                 # If 1st selection, then just set it to bestId grads
                 # Making it a list so that is mutable!
-                grads_currX = list(self.grads_per_elem[bestId])
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]]
             if numSelected % 200 == 0:
                 # Printing the Validation Loss
                 # Also print the selection time for 1 element
@@ -430,7 +427,7 @@ class SetFunctionLoader_2(object):
             else:
                 # If 1st selection, then just set it to bestId grads
                 # Making it a list so that is mutable!
-                grads_currX = list(self.grads_per_elem[bestId])
+                grads_currX = [g.clone() for g in self.grads_per_elem[bestId]]
             if numSelected % 200 == 0:
                 # Printing the Validation Loss
                 # Also print the selection time for 1 element
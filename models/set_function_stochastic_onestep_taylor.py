@@ -2,11 +2,12 @@ import numpy as np
 import time
 import torch
 import math
+from models.remaining_set import RemainingSet
 
 class SetFunctionLoader_2(object):
 
     def __init__(self, trainloader, validset, model, loss_criterion,
-                 loss_nored, eta, device):
+                 loss_nored, eta, device, seed=None):
         self.trainloader = trainloader  # assume its a sequential loader.
         # self.valloader = valloader      # assume its a sequential loader.
         self.x_val = validset.dataset.data[validset.indices].to(device, dtype=torch.float).view(len(validset.indices),
@@ -21,9 +22,12 @@ class SetFunctionLoader_2(object):
         self.N_trn = len(trainloader.sampler)
         self.grads_per_elem = None
         self.theta_init = None
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
-        grads_vec = [0 for i in range(self.N_trn)]
+        grads_vec = None  # N x P, gradient of the last parameter of every element
         counter = 0
         for batch_idx, (inputs, targets) in enumerate(self.trainloader):
             # print(batch_idx)
@@ -33,7 +37,10 @@ class SetFunctionLoader_2(object):
             losses = self.loss_nored(scores, targets)
             for i, loss_i in enumerate(losses):
                 self.model.zero_grad()
-                grads_vec[i + counter] = [torch.autograd.grad(loss_i, self.model.parameters(), retain_graph=True)[-1]]
+                grad_i = torch.autograd.grad(loss_i, self.model.parameters(), retain_graph=True)[-1]
+                if grads_vec is None:
+                    grads_vec = torch.zeros((self.N_trn,) + grad_i.shape, device=grad_i.device)
+                grads_vec[i + counter] = grad_i
             params = [param for param in self.model.parameters()]
             for param in params:
                 param.grad = None
@@ -74,23 +81,17 @@ class SetFunctionLoader_2(object):
             dot_prod += torch.sum(grads_val[0] * (params[-1].data - self.eta * grads_elem[0]))
         return dot_prod.data
 
-    def eval_taylor_modular(self, grads, theta_init):
+    def eval_taylor_modular(self, idxs):
+        # gains of the elements idxs (a LongTensor), one gather and one matmul
         grads_val = self.grads_val_curr
-        self.model.load_state_dict(theta_init)
         with torch.no_grad():
-            params = [param for param in self.model.parameters()]
-            #temp_tensor = params[-1].data.detach()
-            grads_tensor = torch.cat(grads, dim=0)
-            #param_update = temp_tensor - self.eta * grads_tensor
-            param_update = - self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val[0])
+            gains = torch.matmul(self.grads_per_elem.index_select(0, idxs), grads_val[0]).mul_(-self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element):
-        grads_e = self.grads_per_elem[element]
-        grads_X[0] += grads_e[0]
+        grads_X[0] += self.grads_per_elem[element]
 
     # Same as before i.e full batch case! No use of dataloaders here!
     # Everything is abstracted away in eval call
@@ -102,25 +103,23 @@ class SetFunctionLoader_2(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
-        remainSet = set(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = set(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [self.grads_per_elem[x][0].view(1, self.grads_per_elem[0][0].shape[0]) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads, theta_init)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = list(subset_selected)[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.add(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = list(
-                    self.grads_per_elem[bestId])  # Making it a list so that is mutable!
+                grads_currX = [self.grads_per_elem[bestId].clone()]  # Making it a list so that is mutable!
             # Update the grads_val_current using current greedySet grads
             self._update_grads_val(theta_init, grads_currX)
 
@@ -135,7 +134,7 @@ class SetFunctionLoader_2(object):
 class WeightedSetFunctionLoader(object):
 
     def __init__(self, trainloader, validset, facloc_size, lam, model, loss_criterion,
-                 loss_nored, eta, device):
+                 loss_nored, eta, device, seed=None):
         self.trainloader = trainloader  # assume its a sequential loader.
         # self.valloader = valloader      # assume its a sequential loader.
         self.x_val = validset.dataset.data[validset.indices].to(device, dtype=torch.float).view(len(validset.indices),
@@ -152,9 +151,12 @@ class WeightedSetFunctionLoader(object):
         self.N_trn = len(trainloader.sampler)
         self.grads_per_elem = None
         self.theta_init = None
+        # candidates of the stochastic greedy are drawn from this stream (the global torch
+        # RNG if seed is None)
+        self.generator = None if seed is None else torch.Generator(device=device).manual_seed(seed)
 
     def _compute_per_element_grads(self, theta_init):
-        grads_vec = [0 for i in range(self.N_trn)]
+        grads_vec = None  # N x P, gradient of the last parameter of every element
         counter = 0
         for batch_idx, (inputs, targets) in enumerate(self.trainloader):
             # print(batch_idx)
@@ -164,7 +166,10 @@ class WeightedSetFunctionLoader(object):
             losses = self.loss_nored(scores, targets)
             for i, loss_i in enumerate(losses):
                 self.model.zero_grad()
-                grads_vec[i + counter] = [torch.autograd.grad(loss_i, self.model.parameters(), retain_graph=True)[-1]]
+                grad_i = torch.autograd.grad(loss_i, self.model.parameters(), retain_graph=True)[-1]
+                if grads_vec is None:
+                    grads_vec = torch.zeros((self.N_trn,) + grad_i.shape, device=grad_i.device)
+                grads_vec[i + counter] = grad_i
             params = [param for param in self.model.parameters()]
             for param in params:
                 param.grad = None
@@ -220,23 +225,17 @@ class WeightedSetFunctionLoader(object):
             #dot_prod += torch.sum(grads_val[0] * (params[-1].data - self.eta * grads_elem[0]))
         return dot_prod.data
 
-    def eval_taylor_modular(self, grads, theta_init):
+    def eval_taylor_modular(self, idxs):
+        # gains of the elements idxs (a LongTensor), one gather and one matmul
         grads_val = self.grads_val_curr
-        self.model.load_state_dict(theta_init)
         with torch.no_grad():
-            params = [param for param in self.model.parameters()]
-            #temp_tensor = params[-1].data.detach()
-            grads_tensor = torch.cat(grads, dim=0)
-            #param_update = temp_tensor - self.eta * grads_tensor
-            param_update = - self.eta * grads_tensor
-            gains = torch.matmul(param_update, grads_val[0])
+            gains = torch.matmul(self.grads_per_elem.index_select(0, idxs), grads_val[0]).mul_(-self.eta)
         return gains
 
     # Updates gradients of set X + element (basically adding element to X)
     # Note that it modifies the inpute vector! Also grads_X is a list! grad_e is a tuple!
     def _update_gradients_subset(self, grads_X, element):
-        grads_e = self.grads_per_elem[element]
-        grads_X[0] += grads_e[0]
+        grads_X[0] += self.grads_per_elem[element]
 
     # Same as before i.e full batch case! No use of dataloaders here!
     # Everything is abstracted away in eval call
@@ -248,25 +247,23 @@ class WeightedSetFunctionLoader(object):
         numSelected = 0
         grads_currX = []  # basically stores grads_X for the current greedy set X
         greedySet = set()
-        remainSet = set(range(self.N_trn))
+        remainSet = RemainingSet(self.N_trn, device=self.grads_per_elem.device)
         t_ng_start = time.time()  # naive greedy start time
         subset_size = int((len(self.grads_per_elem)/budget) * math.log(100))
         while (numSelected < budget):
             # Try Using a List comprehension here!
             t_one_elem = time.time()
-            subset_selected = set(np.random.choice(np.array(list(remainSet)), size=subset_size, replace=False))
-            rem_grads = [self.grads_per_elem[x][0].view(1, self.grads_per_elem[0][0].shape[0]) for x in subset_selected]
-            gains = self.eval_taylor_modular(rem_grads, theta_init)
+            subset_selected = remainSet.sample_tensor(subset_size, self.generator)
+            gains = self.eval_taylor_modular(subset_selected)
             # Update the greedy set and remaining set
-            bestId = list(subset_selected)[torch.argmax(gains)]
+            bestId = subset_selected[torch.argmax(gains)].item()
             greedySet.add(bestId)
             remainSet.remove(bestId)
             # Update info in grads_currX using element=bestId
             if numSelected > 0:
                 self._update_gradients_subset(grads_currX, bestId)
             else:  # If 1st selection, then just set it to bestId grads
-                grads_currX = list(
-                    self.grads_per_elem[bestId])  # Making it a list so that is mutable!
+                grads_currX = [self.grads_per_elem[bestId].clone()]  # Making it a list so that is mutable!
             # Update the grads_val_current using current greedySet grads
             self._update_grads_val(theta_init, grads_currX)
 
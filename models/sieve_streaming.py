@@ -0,0 +1,120 @@
+import math
+import torch
+from models.pairwise_distance import pairwise_distances
+
+
+## Single pass facility location by sieve streaming (Badanidiyuru et al., "Streaming
+## Submodular Maximization: Massive Data Summarization on the Fly", 2014), for pools
+## too large for the N x N matrix of SetFunctionFacLoc (and for the repeated sampled
+## greedy of run_stochastic_Facloc). The stream is read once, chunk by chunk.
+## The objective is the exemplar based facility location on a reference sample W of
+## the stream (its first `num_ref` points, the stream should be in random order):
+##   f(S) = sum_{w in W} d(w, e0) - min(d(w, e0), min_{s in S} d(w, s))
+## with d the squared euclidean distance and e0 the mean of W (a phantom exemplar,
+## f is monotone submodular and f({}) = 0, no max distance constant is needed).
+## One sieve per threshold v in {(1 + eps)^i} within [m, 2 k m], m the largest
+## singleton value seen so far (sieves are opened as m grows and dropped below it).
+## A sieve takes a point if its gain is at least (v / 2 - f(S_v)) / (k - |S_v|),
+## the best sieve is a (1 / 2 - eps) approximation. Memory is O(|W| log(k) / eps) for
+## the sieves plus a chunk x |W| distance block, never quadratic in the pool.
+
+
+class SieveStreamingFacLoc(object):
+
+    def __init__(self, budget, epsilon=0.1, num_ref=2048, device='cpu'):
+        self.budget = budget
+        self.epsilon = epsilon
+        self.num_ref = num_ref
+        self.device = device
+        self.ref = None  # reference sample W
+        self.ref_dist = None  # d(w, e0) for every w in W
+        self.max_singleton = 0.
+        self.sieves = {}  # exponent i of v = (1 + eps)^i -> [ids, min_dist over W, f]
+        self.N = 0  # points sieved
+        self.pending = []  # chunks held back until W is full
+
+    def _update_sieves(self, singletons):
+        self.max_singleton = max(self.max_singleton, singletons.max().item())
+        if self.max_singleton <= 0:
+            return
+        base = math.log(1 + self.epsilon)
+        lo = int(math.ceil(math.log(self.max_singleton) / base))
+        hi = int(math.floor(math.log(2 * self.budget * self.max_singleton) / base))
+        for i in list(self.sieves):
+            if i < lo:
+                del self.sieves[i]
+        for i in range(lo, hi + 1):
+            if i not in self.sieves:
+                self.sieves[i] = [[], self.ref_dist.clone(), 0.]
+
+    def _sieve_chunk(self, i, dist, first_id, block_size=64):
+        # offers the rows of dist (chunk x |W|) in order to the sieve of v = (1 + eps)^i.
+        # The gains at the start of the chunk bound the later ones (submodularity), only
+        # the rows whose bound reaches the threshold get their exact gain, block_size at a
+        # time. The first one reaching it is taken, the ones before it are rejected as one
+        # row at a time would (the threshold is constant between two taken rows).
+        ids, min_dist, value = self.sieves[i]
+        v = (1 + self.epsilon) ** i
+        upper = (min_dist - dist).clamp_(min=0).sum(1)
+        pos = 0
+        while len(ids) < self.budget and pos < dist.shape[0]:
+            threshold = (v / 2. - value) / (self.budget - len(ids))
+            cands = pos + torch.nonzero(upper[pos:] >= threshold).flatten()
+            if len(cands) == 0:
+                break
+            block = cands[:block_size]
+            exact = (min_dist - dist[block]).clamp_(min=0).sum(1)
+            upper[block] = exact
+            passing = torch.nonzero(exact >= threshold).flatten()
+            if len(passing) == 0:
+                pos = block[-1].item() + 1
+                continue
+            j = block[passing[0]].item()
+            ids.append(first_id + j)
+            value += exact[passing[0]].item()
+            min_dist = torch.min(min_dist, dist[j])
+            pos = j + 1
+        self.sieves[i] = [ids, min_dist, value]
+
+    def _set_reference(self, x):
+        self.ref = x[:self.num_ref]
+        self.ref_dist = pairwise_distances(self.ref, self.ref.mean(dim=0, keepdim=True)).flatten()
+
+    def _process(self, x):
+        dist = pairwise_distances(x, self.ref)
+        self._update_sieves((self.ref_dist - dist).clamp(min=0).sum(1))
+        for i in sorted(self.sieves):
+            self._sieve_chunk(i, dist, self.N)
+        self.N += x.shape[0]
+
+    def partial_fit(self, x):
+        """Offers the next chunk of the stream (rows of features)."""
+        x = x.to(self.device).float()
+        if self.ref is None:
+            # the points are held back until the first num_ref of them make W
+            self.pending.append(x)
+            if sum(chunk.shape[0] for chunk in self.pending) < self.num_ref:
+                return self
+            x = torch.cat(self.pending)
+            self.pending = []
+            self._set_reference(x)
+        self._process(x)
+        return self
+
+    def fit(self, loader):
+        """One pass over loader, yielding feature chunks or (inputs, targets) batches."""
+        for batch in loader:
+            self.partial_fit(batch[0] if isinstance(batch, (tuple, list)) else batch)
+        return self.selection()
+
+    def selection(self):
+        # ids (positions in the stream) of the best sieve
+        if self.pending:
+            # stream shorter than num_ref, W is all of it
+            x = torch.cat(self.pending)
+            self.pending = []
+            self._set_reference(x)
+            self._process(x)
+        if not self.sieves:
+            return []
+        return list(max(self.sieves.values(), key=lambda sieve: sieve[2])[0])
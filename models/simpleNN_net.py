@@ -1,11 +1,12 @@
 import torch.nn as nn
 import torch.nn.functional as F
+from models.sparse_linear import SparseInputLinear
 
 
 class TwoLayerNet(nn.Module):
     def __init__(self, input_dim, num_classes, hidden_units):
         super(TwoLayerNet, self).__init__()
-        self.linear1 = nn.Linear(input_dim, hidden_units)
+        self.linear1 = SparseInputLinear(input_dim, hidden_units)
         self.linear2 = nn.Linear(hidden_units, num_classes)
     
     def forward(self, x):
@@ -16,7 +17,7 @@ class TwoLayerNet(nn.Module):
 class ThreeLayerNet(nn.Module):
     def __init__(self, input_dim, num_classes, h1, h2):
         super(ThreeLayerNet, self).__init__()
-        self.linear1 = nn.Linear(input_dim, h1)
+        self.linear1 = SparseInputLinear(input_dim, h1)
         self.linear2 = nn.Linear(h1, h2)
         self.linear3 = nn.Linear(h2, num_classes)
     
@@ -0,0 +1,15 @@
+import torch
+import torch.nn as nn
+
+
+## First layer of the models used on the libsvm datasets, for sparse (COO or CSR)
+## inputs as loaded with libsvm_file_load(..., sparse=True) and csr_to_tensor. The
+## matmul goes through torch.sparse.mm, dense inputs take the usual nn.Linear path.
+## Being an nn.Linear, state dicts and the closed form per-element gradients are
+## unchanged.
+class SparseInputLinear(nn.Linear):
+
+    def forward(self, x):
+        if x.layout != torch.strided:
+            return torch.sparse.mm(x, self.weight.t()) + self.bias
+        return super(SparseInputLinear, self).forward(x)
@@ -0,0 +1,62 @@
+import sys
+import time
+import torch
+from models.pairwise_distance import pairwise_distances
+
+## Parity check of the shared pairwise distance kernel against the expand based
+## distance() the facility location / CRAIG set functions used before.
+## python3 pairwise_distance_parity.py [n] [m] [d]
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 700
+m = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+d = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+
+def expand_distance(x, y, exp=2):
+    # Exactly the old distance() methods
+    n, m, d = x.size(0), y.size(0), x.size(1)
+    x = x.unsqueeze(1).expand(n, m, d)
+    y = y.unsqueeze(0).expand(n, m, d)
+    return torch.pow(x - y, exp).sum(2)
+
+
+torch.manual_seed(42)
+all_ok = True
+cases = [('float32', torch.float32, 2, 1e-4), ('float64', torch.float64, 2, 1e-10),
+         ('float32 exp=1', torch.float32, 1, 1e-4), ('float32 exp=3', torch.float32, 3, 1e-4),
+         ('float16 upcast', torch.float16, 2, 1e-2)]
+for name, dtype, exp, rtol in cases:
+    # offset inputs so the norm expansion has something to cancel
+    x = (torch.randn(n, d, dtype=torch.float64) + 10).to(dtype)
+    y = (torch.randn(m, d, dtype=torch.float64) + 10).to(dtype)
+    ref = expand_distance(x.double(), y.double(), exp)
+    for tile_bytes in [2 ** 12, 2 ** 20, 2 ** 28]:
+        t = time.time()
+        dist = pairwise_distances(x, y, exp, tile_bytes=tile_bytes)
+        elapsed = time.time() - t
+        err = ((dist.double() - ref).abs() / ref.abs().clamp(min=1)).max().item()
+        ok = dist.dtype == dtype and dist.shape == (n, m) and err <= rtol
+        all_ok = all_ok and ok
+        print(name, "tile_bytes:", tile_bytes, "max rel err:", err, "ok:", ok, "time:", elapsed)
+    if dtype != torch.float16:
+        t = time.time()
+        expand_distance(x, y, exp)
+        print(name, "expand time:", time.time() - t)
+
+# identical points must give exact zeros, not small negatives
+x = torch.randn(50, d) + 100
+ok = bool((pairwise_distances(x, x).diagonal() == 0).all()) and bool((pairwise_distances(x, x) >= 0).all())
+all_ok = all_ok and ok
+print("zero diagonal ok:", ok)
+
+# writing into a preallocated slice, as compute_score does
+out = torch.zeros(n + 10, m)
+x = torch.randn(n, d)
+y = torch.randn(m, d)
+pairwise_distances(x, y, out=out[10:])
+ok = torch.allclose(out[10:], expand_distance(x, y), rtol=1e-4, atol=1e-4) and bool((out[:10] == 0).all())
+all_ok = all_ok and ok
+print("out slice ok:", ok)
+
+print("Parity", "passed" if all_ok else "FAILED")
+sys.exit(0 if all_ok else 1)
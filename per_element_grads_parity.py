@@ -0,0 +1,52 @@
+import sys
+import time
+import torch
+import torch.nn as nn
+from models.logistic_regression import LogisticRegNet
+from models.simpleNN_net import TwoLayerNet, ThreeLayerNet
+from models.per_element_grads import chunk_loader, compute_per_element_grads, functional_call
+
+## Parity check of the batched per-element gradient engine against the
+## original per-element autograd loop used by SetFunctionTaylor.
+## python3 per_element_grads_parity.py [num_points] [chunk_size]
+
+num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+num_features = 54
+num_cls = 7
+
+torch.manual_seed(42)
+x_trn = torch.randn(num_points, num_features)
+y_trn = torch.randint(0, num_cls, (num_points,))
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+models = [('LogisticRegNet', LogisticRegNet(num_features, num_cls)),
+          ('TwoLayerNet', TwoLayerNet(num_features, num_cls, 100)),
+          ('ThreeLayerNet', ThreeLayerNet(num_features, num_cls, 50, 50))]
+backends = ['linear', 'loop'] + (['vmap'] if functional_call is not None else [])
+
+all_ok = True
+for model_name, model in models:
+    params = list(model.parameters())
+    last_params = list(model.parameters())[-2:]
+    for param_name, curr_params in [('all', params), ('last', last_params)]:
+        # Reference: exactly the loop in SetFunctionTaylor._compute_per_element_grads before the engine
+        t = time.time()
+        losses = criterion_nored(model(x_trn), y_trn)
+        ref = torch.zeros((num_points, sum(p.numel() for p in curr_params)))
+        for item in range(num_points):
+            ref[item] = torch.cat([g.flatten() for g in torch.autograd.grad(losses[item], curr_params, retain_graph=True)])
+        ref_time = time.time() - t
+        for backend in backends:
+            t = time.time()
+            grads = compute_per_element_grads(model, criterion_nored, chunk_loader(x_trn, y_trn, chunk_size),
+                                              curr_params, backend=backend)
+            elapsed = time.time() - t
+            max_diff = (grads - ref).abs().max().item()
+            ok = torch.allclose(grads, ref, atol=1e-5, rtol=1e-4)
+            all_ok = all_ok and ok
+            print(model_name, param_name, backend, "max abs diff:", max_diff, "ok:", ok,
+                  "time:", elapsed, "loop time:", ref_time)
+
+print("Parity", "passed" if all_ok else "FAILED")
+sys.exit(0 if all_ok else 1)
@@ -0,0 +1,65 @@
+import copy
+import sys
+import time
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor, SetFunctionCRAIG_Super, SetFunctionFacLoc
+from utils.custom_dataset import load_tiled_dataset
+
+## Selection overlap of the fp16 / bf16 storage precision policy (models/precision.py)
+## against fp32, for the Taylor greedy (per-element grads), CRAIG (dist_mat, class
+## wise) and facility location (dist_mat), with the size of the cached matrix and the
+## selection time. The training set can be tiled `repeat` times (plus a little noise)
+## to get matrices large enough for the timings to mean something.
+## python3 precision_overlap.py <datadir> [data_name] [fraction] [repeat]
+## e.g. python3 precision_overlap.py ./data sklearn-digits 0.1 4
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+learning_rate = 0.05
+precisions = ['fp32', 'fp16', 'bf16']
+
+x_trn, y_trn, x_val, y_val, num_fea, num_cls = load_tiled_dataset(datadir, data_name, repeat)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+print("Data sizes:", x_trn.shape, x_val.shape, "budget:", bud)
+
+model = TwoLayerNet(num_fea, num_cls, 100)
+theta_init = copy.deepcopy(model.state_dict())
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+
+def taylor(precision):
+    setf = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored,
+                             learning_rate, 'cpu', precision=precision)
+    subset = setf.naive_greedy_max(bud, copy.deepcopy(theta_init))
+    return subset, setf.flat_grads_mat
+
+
+def craig(precision):
+    # one class per call of compute_score, the last class' dist_mat is the one kept
+    setf = SetFunctionCRAIG_Super('cpu', x_trn, y_trn, True, precision=precision)
+    subset, _ = setf.class_wise(bud, model)
+    return [int(i) for i in subset], setf.dist_mat
+
+
+def facloc(precision):
+    setf = SetFunctionFacLoc('cpu', [(x_trn, y_trn)], precision=precision)
+    return setf.lazy_greedy_max(bud, model), setf.dist_mat
+
+
+print("set_function precision matrix_MB time overlap_with_fp32")
+for name, select in [('taylor', taylor), ('craig', craig), ('facloc', facloc)]:
+    ref = None
+    for precision in precisions:
+        t = time.time()
+        subset, mat = select(precision)
+        elapsed = time.time() - t
+        if ref is None:
+            ref = set(subset)
+        print(name, precision, round(mat.numel() * mat.element_size() / 2. ** 20, 1), round(elapsed, 3),
+              round(len(set(subset) & ref) / float(len(ref)), 4))
@@ -0,0 +1,83 @@
+import math
+import sys
+import time
+import numpy as np
+import torch
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionFacLoc
+from models.sieve_streaming import SieveStreamingFacLoc
+from models.pairwise_distance import pairwise_distances
+from utils.custom_dataset import load_tiled_dataset
+
+## Single pass sieve streaming facility location (models/sieve_streaming.py, the
+## run_sieve_Facloc of the drivers) against the sampled repeated greedy of
+## run_stochastic_Facloc and, if the pool is small enough for its N x N matrix, the
+## full lazy greedy of SetFunctionFacLoc. Reports the selection time, the size of the
+## distance matrices each one holds at once, the subset size and the facility location objective
+## (exemplar form, on a random evaluation sample of the pool) relative to the best.
+## The training set can be tiled `repeat` times (plus a little noise) for larger pools.
+## python3 sieve_streaming_report.py <datadir> [data_name] [fraction] [repeat] [epsilons]
+## e.g. python3 sieve_streaming_report.py ./data sklearn-digits 0.05 8 0.1,0.3
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+epsilons = [float(e) for e in sys.argv[5].split(',')] if len(sys.argv) > 5 else [0.1, 0.3]
+max_full_N = 20000
+
+x_trn, y_trn, _, _, num_fea, num_cls = load_tiled_dataset(datadir, data_name, repeat)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+model = TwoLayerNet(num_fea, num_cls, 100)
+print("Data sizes:", x_trn.shape, "budget:", bud)
+
+evals = x_trn[torch.from_numpy(np.random.RandomState(0).choice(N, min(N, 4096), replace=False))]
+eval_dist = pairwise_distances(evals, evals.mean(dim=0, keepdim=True)).flatten()
+
+
+def objective(idxs):
+    dist = pairwise_distances(evals, x_trn[torch.tensor([int(i) for i in idxs])]).min(1)[0]
+    return (eval_dist - torch.min(eval_dist, dist)).sum().item()
+
+
+def stochastic():
+    # run_stochastic_Facloc of new_run_onestep_selection_minibatch.py
+    per_iter_bud = 10
+    num_iterations = int(bud / 10)
+    sample_size = int(N / num_iterations * math.log(1 / 0.01))
+    facloc_indices = []
+    for i in range(num_iterations):
+        rem_indices = list(set(range(N)).difference(set(facloc_indices)))
+        sub_indices = np.random.choice(rem_indices, size=min(sample_size, len(rem_indices)), replace=False)
+        setf_model = SetFunctionFacLoc('cpu', [(x_trn[sub_indices], y_trn[sub_indices])])
+        idxs = setf_model.lazy_greedy_max(per_iter_bud, model)
+        facloc_indices.extend([sub_indices[idx] for idx in idxs])
+    return facloc_indices, min(sample_size, N) ** 2
+
+
+def sieve(epsilon):
+    def select():
+        perm = np.random.RandomState(42).permutation(N)
+        setf_model = SieveStreamingFacLoc(bud, epsilon)
+        idxs = setf_model.fit(x_trn[perm[start:start + 4096]] for start in range(0, N, 4096))
+        return [perm[idx] for idx in idxs], 4096 * setf_model.num_ref + len(setf_model.sieves) * setf_model.num_ref
+    return select
+
+
+def full():
+    return SetFunctionFacLoc('cpu', [(x_trn, y_trn)]).lazy_greedy_max(bud, model), N ** 2
+
+
+runs = [('sieve eps=%g' % e, sieve(e)) for e in epsilons] + [('stochastic', stochastic)]
+if N <= max_full_N:
+    runs.append(('full lazy greedy', full))
+results = []
+for name, select in runs:
+    t = time.time()
+    idxs, entries = select()
+    results.append((name, time.time() - t, entries, len(idxs), objective(idxs)))
+best = max(r[4] for r in results)
+print("method time matrices_MB subset_size objective_rel")
+for name, elapsed, entries, size, value in results:
+    print(name, round(elapsed, 3), round(entries * 4 / 2. ** 20, 1), size, round(value / best, 4))
@@ -0,0 +1,98 @@
+import copy
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor
+from utils.custom_dataset import load_dataset_custom
+
+## Accuracy vs dimension of the sketched Taylor selection (SetFunctionTaylor(...,
+## sketch_dim=d, sketch=kind)) against the exact one, per dataset and projection:
+## correlation of the first round gains with the exact gains, overlap with the exact
+## selection, one step validation loss of the subset, selection time and the test
+## accuracy of a model trained on the subset.
+## Datasets are read from <datadir>/<data_name> (sklearn-digits needs no files, the
+## toy datasets are the ones written by toy_data.py).
+## python3 sketch_dimension_report.py <datadir> [data_names] [fraction] [dims] [kinds] [train epochs]
+## e.g. python3 sketch_dimension_report.py ./data sklearn-digits,linsep_4,clf_2 0.1 16,64,256,1024 gaussian,sparse 200
+
+datadir = sys.argv[1]
+data_names = sys.argv[2].split(',') if len(sys.argv) > 2 else ['sklearn-digits']
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+dims = [int(d) for d in sys.argv[4].split(',')] if len(sys.argv) > 4 else [16, 64, 256, 1024]
+kinds = sys.argv[5].split(',') if len(sys.argv) > 5 else ['gaussian', 'sparse']
+train_epochs = int(sys.argv[6]) if len(sys.argv) > 6 else 200
+learning_rate = 0.05
+warm_epochs = 20
+device = "cuda" if torch.cuda.is_available() else "cpu"
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+
+def to_tensors(split):
+    return torch.from_numpy(split[0]).float().to(device), torch.from_numpy(split[1]).long().to(device)
+
+
+def train_on_subset(model, theta, x, y, subset, x_tst, y_tst):
+    # full batch SGD on the subset from theta, test accuracy at the end
+    model.load_state_dict(theta)
+    optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
+    idxs = torch.as_tensor(subset, device=device)
+    for _ in range(train_epochs):
+        optimizer.zero_grad()
+        criterion(model(x[idxs]), y[idxs]).backward()
+        optimizer.step()
+    with torch.no_grad():
+        return (model(x_tst).argmax(dim=1) == y_tst).float().mean().item()
+
+
+def one_step_val_loss(model, theta, grads, x_val, y_val):
+    model.load_state_dict(theta)
+    with torch.no_grad():
+        for param, g in zip(model.parameters(), grads):
+            param.data.sub_(learning_rate * g)
+        return criterion(model(x_val), y_val).item()
+
+
+print("dataset P kind dim gain_corr overlap one_step_val_loss time test_acc")
+for data_name in data_names:
+    torch.manual_seed(42)
+    np.random.seed(42)
+    fullset, valset, testset, num_fea, num_cls = load_dataset_custom(os.path.join(datadir, data_name), data_name, 'dss')
+    x_trn, y_trn = to_tensors(fullset)
+    x_val, y_val = to_tensors(valset)
+    x_tst, y_tst = to_tensors(testset)
+    bud = int(fraction * x_trn.shape[0])
+
+    model = TwoLayerNet(num_fea, num_cls, 100).to(device)
+    num_params = sum(p.numel() for p in model.parameters())
+    optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
+    # A few full batch epochs so that the selection does not run at the random init
+    for i in range(warm_epochs):
+        optimizer.zero_grad()
+        criterion(model(x_trn), y_trn).backward()
+        optimizer.step()
+    theta_init = copy.deepcopy(model.state_dict())
+
+    runs = [('exact', None)] + [(kind, d) for kind in kinds for d in dims]
+    exact = None
+    for kind, d in runs:
+        setf = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored,
+                                 learning_rate, device, sketch_dim=d, sketch=kind)
+        setf._compute_per_element_grads(copy.deepcopy(theta_init))
+        setf._compute_init_valloss_grads(copy.deepcopy(theta_init))
+        gains = setf.grads_per_elem.dot(setf.flatten_params(setf.grads_curr_subset))
+        t = time.time()
+        subset = setf.naive_greedy_max(bud, copy.deepcopy(theta_init))
+        elapsed = time.time() - t
+        model.load_state_dict(theta_init)
+        loss = one_step_val_loss(model, theta_init, setf.grads_per_elem.block(subset), x_val, y_val)
+        acc = train_on_subset(model, theta_init, x_trn, y_trn, subset, x_tst, y_tst)
+        if exact is None:
+            exact = (gains, set(subset))
+        corr = np.corrcoef(gains.cpu().numpy(), exact[0].cpu().numpy())[0, 1]
+        print(data_name, num_params, kind, d if d is not None else num_params, round(float(corr), 4),
+              round(len(set(subset) & exact[1]) / float(bud), 4), round(loss, 6), round(elapsed, 3), round(acc, 4))
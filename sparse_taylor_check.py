@@ -0,0 +1,58 @@
+import copy
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from models.logistic_regression import LogisticRegNet
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor
+from utils.custom_dataset import load_dataset_custom, csr_to_tensor
+
+## Sparse mode check for the libsvm datasets: loads <data_name> as CSR
+## (load_dataset_custom(..., sparse=True)), runs the SetFunctionTaylor greedy on the
+## sparse tensors (factored per-element grads, torch.sparse first layer) and on the
+## same data densified, and compares selections, time and gradient store sizes.
+## python3 sparse_taylor_check.py <datadir> <data_name> [fraction] [model: lr|nn]
+## e.g. python3 sparse_taylor_check.py ./data/adult adult 0.1 lr
+
+datadir = sys.argv[1]
+data_name = sys.argv[2]
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+model_name = sys.argv[4] if len(sys.argv) > 4 else 'lr'
+learning_rate = 0.05
+
+torch.manual_seed(42)
+np.random.seed(42)
+fullset, valset, testset, num_fea, num_cls = load_dataset_custom(datadir, data_name, 'dss', sparse=True)
+x_trn, y_trn = csr_to_tensor(fullset[0]), torch.from_numpy(fullset[1]).long()
+x_val, y_val = csr_to_tensor(valset[0]), torch.from_numpy(valset[1]).long()
+N = x_trn.shape[0]
+bud = int(fraction * N)
+print("Data sizes:", x_trn.shape, x_val.shape, "nnz per row:", x_trn._nnz() / float(N), "budget:", bud)
+
+model = LogisticRegNet(num_fea, num_cls) if model_name == 'lr' else TwoLayerNet(num_fea, num_cls, 100)
+theta_init = copy.deepcopy(model.state_dict())
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+
+def store_bytes(setf):
+    if setf.flat_grads_mat is not None:
+        return setf.flat_grads_mat.numel() * setf.flat_grads_mat.element_size()
+    grads = setf.grads_per_elem
+    total = 0
+    for t in list(grads.dzs.values()) + list(grads.acts.values()):
+        total += t._values().numel() * 12 if t.is_sparse else t.numel() * t.element_size()
+    return total
+
+
+subsets = {}
+for mode, xt, xv in [('sparse', x_trn, x_val), ('dense', x_trn.to_dense(), x_val.to_dense())]:
+    setf = SetFunctionTaylor(xt, y_trn, xv, y_val, True, model, criterion, criterion_nored, learning_rate, 'cpu')
+    t = time.time()
+    subsets[mode] = setf.naive_greedy_max(bud, copy.deepcopy(theta_init))
+    print(mode, "selection time:", round(time.time() - t, 3), "grad store MB:", round(store_bytes(setf) / 2. ** 20, 2))
+
+print("same selection:", sorted(subsets['sparse']) == sorted(subsets['dense']),
+      "overlap:", len(set(subsets['sparse']) & set(subsets['dense'])) / float(bud))
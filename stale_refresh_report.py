@@ -0,0 +1,82 @@
+import copy
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from models.simpleNN_net import TwoLayerNet
+from models.set_function_all import SetFunctionTaylor
+from models.gradient_cache import GradientCache
+from utils.custom_dataset import load_dataset_custom
+
+## Cost / quality of reusing stale per-element gradients across selection rounds
+## (SetFunctionTaylor(..., grads_cache=GradientCache(fraction, policy, max_age))).
+## Runs the online Taylor selection loop of timing_analysis.py (full batch SGD on the
+## subset, reselection every select_every epochs) once per refresh policy and, at
+## every round, also the fresh full recomputation at the same parameters. Reports per
+## policy the mean selection time, gradient refresh time and rows recomputed per round,
+## the relative error of the cached gradient matrix, the overlap of the selections
+## with the fresh ones, the mean age of the cached rows and the final test accuracy.
+## python3 stale_refresh_report.py <datadir> [data_name] [fraction] [num_epochs] [select_every] [policies]
+## e.g. python3 stale_refresh_report.py ./data sklearn-digits 0.1 200 10 full:1,shard:0.25,loss:0.25,loss:0.1:8
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+num_epochs = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+select_every = int(sys.argv[5]) if len(sys.argv) > 5 else 10
+policies = [p.split(':') for p in sys.argv[6].split(',')] if len(sys.argv) > 6 else \
+    [['full', '1'], ['shard', '0.25'], ['loss', '0.25'], ['loss', '0.1', '8']]
+learning_rate = 0.05
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+torch.manual_seed(42)
+np.random.seed(42)
+fullset, valset, testset, num_fea, num_cls = load_dataset_custom(os.path.join(datadir, data_name), data_name, 'dss')
+x_trn, y_trn = torch.from_numpy(fullset[0]).float().to(device), torch.from_numpy(fullset[1]).long().to(device)
+x_val, y_val = torch.from_numpy(valset[0]).float().to(device), torch.from_numpy(valset[1]).long().to(device)
+x_tst, y_tst = torch.from_numpy(testset[0]).float().to(device), torch.from_numpy(testset[1]).long().to(device)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+start_idxs = np.random.choice(N, size=bud, replace=False)
+print("Data sizes:", x_trn.shape, x_val.shape, "budget:", bud, "rounds:", num_epochs // select_every)
+criterion = nn.CrossEntropyLoss()
+criterion_nored = nn.CrossEntropyLoss(reduction='none')
+
+print("policy fraction max_age sel_time refresh_time rows_per_round grad_rel_err overlap_with_fresh staleness_mean test_acc")
+for policy in policies:
+    torch.manual_seed(42)
+    model = TwoLayerNet(num_fea, num_cls, 100).to(device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
+    cache = GradientCache(float(policy[1]), policy[0], int(policy[2]) if len(policy) > 2 else None)
+    setf_model = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored,
+                                   learning_rate, device, grads_cache=cache)
+    fresh_model = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, True, model, criterion, criterion_nored,
+                                    learning_rate, device)
+    idxs = list(start_idxs)
+    sel_times, refresh_times, rows, errs, overlaps, ages = [], [], [], [], [], []
+    for i in range(num_epochs):
+        optimizer.zero_grad()
+        criterion(model(x_trn[idxs]), y_trn[idxs]).backward()
+        optimizer.step()
+        if (i + 1) % select_every == 0:
+            cached_state_dict = copy.deepcopy(model.state_dict())
+            t_ng_start = time.time()
+            new_idxs = setf_model.naive_greedy_max(bud, copy.deepcopy(cached_state_dict))
+            sel_times.append(time.time() - t_ng_start)
+            refresh_times.append(cache.refresh_time)
+            rows.append(cache.num_refreshed)
+            ages.append(cache.staleness()[0])
+            # fresh gradients and selection at the same parameters
+            fresh_idxs = fresh_model.naive_greedy_max(bud, copy.deepcopy(cached_state_dict))
+            errs.append((torch.norm(cache.flat_grads_mat - fresh_model.flat_grads_mat) /
+                         torch.norm(fresh_model.flat_grads_mat)).item())
+            overlaps.append(len(set(new_idxs) & set(fresh_idxs)) / float(bud))
+            model.load_state_dict(cached_state_dict)
+            idxs = new_idxs
+    with torch.no_grad():
+        tst_acc = (model(x_tst).argmax(dim=1) == y_tst).float().mean().item()
+    print(policy[0], policy[1], policy[2] if len(policy) > 2 else '-', round(np.mean(sel_times), 4),
+          round(np.mean(refresh_times), 4), int(np.mean(rows)), round(np.mean(errs), 4), round(np.mean(overlaps), 4),
+          round(np.mean(ages), 2), round(tst_acc, 4))
@@ -0,0 +1,66 @@
+import sys
+import time
+import torch
+from models.simpleNN_net import TwoLayerNet
+from models.FacilityLocation import SetFunctionFacLoc
+from models.lazy_greedy import lazy_greedy, threshold_greedy
+from utils.custom_dataset import load_tiled_dataset
+
+## Decreasing threshold greedy (threshold_greedy, SetFunctionFacLoc(..., epsilon=...))
+## against the lazy greedy for facility location. Per engine and epsilon: the greedy
+## time, the number of gains() calls and of rows they evaluated (the initial gains of
+## all N elements, shared by both, excluded), the objective relative to the lazy greedy
+## and the overlap of the selections, then the end to end lazy_greedy_max time (with
+## the dist_mat). The training set can be tiled `repeat` times (plus a little noise).
+## python3 threshold_greedy_report.py <datadir> [data_name] [fraction] [repeat] [epsilons]
+## e.g. python3 threshold_greedy_report.py ./data sklearn-digits 0.1 4 0.01,0.05,0.1,0.2
+
+datadir = sys.argv[1]
+data_name = sys.argv[2] if len(sys.argv) > 2 else 'sklearn-digits'
+fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+epsilons = [float(e) for e in sys.argv[5].split(',')] if len(sys.argv) > 5 else [0.01, 0.05, 0.1, 0.2]
+
+x_trn, y_trn, _, _, num_fea, num_cls = load_tiled_dataset(datadir, data_name, repeat)
+N = x_trn.shape[0]
+bud = int(fraction * N)
+model = TwoLayerNet(num_fea, num_cls, 100)
+print("Data sizes:", x_trn.shape, "budget:", bud)
+
+setf = SetFunctionFacLoc('cpu', [(x_trn, y_trn)])
+id_first = setf.compute_score(model)
+max_sim_first = setf.max_sim.clone()
+
+
+def run(engine, **kwargs):
+    setf.max_sim = max_sim_first.clone()
+    stats = [0, 0]
+
+    def gains(idxs):
+        stats[0] += 1
+        stats[1] += len(idxs)
+        return setf.sim_rows(idxs).sub_(setf.max_sim).clamp_(min=0).sum(1)
+
+    def add(j):
+        setf.max_sim = torch.max(setf.max_sim, setf.sim_rows(torch.tensor([j]))[0])
+
+    init_gains = torch.cat([gains(torch.arange(start, min(N, start + 32))) for start in range(0, N, 32)])
+    stats[:] = [0, 0]
+    t = time.time()
+    subset = engine(gains, add, N, bud, [id_first], init_gains=init_gains, **kwargs)
+    return subset, time.time() - t, stats, setf.max_sim.sum().item()
+
+
+ref, elapsed, stats, ref_value = run(lazy_greedy)
+print("engine epsilon greedy_time gains_calls rows objective_rel overlap_with_lazy")
+print('lazy', '-', round(elapsed, 3), stats[0], stats[1], 1.0, 1.0)
+for epsilon in epsilons:
+    subset, elapsed, stats, value = run(threshold_greedy, epsilon=epsilon)
+    print('threshold', epsilon, round(elapsed, 3), stats[0], stats[1], round(value / ref_value, 6),
+          round(len(set(subset) & set(ref)) / float(bud), 4))
+
+print("end to end lazy_greedy_max: epsilon time")
+for epsilon in [None] + epsilons:
+    t = time.time()
+    SetFunctionFacLoc('cpu', [(x_trn, y_trn)], epsilon=epsilon).lazy_greedy_max(bud, model)
+    print(epsilon if epsilon is not None else '- (lazy)', round(time.time() - t, 3))
@@ -17,6 +17,7 @@ from models.set_function_all import SetFunctionFacLoc, SetFunctionTaylor, SetFun
 #from models.set_function_craig import SetFunction2 as CRAIG
 from models.set_function_craig import SetFunctionCRAIG_Super as CRAIG
 from models.set_function_ideas import SetFunctionTaylorDeep_ReLoss_Mean
+from models.gradient_cache import GradientCache
 from sklearn.model_selection import train_test_split
 from utils.custom_dataset import load_dataset_numpy, write_knndata
 from custom_dataset_old import load_dataset_numpy as load_dataset_numpy_old, write_knndata as write_knndata_old
@@ -36,6 +37,8 @@ fraction = float(sys.argv[3])
 num_epochs = int(sys.argv[4])
 select_every = int(sys.argv[5])
 feature = sys.argv[6]# 70
+# optional per-element gradient reuse across rounds, policy:fraction[:max_age], e.g. loss:0.25:8
+refresh = sys.argv[7].split(':') if len(sys.argv) > 7 else None
 warm_method = 0  # whether to use warmstart-onestep (1) or online (0)
 num_runs = 1  # number of random runs
 learning_rate = 0.05
@@ -243,8 +246,11 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
                                        criterion, criterion_nored, learning_rate, device)
 
     else:
+        grads_cache = None
+        if refresh is not None:
+            grads_cache = GradientCache(float(refresh[1]), refresh[0], int(refresh[2]) if len(refresh) > 2 else None)
         setf_model = SetFunctionTaylor(x_trn, y_trn, x_val, y_val, valid, model,
-                                       criterion, criterion_nored, learning_rate, device)
+                                       criterion, criterion_nored, learning_rate, device, grads_cache=grads_cache)
 
     if func_name == 'Taylor Online':
         print("Starting Online OneStep Run with taylor on loss!")
@@ -359,6 +365,11 @@ def train_model_taylor(func_name, start_rand_idxs=None, bud=None, valid=True, fa
             else:
                 new_idxs = setf_model.naive_greedy_max(bud, clone_dict)  # , grads_idxs
                 idxs = new_idxs  # update the current set
+            if getattr(setf_model, 'grads_cache', None) is not None:
+                # cost / quality of the partial refresh: rows recomputed, age of the reused ones
+                print("Selection time:", time.time() - t_ng_start, "refresh time:", setf_model.grads_cache.refresh_time,
+                      "refreshed rows:", setf_model.grads_cache.num_refreshed,
+                      "staleness (mean, max):", setf_model.grads_cache.staleness(), file=logfile)
             model.load_state_dict(cached_state_dict)
 
     print("SelectionRun---------------------------------")
@@ -1,5 +1,8 @@
+import hashlib
 import numpy as np
 import os
+import shutil
+import scipy.sparse as sp
 import torch
 import torchvision
 from matplotlib import pyplot as plt
@@ -57,59 +60,184 @@ class CustomDataset_WithId(Dataset):
         return sample_data, label,idx #.astype('float32')
 
 
+## MNIST / CIFAR images kept as one contiguous uint8 N x C x H x W tensor. The
+## torchvision datasets build a PIL image and run ToTensor + Normalize per
+## __getitem__; here any batch of indices (int, list, array or LongTensor) is one
+## gather plus one vectorized normalization, giving the same floats as the per image
+## transform. index_batch in models.last_layer_grads uses this (batched_indexing).
+class NormalizedImageDataset(Dataset):
+    batched_indexing = True
+
+    def __init__(self, source, mean, std):
+        images = torch.as_tensor(source.data)
+        # MNIST keeps N x H x W tensors, CIFAR N x H x W x C arrays
+        self.images = images.unsqueeze(1).contiguous() if images.dim() == 3 else images.permute(0, 3, 1, 2).contiguous()
+        self.data = source.data
+        self.targets = torch.as_tensor(source.targets, dtype=torch.long)
+        self.mean = torch.as_tensor(mean, dtype=torch.float32).view(-1, 1, 1)
+        self.std = torch.as_tensor(std, dtype=torch.float32).view(-1, 1, 1)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def to(self, device):
+        # Keeps the images (uint8) on `device`, batches are then gathered and normalized there
+        self.images, self.targets = self.images.to(device), self.targets.to(device)
+        self.mean, self.std = self.mean.to(device), self.std.to(device)
+        return self
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (list, np.ndarray)):
+            idx = torch.as_tensor(np.asarray(idx), dtype=torch.long)
+        # ToTensor divides by 255, Normalize subtracts the mean and divides by the std
+        sample_data = self.images[idx].to(torch.float32).div_(255).sub_(self.mean).div_(self.std)
+        return sample_data, self.targets[idx]
+
+
 ## Utility function to load datasets from libsvm datasets
-def csv_file_load(path,dim, save_data=False):
-    data = []
-    target = []
-    with open(path) as fp:
-       line = fp.readline()
-       while line:
-        temp = [i for i in line.strip().split(",")]
-        target.append(int(float(temp[-1]))) # Class Number. # Not assumed to be in (0, K-1)
-        temp_data = [0]*dim
-        count = 0
-        for i in temp[:-1]:
-            #ind, val = i.split(':')
-            temp_data[count] = float(i)
-            count += 1
-        data.append(temp_data)
-        line = fp.readline()
-    X_data = np.array(data, dtype=np.float32)
-    Y_label = np.array(target)
-    if save_data:
-        # Save the numpy files to the folder where they come from
-        data_np_path = path + '.data.npy'
-        target_np_path = path + '.label.npy'
-        np.save(data_np_path, X_data)
-        np.save(target_np_path, Y_label)
+## The text files are parsed a chunk of lines at a time (one split and one float
+## conversion per chunk instead of per token) and cached as .npy files next to them,
+## keyed by the sha1 of the file and dim. Later loads memory map the cache (copy on
+## write). Bump CACHE_VERSION whenever the parsing changes.
+CACHE_VERSION = 1
+PARSE_CHUNK_BYTES = 64 * 2 ** 20
+
+
+def file_hash(path):
+    # Remembered in <path>.sha1 along with the size and mtime of the file, so an
+    # unchanged file is not read again
+    stat = os.stat(path)
+    stamp = '%d %d' % (stat.st_size, stat.st_mtime_ns)
+    try:
+        with open(path + '.sha1') as fp:
+            saved_stamp, digest = fp.read().rsplit(' ', 1)
+        if saved_stamp == stamp:
+            return digest
+    except (OSError, ValueError):
+        pass
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(2 ** 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    try:
+        with open(path + '.sha1.tmp%d' % os.getpid(), 'w') as fp:
+            fp.write(stamp + ' ' + digest)
+        os.replace(path + '.sha1.tmp%d' % os.getpid(), path + '.sha1')
+    except OSError:
+        pass
+    return digest
+
+
+def cached_file_load(path, dim, parse_fn, kind, cache=True):
+    """(X_data, Y_label) = parse_fn(path, dim), read back from the binary cache if there is one."""
+    if not cache:
+        return parse_fn(path, dim)
+    prefix = '%s.%s.v%d.%s.%d' % (path, kind, CACHE_VERSION, file_hash(path)[:16], dim)
+    data_np_path = prefix + '.data.npy'
+    target_np_path = prefix + '.label.npy'
+    csr_np_path = prefix + '.data.npz'  # CSR data (sparse=True) can not be memory mapped
+    if os.path.exists(csr_np_path) and os.path.exists(target_np_path):
+        return sp.load_npz(csr_np_path), np.asarray(np.load(target_np_path, mmap_mode='c'))
+    if os.path.exists(data_np_path) and os.path.exists(target_np_path):
+        return np.asarray(np.load(data_np_path, mmap_mode='c')), np.asarray(np.load(target_np_path, mmap_mode='c'))
+    X_data, Y_label = parse_fn(path, dim)
+    try:
+        # Written under a temporary name first, an interrupted run must not leave a partial cache
+        np.save(target_np_path + '.tmp.npy', Y_label)
+        os.replace(target_np_path + '.tmp.npy', target_np_path)
+        if sp.issparse(X_data):
+            sp.save_npz(csr_np_path + '.tmp.npz', X_data)
+            os.replace(csr_np_path + '.tmp.npz', csr_np_path)
+        else:
+            np.save(data_np_path + '.tmp.npy', X_data)
+            os.replace(data_np_path + '.tmp.npy', data_np_path)
+    except OSError as e:
+        print("Not caching", path, e)
     return (X_data, Y_label)
 
-def libsvm_file_load(path,dim, save_data=False):
+
+def line_chunks(path):
+    with open(path) as fp:
+        lines = fp.readlines(PARSE_CHUNK_BYTES)
+        while lines:
+            yield [line for line in lines if line.strip()]
+            lines = fp.readlines(PARSE_CHUNK_BYTES)
+
+
+def parse_csv(path, dim):
+    # label,f_1,...,f_k per line (k <= dim, missing features are 0)
     data = []
     target = []
-    with open(path) as fp:
-       line = fp.readline()
-       while line:
-        temp = [i for i in line.strip().split(" ")]
-        target.append(int(float(temp[0]))) # Class Number. # Not assumed to be in (0, K-1)
-        temp_data = [0]*dim
-        
-        for i in temp[1:]:
-            ind,val = i.split(':')
-            temp_data[int(ind)-1] = float(val)
-        data.append(temp_data)
-        line = fp.readline()
-    X_data = np.array(data,dtype=np.float32)
-    Y_label = np.array(target)
-    if save_data:
-        # Save the numpy files to the folder where they come from
-        data_np_path = path + '.data.npy'
-        target_np_path = path + '.label.npy'
-        np.save(data_np_path, X_data)
-        np.save(target_np_path, Y_label)
-    return (X_data, Y_label)
+    for lines in line_chunks(path):
+        counts = np.array([line.count(',') for line in lines])
+        tokens = np.array(','.join(lines).split(','), dtype=np.float64)
+        X_data = np.zeros((len(lines), dim), dtype=np.float32)
+        if (counts == counts[0]).all():
+            tokens = tokens.reshape(len(lines), counts[0] + 1)
+            X_data[:, :counts[0]] = tokens[:, :-1]
+            labels = tokens[:, -1]
+        else:
+            label_pos = np.cumsum(counts + 1) - 1
+            is_feature = np.ones(len(tokens), dtype=bool)
+            is_feature[label_pos] = False
+            rows = np.repeat(np.arange(len(lines)), counts)
+            cols = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            X_data[rows, cols] = tokens[is_feature]
+            labels = tokens[label_pos]
+        data.append(X_data)
+        target.append(labels.astype(np.int64)) # Class Number. # Not assumed to be in (0, K-1)
+    return (np.concatenate(data), np.concatenate(target))
+
+
+def parse_libsvm(path, dim, sparse=False):
+    # label index:value ... per line, 1-based feature indices
+    data = []
+    target = []
+    for lines in line_chunks(path):
+        counts = np.array([line.count(':') for line in lines])
+        tokens = np.array(' '.join(lines).replace(':', ' ').split(), dtype=np.float64)
+        label_pos = np.cumsum(1 + 2 * counts) - (1 + 2 * counts)
+        is_pair = np.ones(len(tokens), dtype=bool)
+        is_pair[label_pos] = False
+        pairs = tokens[is_pair].reshape(-1, 2)
+        if sparse:
+            indptr = np.concatenate(([0], np.cumsum(counts)))
+            X_data = sp.csr_matrix((pairs[:, 1].astype(np.float32), pairs[:, 0].astype(np.int64) - 1, indptr),
+                                   shape=(len(lines), dim))
+        else:
+            rows = np.repeat(np.arange(len(lines)), counts)
+            X_data = np.zeros((len(lines), dim), dtype=np.float32)
+            X_data[rows, pairs[:, 0].astype(np.int64) - 1] = pairs[:, 1]
+        data.append(X_data)
+        target.append(tokens[label_pos].astype(np.int64)) # Class Number. # Not assumed to be in (0, K-1)
+    return (sp.vstack(data, format='csr') if sparse else np.concatenate(data), np.concatenate(target))
+
+
+def parse_libsvm_csr(path, dim):
+    return parse_libsvm(path, dim, sparse=True)
+
+
+def csv_file_load(path,dim, cache=True):
+    return cached_file_load(path, dim, parse_csv, 'csv', cache)
+
+def libsvm_file_load(path,dim, cache=True, sparse=False):
+    # sparse: X_data as a scipy CSR matrix, csr_to_tensor makes the torch input of it
+    if sparse:
+        return cached_file_load(path, dim, parse_libsvm_csr, 'libsvm_csr', cache)
+    return cached_file_load(path, dim, parse_libsvm, 'libsvm', cache)
+
+
+def csr_to_tensor(x):
+    # scipy CSR -> float32 torch sparse COO, the input SparseInputLinear takes
+    coo = x.tocoo()
+    indices = torch.from_numpy(np.vstack((coo.row, coo.col)).astype(np.int64))
+    return torch.sparse_coo_tensor(indices, torch.from_numpy(coo.data.astype(np.float32)), coo.shape).coalesce()
 
-def census_load(path,dim, save_data=False):
+def census_load(path,dim, cache=True):
+    return cached_file_load(path, dim, parse_census, 'census', cache)
+
+def parse_census(path,dim):
     
     enum=enumerate(['Private', 'Self-emp-not-inc', 'Self-emp-inc', 'Federal-gov', 'Local-gov', 'State-gov', 'Without-pay', 
         'Never-worked'])
@@ -188,15 +316,11 @@ def census_load(path,dim, save_data=False):
             line = fp.readline()
     X_data = np.array(data, dtype=np.float32)
     Y_label = np.array(target)
-    if save_data:
-        # Save the numpy files to the folder where they come from
-        data_np_path = path + '.data.npy'
-        target_np_path = path + '.label.npy'
-        np.save(data_np_path, X_data)
-        np.save(target_np_path, Y_label)
     return (X_data, Y_label)
 
-def create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst):
+def create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst, num_cls):
+    # CSR data (sparse=True) is stacked with scipy
+    row_stack = (lambda xs: sp.vstack(xs, format='csr')) if sp.issparse(x_trn) else np.row_stack
 
     samples_per_class = np.zeros(num_cls)
     val_samples_per_class = np.zeros(num_cls)
@@ -220,496 +344,239 @@ def create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst):
                 subset_idxs = np.random.choice(np.where(y_trn == i)[0], size=min_samples, replace=False)
             else:
                 subset_idxs = np.where(y_trn == i)[0]
-            x_trn_new = np.row_stack((x_trn_new, x_trn[subset_idxs]))
+            x_trn_new = row_stack((x_trn_new, x_trn[subset_idxs]))
             y_trn_new = np.row_stack((y_trn_new, y_trn[subset_idxs].reshape(-1, 1)))
     max_samples = int(np.max(val_samples_per_class))
     for i in range(num_cls):
         y_class = np.where(y_val == i)[0]
         if i == 0:
             subset_ids = np.random.choice(y_class, size=max_samples - y_class.shape[0], replace=True)
-            x_val_new = np.row_stack((x_val,x_val[subset_ids]))
+            x_val_new = row_stack((x_val,x_val[subset_ids]))
             y_val_new = np.row_stack((y_val.reshape(-1, 1),y_val[subset_ids].reshape(-1, 1)))
         else:
             subset_ids = np.random.choice(y_class, size=max_samples- y_class.shape[0], replace=True)
-            x_val_new = np.row_stack((x_val,x_val_new, x_val[subset_ids]))
+            x_val_new = row_stack((x_val,x_val_new, x_val[subset_ids]))
             y_val_new = np.row_stack((y_val.reshape(-1, 1),y_val_new, y_val[subset_ids].reshape(-1, 1)))
     max_samples = int(np.max(tst_samples_per_class))
     for i in range(num_cls):
         y_class = np.where(y_tst == i)[0]
         if i == 0:
             subset_ids = np.random.choice(y_class, size=max_samples - y_class.shape[0], replace=True)
-            x_tst_new = np.row_stack((x_tst,x_tst[subset_ids]))
+            x_tst_new = row_stack((x_tst,x_tst[subset_ids]))
             y_tst_new = np.row_stack((y_tst.reshape(-1, 1),y_tst[subset_ids].reshape(-1, 1)))
         else:
             subset_ids = np.random.choice(y_class, size=max_samples - y_class.shape[0], replace=True)
-            x_tst_new = np.row_stack((x_tst,x_tst_new, x_tst[subset_ids]))
+            x_tst_new = row_stack((x_tst,x_tst_new, x_tst[subset_ids]))
             y_tst_new = np.row_stack((y_tst.reshape(-1, 1),y_tst_new, y_tst[subset_ids].reshape(-1, 1)))
 
     return x_trn_new, y_trn_new.reshape(-1),x_val_new, y_val_new.reshape(-1), x_tst_new,y_tst_new.reshape(-1)
 
-def create_noisy(y_trn):
+def create_noisy(y_trn, num_cls):
     
     noise_size = int(len(y_trn) * 0.8)
     noise_indices = np.random.choice(np.arange(len(y_trn)), size=noise_size, replace=False)
     y_trn[noise_indices] = np.random.choice(np.arange(num_cls), size=noise_size, replace=True)
 
     return y_trn
-    
-def load_dataset_custom (datadir, dset_name,feature,isnumpy=True):
-    
-    if dset_name == "dna":
-        np.random.seed(42)
-        trn_file = os.path.join(datadir, 'dna.scale.trn')
-        val_file = os.path.join(datadir, 'dna.scale.val')
-        tst_file = os.path.join(datadir, 'dna.scale.tst')
-        data_dims = 180
-        num_cls = 3
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_val, y_val = libsvm_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        
-        y_trn -= 1  # First Class should be zero
-        y_val -= 1  # First Class should be zero
-        y_tst -= 1  # First Class should be zero
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn)
-            valset = CustomDataset(x_val, y_val)
-            testset = CustomDataset(x_tst, y_tst)
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "adult":
-        trn_file = os.path.join(datadir, 'a9a.trn')
-        tst_file = os.path.join(datadir, 'a9a.tst')
-        data_dims = 123
-        num_cls = 2
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        
-        y_trn[y_trn < 0] = 0
-        y_tst[y_tst < 0] = 0
-
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "connect_4":
-        trn_file = os.path.join(datadir, 'connect_4.trn')
-
-        data_dims = 126
-        num_cls = 3
-
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        # The class labels are (-1,0,1). Make them to (0,1,2)
-        y_trn[y_trn < 0] = 2
-
-        x_trn, x_tst, y_trn, y_tst = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-     elif dset_name == "letter":
-        trn_file = os.path.join(datadir, 'letter.scale.trn')
-        val_file = os.path.join(datadir, 'letter.scale.val')
-        tst_file = os.path.join(datadir, 'letter.scale.tst')
-        data_dims = 16
-        num_cls = 26 
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_val, y_val = libsvm_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        y_trn -= 1  # First Class should be zero
-        y_val -= 1
-        y_tst -= 1  # First Class should be zero
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "satimage":
-        np.random.seed(42)
-        trn_file = os.path.join(datadir, 'satimage.scale.trn')
-        val_file = os.path.join(datadir, 'satimage.scale.val')
-        tst_file = os.path.join(datadir, 'satimage.scale.tst')
-        data_dims = 36
-        num_cls = 6
-        
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_val, y_val = libsvm_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        
-        y_trn -= 1  # First Class should be zero
-        y_val -= 1
-        y_tst -= 1  # First Class should be zero
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
 
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "svmguide1":
-        np.random.seed(42)
-        trn_file = os.path.join(datadir, 'svmguide1.trn_full')
-        tst_file = os.path.join(datadir, 'svmguide1.tst')
-        data_dims = 4
-        num_cls = 2
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "usps":
-        trn_file = os.path.join(datadir, 'usps.trn_full')
-        tst_file = os.path.join(datadir, 'usps.tst')
-        data_dims = 256
-        num_cls = 10
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        y_trn -= 1  # First Class should be zero
-        y_tst -= 1  # First Class should be zero
-
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "ijcnn1":
-        trn_file = os.path.join(datadir, 'ijcnn1.trn')
-        val_file = os.path.join(datadir, 'ijcnn1.val')
-        tst_file = os.path.join(datadir, 'ijcnn1.tst')
-        data_dims = 22
-        num_cls = 2
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-        x_val, y_val = libsvm_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = libsvm_file_load(tst_file, dim=data_dims)
-        
-        # The class labels are (-1,1). Make them to (0,1)
-        y_trn[y_trn < 0] = 0
-        y_val[y_val < 0] = 0
-        y_tst[y_tst < 0] = 0    
-
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "sklearn-digits":
-        
-        np.random.seed(42)
-        data, target = datasets.load_digits(return_X_y=True)
-        # Test data is 10%
-        x_trn, x_tst, y_trn, y_tst = train_test_split(data, target, test_size=0.1, random_state=42)
-
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        num_cls = 10
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
 
+## Registry of the datasets load_dataset_custom knows. A spec gives the raw files
+## (part -> file name in datadir, '{}' is the dataset name), their format, the label
+## fix (y + y_offset, negative labels -> neg_label), the train/val/test splits taken
+## off the training file (in order, random_state=42), whether the features are
+## standard scaled and the numpy seed the dataset is loaded under.
+DATASETS = {}
+SPLITS = ('x_trn', 'y_trn', 'x_val', 'y_val', 'x_tst', 'y_tst')
+
+
+def register_dataset(names, files, fmt, dims, num_cls, y_offset=0, neg_label=None, splits=(), scale=True, seed=None):
+    for name in ([names] if isinstance(names, str) else names):
+        DATASETS[name] = dict(files=[(part, fname.format(name)) for part, fname in files], format=fmt,
+                              dims=dims, num_cls=num_cls, y_offset=y_offset, neg_label=neg_label,
+                              splits=list(splits), scale=scale, seed=seed)
+
+
+register_dataset('dna', [('trn', 'dna.scale.trn'), ('val', 'dna.scale.val'), ('tst', 'dna.scale.tst')],
+                 'libsvm', 180, 3, y_offset=-1, seed=42)
+register_dataset('adult', [('trn', 'a9a.trn'), ('tst', 'a9a.tst')], 'libsvm', 123, 2, neg_label=0,
+                 splits=[('val', 0.1)])
+# The class labels are (-1,0,1). Make them to (0,1,2)
+register_dataset('connect_4', [('trn', 'connect_4.trn')], 'libsvm', 126, 3, neg_label=2,
+                 splits=[('tst', 0.1), ('val', 0.1)])
+register_dataset('letter', [('trn', 'letter.scale.trn'), ('val', 'letter.scale.val'), ('tst', 'letter.scale.tst')],
+                 'libsvm', 16, 26, y_offset=-1)
+register_dataset('satimage', [('trn', 'satimage.scale.trn'), ('val', 'satimage.scale.val'), ('tst', 'satimage.scale.tst')],
+                 'libsvm', 36, 6, y_offset=-1, seed=42)
+register_dataset('svmguide1', [('trn', 'svmguide1.trn_full'), ('tst', 'svmguide1.tst')], 'libsvm', 4, 2,
+                 splits=[('val', 0.1)], seed=42)
+register_dataset('usps', [('trn', 'usps.trn_full'), ('tst', 'usps.tst')], 'libsvm', 256, 10, y_offset=-1,
+                 splits=[('val', 0.1)])
+register_dataset('ijcnn1', [('trn', 'ijcnn1.trn'), ('val', 'ijcnn1.val'), ('tst', 'ijcnn1.tst')], 'libsvm', 22, 2,
+                 neg_label=0)
+register_dataset('sklearn-digits', [], 'sklearn-digits', 64, 10, splits=[('tst', 0.1), ('val', 0.1)], seed=42)
+register_dataset(['prior_shift_large_linsep_4', 'conv_shift_large_linsep_4', 'red_large_linsep_4', 'expand_large_linsep_4',
+                  'shrink_large_linsep_4', 'red_conv_shift_large_linsep_4', 'linsep_4', 'large_linsep_4'],
+                 [('trn', '{}.trn'), ('val', '{}.val'), ('tst', '{}.tst')], 'csv', 2, 4, scale=False)
+register_dataset(['prior_shift_clf_2', 'prior_shift_gauss_2', 'conv_shift_clf_2', 'conv_shift_gauss_2', 'gauss_2', 'clf_2'],
+                 [('trn', '{}.trn'), ('val', '{}.val'), ('tst', '{}.tst')], 'csv', 2, 2)
+register_dataset('covertype', [('trn', 'covtype.data')], 'libsvm', 54, 7, y_offset=-1,
+                 splits=[('val', 0.1), ('tst', 0.2)])
+register_dataset('census', [('trn', 'adult.data'), ('tst', 'adult.test')], 'census', 14, 2, splits=[('val', 0.1)])
+
+
+def preprocess_dataset(datadir, spec, sparse=False):
+    """Raw files -> (x_trn, y_trn, x_val, y_val, x_tst, y_tst) as described by the spec."""
+    parts = {}
+    for part, fname in spec['files']:
+        path = os.path.join(datadir, fname)
+        if spec['format'] == 'libsvm':
+            parts[part] = libsvm_file_load(path, dim=spec['dims'], sparse=sparse)
+        elif spec['format'] == 'csv':
+            parts[part] = csv_file_load(path, dim=spec['dims'])
         else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name in ['prior_shift_large_linsep_4','conv_shift_large_linsep_4','red_large_linsep_4','expand_large_linsep_4',
-    'shrink_large_linsep_4','red_conv_shift_large_linsep_4',"linsep_4","large_linsep_4"]:
-        
-        trn_file = os.path.join(datadir, dset_name+'.trn')
-        val_file = os.path.join(datadir, dset_name+'.val')
-        tst_file = os.path.join(datadir, dset_name+'.tst')
-        data_dims = 2
-        num_cls = 4
-        x_trn, y_trn = csv_file_load(trn_file, dim=data_dims)
-        x_val, y_val = csv_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = csv_file_load(tst_file, dim=data_dims)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name in ['prior_shift_clf_2', 'prior_shift_gauss_2','conv_shift_clf_2', 'conv_shift_gauss_2',"gauss_2", "clf_2"]:
-        
-        trn_file = os.path.join(datadir, dset_name+'.trn')
-        val_file = os.path.join(datadir, dset_name+'.val')
-        tst_file = os.path.join(datadir, dset_name+'.tst')
-        data_dims = 2
-        num_cls = 2
-        x_trn, y_trn = csv_file_load(trn_file, dim=data_dims)
-        x_val, y_val = csv_file_load(val_file, dim=data_dims)
-        x_tst, y_tst = csv_file_load(tst_file, dim=data_dims)
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls 
-
-    elif dset_name == "covertype":
-        trn_file = os.path.join(datadir, 'covtype.data')
-
-        data_dims = 54
-        num_cls = 7
-        x_trn, y_trn = libsvm_file_load(trn_file, dim=data_dims)
-       
-        y_trn -= 1  # First Class should be zero
-        
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        x_trn, x_tst, y_trn, y_tst = train_test_split(x_trn, y_trn, test_size=0.2, random_state=42)
-        
-        sc = StandardScaler()
-        x_trn = sc.fit_transform(x_trn)
-        x_val = sc.transform(x_val)
-        x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
-        else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls
-
-    elif dset_name == "census":
-        trn_file = os.path.join(datadir, 'adult.data')
-        tst_file = os.path.join(datadir, 'adult.test')
-
-        data_dims = 14
-        num_cls = 2
-
-        x_trn, y_trn = census_load(trn_file, dim=data_dims)
-        x_tst, y_tst = census_load(tst_file, dim=data_dims)
-        
-        x_trn, x_val, y_trn, y_val = train_test_split(x_trn, y_trn, test_size=0.1, random_state=42)
-        sc = StandardScaler()
+            parts[part] = census_load(path, dim=spec['dims'])
+    if spec['format'] == 'sklearn-digits':
+        parts['trn'] = datasets.load_digits(return_X_y=True)
+
+    for x, y in parts.values():
+        if spec['y_offset']:
+            y += spec['y_offset']  # First Class should be zero
+        if spec['neg_label'] is not None:
+            y[y < 0] = spec['neg_label']
+
+    x_trn, y_trn = parts['trn']
+    for part, size in spec['splits']:
+        x_trn, x_part, y_trn, y_part = train_test_split(x_trn, y_trn, test_size=size, random_state=42)
+        parts[part] = (x_part, y_part)
+    x_val, y_val = parts['val']
+    x_tst, y_tst = parts['tst']
+
+    if spec['scale']:
+        sc = StandardScaler(with_mean=not sparse)  # centering would densify CSR data
         x_trn = sc.fit_transform(x_trn)
         x_val = sc.transform(x_val)
         x_tst = sc.transform(x_tst)
-
-        if feature == 'classimb':
-            x_trn, y_trn,x_val, y_val,x_tst, y_tst = create_imbalance(x_trn, y_trn,x_val, y_val,x_tst, y_tst)
-
-        elif feature == 'noise':
-            y_trn = create_noisy(y_trn)
-
-        if isnumpy:
-            fullset = (x_trn, y_trn)
-            valset = (x_val, y_val)
-            testset = (x_tst, y_tst)
-
+    return x_trn, y_trn, x_val, y_val, x_tst, y_tst
+
+
+## Preprocessed splits are cached under <datadir>/preprocessed, one directory per
+## dataset/variant named after a sha1 of everything they depend on: CACHE_VERSION,
+## the spec, the sha1 of every raw file, sparse and, for the classimb/noise variants,
+## the seed. Entries are never overwritten, a changed file or spec gives a new entry.
+## Reads memory map the arrays (copy on write), so a cached load takes milliseconds.
+def preprocessed_key(dset_name, spec, datadir, sparse, variant, seed):
+    sha = hashlib.sha1(repr((CACHE_VERSION, dset_name, sorted(spec.items()), sparse, variant, seed)).encode())
+    for part, fname in spec['files']:
+        sha.update(file_hash(os.path.join(datadir, fname)).encode())
+    return sha.hexdigest()
+
+
+def load_preprocessed(entry):
+    if not os.path.isdir(entry):
+        return None
+    arrays = []
+    for name in SPLITS:
+        path = os.path.join(entry, name)
+        if os.path.exists(path + '.npz'):
+            arrays.append(sp.load_npz(path + '.npz'))
         else:
-            fullset = CustomDataset(x_trn, y_trn,device)
-            valset = CustomDataset(x_val, y_val,device)
-            testset = CustomDataset(x_tst, y_tst,device)
-
-        return fullset, valset, testset, data_dims,num_cls
+            arrays.append(np.asarray(np.load(path + '.npy', mmap_mode='c')))
+    rng_path = os.path.join(entry, 'rng_state.npz')
+    if os.path.exists(rng_path):
+        # numpy RNG state right after the variant was made, as if it had just been made
+        rng = np.load(rng_path)
+        np.random.set_state(('MT19937', rng['keys'], int(rng['pos']), int(rng['has_gauss']), float(rng['cached_gaussian'])))
+    return arrays
+
+
+def save_preprocessed(entry, arrays, rng_state=None):
+    tmp = '%s.tmp%d' % (entry, os.getpid())
+    try:
+        os.makedirs(tmp)
+        for name, a in zip(SPLITS, arrays):
+            if sp.issparse(a):
+                sp.save_npz(os.path.join(tmp, name + '.npz'), a)
+            else:
+                np.save(os.path.join(tmp, name + '.npy'), a)
+        if rng_state is not None:
+            np.savez(os.path.join(tmp, 'rng_state.npz'), keys=rng_state[1], pos=rng_state[2],
+                     has_gauss=rng_state[3], cached_gaussian=rng_state[4])
+        # Renamed in one step, concurrent runs never see a partial entry
+        os.replace(tmp, entry)
+    except OSError as e:
+        # the entry can also have been written by a concurrent run in the meantime
+        if not os.path.isdir(entry):
+            print("Not caching", entry, e)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cached_preprocess(dset_name, datadir, sparse, variant, seed, make, cache):
+    if not cache:
+        return make()
+    spec = DATASETS[dset_name]
+    key = preprocessed_key(dset_name, spec, datadir, sparse, variant, seed)
+    entry = os.path.join(datadir, 'preprocessed', '%s.%s.%s' % (dset_name, variant, key[:16]))
+    arrays = load_preprocessed(entry)
+    if arrays is None:
+        arrays = make()
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        save_preprocessed(entry, arrays, None if variant == 'base' else np.random.get_state())
+    return arrays
+
+
+def load_dataset_custom (datadir, dset_name,feature,isnumpy=True,sparse=False,seed=None,cache=True):
+    """Train/val/test splits of a dataset registered in DATASETS, preprocessed as its spec
+    says. feature 'classimb' / 'noise' gives the class imbalanced / noisy label variant
+    made with numpy seed `seed` (default: the seed of the spec, if not there the
+    variant comes from the current numpy RNG state and is not cached).
+    sparse: CSR features for the libsvm datasets."""
+    spec = DATASETS[dset_name]
+    data_dims, num_cls = spec['dims'], spec['num_cls']
+    sparse = sparse and spec['format'] == 'libsvm'
+    if seed is None:
+        seed = spec['seed']
+    if seed is not None:
+        np.random.seed(seed)
+
+    base = lambda: preprocess_dataset(datadir, spec, sparse)
+    x_trn, y_trn, x_val, y_val, x_tst, y_tst = cached_preprocess(dset_name, datadir, sparse, 'base', None, base, cache)
+
+    if feature == 'classimb':
+        make = lambda: create_imbalance(x_trn, y_trn, x_val, y_val, x_tst, y_tst, num_cls)
+    elif feature == 'noise':
+        make = lambda: (x_trn, create_noisy(y_trn, num_cls), x_val, y_val, x_tst, y_tst)
+    if feature in ('classimb', 'noise'):
+        variant = '%s.s%d' % (feature, seed) if seed is not None else feature
+        x_trn, y_trn, x_val, y_val, x_tst, y_tst = cached_preprocess(dset_name, datadir, sparse, variant, seed, make,
+                                                                      cache and seed is not None)
+
+    if isnumpy:
+        fullset = (x_trn, y_trn)
+        valset = (x_val, y_val)
+        testset = (x_tst, y_tst)
+
+    else:
+        fullset = CustomDataset(x_trn, y_trn)
+        valset = CustomDataset(x_val, y_val)
+        testset = CustomDataset(x_tst, y_tst)
+
+    return fullset, valset, testset, data_dims,num_cls
+
+
+def load_tiled_dataset(datadir, dset_name, repeat=1, noise=0.05, seed=42):
+    """x_trn, y_trn, x_val, y_val (float / long tensors), num_fea, num_cls of the 'dss'
+    splits of dset_name in os.path.join(datadir, dset_name), for the report scripts.
+    The training set is tiled `repeat` times, every copy after the first with
+    N(0, noise^2) added, for larger ground sets. Seeds torch and numpy first."""
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    fullset, valset, testset, num_fea, num_cls = load_dataset_custom(os.path.join(datadir, dset_name), dset_name, 'dss')
+    x_trn, y_trn = torch.from_numpy(fullset[0]).float(), torch.from_numpy(fullset[1]).long()
+    x_val, y_val = torch.from_numpy(valset[0]).float(), torch.from_numpy(valset[1]).long()
+    if repeat > 1:
+        x_trn = torch.cat([x_trn] + [x_trn + noise * torch.randn_like(x_trn) for _ in range(repeat - 1)])
+        y_trn = y_trn.repeat(repeat)
+    return x_trn, y_trn, x_val, y_val, num_fea, num_cls
 
 
 def load_mnist_cifar (datadir, dset_name,feature):
@@ -725,7 +592,9 @@ def load_mnist_cifar (datadir, dset_name,feature):
             torchvision.transforms.Normalize((0.1307,), (0.3081,))
         ])
         num_cls = 10
-        fullset = torchvision.datasets.MNIST(root='./data', train=True, download=True, transform=mnist_transform)
+        mnist_mean, mnist_std = (0.1307,), (0.3081,)
+        fullset = NormalizedImageDataset(torchvision.datasets.MNIST(root='./data', train=True, download=True,
+                                                                    transform=mnist_transform), mnist_mean, mnist_std)
         
         if feature=='classimb':
             samples_per_class = torch.zeros(num_cls)
@@ -747,8 +616,10 @@ def load_mnist_cifar (datadir, dset_name,feature):
                     subset_idxs.extend(batch_subset_idxs)
             fullset = torch.utils.data.Subset(fullset, subset_idxs)
         
-        valset = torchvision.datasets.MNIST(root='./data', train=True, download=True, transform=mnist_val_transform)
-        testset = torchvision.datasets.MNIST(root='./data', train=False, download=True, transform=mnist_transform)
+        valset = NormalizedImageDataset(torchvision.datasets.MNIST(root='./data', train=True, download=True,
+                                                                   transform=mnist_val_transform), mnist_mean, mnist_std)
+        testset = NormalizedImageDataset(torchvision.datasets.MNIST(root='./data', train=False, download=True,
+                                                                    transform=mnist_transform), mnist_mean, mnist_std)
         
         return fullset, valset, testset, num_cls
     
@@ -762,9 +633,13 @@ def load_mnist_cifar (datadir, dset_name,feature):
             transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
         ])
         num_cls = 10
-        fullset = torchvision.datasets.CIFAR10(root='../data', train=True, download=True, transform=cifar_transform)
-        valset = torchvision.datasets.CIFAR10(root='../data', train=True, download=True, transform=cifar_val_transform)
-        testset = torchvision.datasets.CIFAR10(root='../data', train=False, download=True, transform=cifar_transform)
+        cifar_mean, cifar_std = (0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)
+        fullset = NormalizedImageDataset(torchvision.datasets.CIFAR10(root='../data', train=True, download=True,
+                                                                      transform=cifar_transform), cifar_mean, cifar_std)
+        valset = NormalizedImageDataset(torchvision.datasets.CIFAR10(root='../data', train=True, download=True,
+                                                                     transform=cifar_val_transform), cifar_mean, cifar_std)
+        testset = NormalizedImageDataset(torchvision.datasets.CIFAR10(root='../data', train=False, download=True,
+                                                                      transform=cifar_transform), cifar_mean, cifar_std)
         if feature == 'classimb':
             samples_per_class = torch.zeros(num_cls)
             for i in range(num_cls):
@@ -0,0 +1,73 @@
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+from models.last_layer_grads import index_batch, unwrap_subsets
+
+
+## Persistent loader over the selected subset for the training loops of the drivers.
+## They used to build DataLoader(trainset, sampler=SubsetRandomSampler(idxs),
+## num_workers=1, pin_memory=True) again after every selection, respawning the worker
+## and collating item by item. Here set_indices swaps the subset in place and every
+## batch is one index_batch gather: one fancy index for the pre-transformed image
+## sets of load_mnist_cifar and TensorDatasets, which stay on whatever device their
+## tensors are on (NormalizedImageDataset.to(device)).
+## For CRAIG the per element weights (gamma) travel with the indices, see
+## weighted_batches and weighted_cross_entropy.
+
+
+def weighted_cross_entropy(outputs, targets, weights):
+    # sum_i weights_i * CE(outputs_i, targets_i), the CRAIG training loss of a batch
+    return torch.dot(weights, F.cross_entropy(outputs, targets, reduction='none'))
+
+
+class SubsetBatchLoader(object):
+    """(inputs, targets) batches of dataset[idxs], the subset reshuffled every epoch.
+    Batches come in the same order as with DataLoader(dataset, batch_size,
+    sampler=SubsetRandomSampler(idxs)) under the same torch seed.
+
+    weights (one per element of idxs) are given back by weighted_batches. With
+    `importance` every epoch instead draws len(idxs) elements with replacement,
+    with probability proportional to their weight, and gives all of them the weight
+    sum(weights) / len(idxs): the weighted loss stays unbiased."""
+
+    def __init__(self, dataset, idxs, batch_size, shuffle=True, weights=None, importance=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.importance = importance
+        self.set_indices(idxs, weights)
+
+    def set_indices(self, idxs, weights=None):
+        # kept as ids of the dataset under any Subset / random_split wrappers
+        self.base_dataset, base_idxs = unwrap_subsets(self.dataset, np.asarray(idxs, dtype=np.int64))
+        self.idxs = torch.as_tensor(base_idxs)
+        self.weights = None if weights is None else torch.as_tensor(np.asarray(weights, dtype=np.float32))
+        if self.importance and self.weights is None:
+            raise ValueError("importance sampling needs the weights of the subset")
+
+    def __len__(self):
+        return math.ceil(len(self.idxs) / self.batch_size)
+
+    def weighted_batches(self):
+        """(inputs, targets, weights) batches, weights None when the loader has none."""
+        n = len(self.idxs)
+        weights = self.weights
+        if self.importance:
+            pos = torch.multinomial(self.weights, n, replacement=True)
+            weights = torch.full((n,), float(self.weights.sum()) / n)
+        elif self.shuffle:
+            # DataLoader draws its base seed before the sampler's randperm, keep the torch RNG in step
+            torch.empty((), dtype=torch.int64).random_()
+            pos = torch.randperm(n)
+            weights = None if weights is None else weights[pos]
+        else:
+            pos = torch.arange(n)
+        order = self.idxs[pos].numpy()
+        for start in range(0, n, self.batch_size):
+            inputs, targets = index_batch(self.base_dataset, order[start:start + self.batch_size])
+            yield inputs, targets, None if weights is None else weights[start:start + self.batch_size]
+
+    def __iter__(self):
+        for inputs, targets, _ in self.weighted_batches():
+            yield inputs, targets